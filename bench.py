@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+from convert_code import convert_file
+from converters import CodeConverter, create_converter
+from converters.timing import StageTimer
+from converters.metrics import MetricsCollector
+
+
+def run_benchmark(converter: CodeConverter, source_files: list[Path], output_dir: Path, workers: int = 1,
+                  pack_tokens: int | None = None) -> dict:
+    """
+    Convert the given source files, measuring the throughput and the time spent in each stage of the pipeline
+
+    Parameters
+    ----------
+    converter : Converter to use for converting the code (usually a replay or synthetic converter)
+    source_files : Source files to convert
+    output_dir : Directory where the converted / non-converted code is written
+    workers : Maximum number of routines to be converted concurrently within each file
+    pack_tokens : Maximum number of input tokens of the small routines packed in a single request, if any
+
+    Returns
+    -------
+    The benchmark results, which can be serialized as JSON
+    """
+    converter.tracer = StageTimer()
+    metrics = MetricsCollector()
+    total_converted, total_failed = 0, 0
+    start = time.perf_counter()
+    for source_file in source_files:
+        n_converted, n_failed = convert_file(converter, source_file,
+                                             output_dir / source_file.with_suffix('.py').name,
+                                             output_dir / source_file.name,
+                                             workers=workers, metrics=metrics, pack_tokens=pack_tokens)
+        total_converted, total_failed = total_converted + n_converted, total_failed + n_failed
+    wall_time = time.perf_counter() - start
+
+    stages = converter.tracer.summary()
+    routine_latency = stages.pop('routine', {})
+    n_routines = total_converted + total_failed
+    run_metrics = metrics.summary()['run']
+    return {'fm_name': converter.fm_name,
+            'files': len(source_files),
+            'workers': workers,
+            'routines': n_routines,
+            'converted': total_converted,
+            'failed': total_failed,
+            'wall_time': wall_time,
+            'routines_per_second': n_routines / wall_time if wall_time > 0 else None,
+            'routine_latency': {key: routine_latency.get(key) for key in ('mean', 'p50', 'p95', 'p99', 'max')},
+            'seeds': stages.get('seed', {}).get('count', 0),
+            'chunks': stages.get('chunk', {}).get('count', 0),
+            'fm_calls': run_metrics['fm_calls'],
+            'input_tokens': run_metrics['input_tokens'],
+            'output_tokens': run_metrics['output_tokens'],
+            'saved_input_tokens': run_metrics['saved_input_tokens'],
+            'retries': run_metrics['retries'],
+            'stages': stages}
+
+
+def build_converter(args: argparse.Namespace) -> CodeConverter:
+    """
+    Create the converter requested in the command line
+    """
+    match args.command:
+        case 'synthetic':
+            return create_converter('synthetic', latency=args.latency, tokens_per_second=args.tokens_per_second,
+                                    jitter=args.jitter, failure_rate=args.failure_rate, seed=args.seed)
+        case 'replay':
+            # The recorded converter is only used to build the payloads and to extract the code
+            if args.endpoint_name is not None:
+                recorded = create_converter('codellama', sagemaker_endpoint=args.endpoint_name)
+            elif args.model_id.startswith('anthropic'):
+                recorded = create_converter('claude', model_id=args.model_id)
+            else:
+                recorded = create_converter('bedrock-llama', model_id=args.model_id)
+            return create_converter('replay', converter=recorded, cassette=args.cassette, latency=not args.no_latency)
+        case _:
+            raise RuntimeError('You should not be here...')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the conversion pipeline without calling the FM')
+    parser.add_argument('-s', '--sources_dir',
+                        help='Path to the directory containing the source files to be converted',
+                        type=Path, default='scripts')
+    parser.add_argument('-d', '--debug',
+                        action='store_true', help='Enable debugging')
+    parser.add_argument('-w', '--workers',
+                        help='Number of routines to be converted concurrently within each file',
+                        type=int, default=1)
+    parser.add_argument('-o', '--output',
+                        help='JSON file where the results are written (defaults to the standard output)',
+                        type=Path, default=None)
+    parser.add_argument('--no-partial-validation',
+                        action='store_true',
+                        help='Do not validate the partial code between chunks')
+    parser.add_argument('--compact_source',
+                        action='store_true',
+                        help='Compact the code before sending it to the FM')
+    parser.add_argument('--parallel_seeds',
+                        help='Number of conversion attempts (seeds) of each routine run at the same time (when '
+                             'replaying, it must match the recorded run, since it changes the sampling temperatures)',
+                        type=int, default=1)
+    parser.add_argument('--continuation_window',
+                        help='Number of lines of the converted code sent back to the FM when continuing it (when '
+                             'replaying, it must match the recorded run)',
+                        type=int, default=None)
+    parser.add_argument('--repair_attempts',
+                        help='Number of times the FM is asked to fix converted code that does not compile',
+                        type=int, default=1)
+    parser.add_argument('--pack_tokens',
+                        help='Pack consecutive small routines in a single request of up to this number of input tokens',
+                        type=int, default=None)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    synthetic = subparsers.add_parser('synthetic', help='Use a simulated FM with a synthetic latency')
+    synthetic.add_argument('--latency',
+                           help='Mean time to first token of each FM call, in seconds',
+                           type=float, default=0.5)
+    synthetic.add_argument('--tokens_per_second',
+                           help='Generation speed of the simulated FM (instant generation if not set)',
+                           type=float, default=None)
+    synthetic.add_argument('--jitter',
+                           help='Standard deviation of the log-normal noise applied to the latency',
+                           type=float, default=0.0)
+    synthetic.add_argument('--failure_rate',
+                           help='Fraction of the generations that contain a syntax error',
+                           type=float, default=0.0)
+    synthetic.add_argument('--seed',
+                           help='Seed for the random number generator',
+                           type=int, default=0)
+    replay = subparsers.add_parser('replay', help='Replay the FM calls recorded with `convert_code.py --record`')
+    replay.add_argument('-c', '--cassette',
+                        help='Cassette file with the recorded FM calls',
+                        type=Path, required=True)
+    replay.add_argument('-m', '--model_id',
+                        help='Amazon Bedrock model used in the recorded run',
+                        default='anthropic.claude-3-sonnet-20240229-v1:0')
+    replay.add_argument('-e', '--endpoint-name',
+                        help='SageMaker endpoint used in the recorded run (instead of a Bedrock model)',
+                        default=None)
+    replay.add_argument('--no-latency',
+                        action='store_true', help='Return the recorded responses without waiting')
+    args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('The number of workers must be at least 1')
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
+
+    converter = build_converter(args)
+    converter.validate_partial_code = not args.no_partial_validation
+    converter.compact_source = args.compact_source
+    converter.parallel_seeds = args.parallel_seeds
+    converter.continuation_window = args.continuation_window
+    converter.repair_attempts = args.repair_attempts
+    source_files = sorted(args.sources_dir.glob('*.pkb'))
+    if not source_files:
+        raise ValueError(f'Could not find any source file in {args.sources_dir}')
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        results = run_benchmark(converter, source_files, Path(output_dir), workers=args.workers,
+                                pack_tokens=args.pack_tokens)
+    results['command'] = sys.argv[1:]
+
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        args.output.write_text(json.dumps(results, indent=2) + '\n')
@@ -1,18 +1,132 @@
 #!/usr/bin/env python3
 
-import re
+import time
 import logging
+import contextvars
+import argparse
+import multiprocessing
 from pathlib import Path
-from converters import CodeConverter
+from contextlib import nullcontext
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from converters import CodeConverter, create_converter
+from converters.cache import ConversionCache
+from converters.budget import TokenBudget
+from converters.retry import get_circuit_breaker
+from converters.hedging import get_hedging_policy
+from converters.clients import configure_clients
+from converters.ratelimit import get_rate_limiter
+from converters.journal import ConversionJournal
+from converters.splitter import split_routines
+from converters.tracing import FileTracer
+from converters.metrics import ConversionMetrics, MetricsCollector
 from converters.exceptions import ConversionError
-from converters import BedrockLlamaConverter, ClaudeConverter, CodeLlamaConverter
 
 
-def convert_file(converter: CodeConverter, source_file: Path, output_file: Path, errors_file: Path) -> None:
+def convert_routine(converter: CodeConverter, routine_code: str, cache: ConversionCache | None = None,
+                    metrics: ConversionMetrics | None = None) -> str | None:
+    """
+    Try to convert a single routine
+
+    Parameters
+    ----------
+    converter : Converter to use for converting the code
+    routine_code : PL/SQL code for the procedure / function to convert
+    cache : Cache to look up previous conversions in and to store new conversions into, if any
+    metrics : Metrics where the conversion of the routine is recorded, if any
+
+    Returns
+    -------
+    The converted code or `None` if the routine could not be converted
+    """
+    logging.debug(f'Converting code: {routine_code}')
+    routine_name = routine_code.split("\n")[0]
+    start = time.perf_counter()
+    if cache is not None:
+        key = converter.fingerprint(routine_code)
+        converted = cache.get(key)
+        if converted is not None:
+            logging.info(f'\t\tUsing cached conversion for {routine_name}')
+            if metrics is not None:
+                metrics.status, metrics.latency = ConversionMetrics.CACHED, time.perf_counter() - start
+            return converted
+    try:
+        logging.info(f'\t\tConverting {routine_name}')
+        with converter.tracer.span('routine', routine=routine_name, model=converter.fm_name):
+            converted = converter.convert(routine_code, metrics=metrics)
+    except ConversionError:
+        logging.info(f'\t\tFailed to convert procedure, failing...')
+        if metrics is not None:
+            metrics.status, metrics.latency = ConversionMetrics.FAILED, time.perf_counter() - start
+        return None
+    if metrics is not None:
+        metrics.status, metrics.latency = ConversionMetrics.CONVERTED, time.perf_counter() - start
+    if cache is not None:
+        cache.put(key, converter.fm_name, converted,
+                  metadata={'routine': routine_name, 'duration': time.perf_counter() - start})
+    return converted
+
+
+def convert_routines(converter: CodeConverter, routine_codes: list[str], cache: ConversionCache | None = None,
+                     metrics: list[ConversionMetrics | None] | None = None) -> list[str | None]:
+    """
+    Try to convert several small routines with a single FM request (see `CodeConverter.convert_batch`)
+
+    The routines that are already cached are not sent to the FM, and the routines that could not be converted
+    by the packed request are converted again on their own (see `convert_routine`).
+
+    Parameters
+    ----------
+    converter : Converter to use for converting the code
+    routine_codes : PL/SQL code for the procedures / functions to convert
+    cache : Cache to look up previous conversions in and to store new conversions into, if any
+    metrics : Metrics where the conversion of each routine is recorded, if any. The packed request is recorded
+              in the metrics of the first routine sent to the FM
+
+    Returns
+    -------
+    The converted code of each routine, or `None` for the routines that could not be converted
+    """
+    metrics = metrics or [None] * len(routine_codes)
+    converted: list[str | None] = [None] * len(routine_codes)
+    packed = [i for i, routine_code in enumerate(routine_codes)
+              if cache is None or cache.get(converter.fingerprint(routine_code)) is None]
+    if len(packed) > 1:
+        start = time.perf_counter()
+        logging.info(f'\t\tConverting {len(packed)} routines in a single request')
+        try:
+            with converter.tracer.span('packed_routines', routines=len(packed), model=converter.fm_name):
+                packed_code = converter.convert_batch([routine_codes[i] for i in packed], metrics=metrics[packed[0]])
+        except ConversionError:
+            logging.info(f'\t\tFailed to convert the packed routines, converting them one by one...')
+            packed_code = [None] * len(packed)
+        for i, code in zip(packed, packed_code):
+            if code is None:
+                continue
+            converted[i] = code
+            routine_name = routine_codes[i].split("\n")[0]
+            if metrics[i] is not None:
+                metrics[i].status, metrics[i].latency = ConversionMetrics.CONVERTED, time.perf_counter() - start
+            if cache is not None:
+                cache.put(converter.fingerprint(routine_codes[i]), converter.fm_name, code,
+                          metadata={'routine': routine_name, 'duration': time.perf_counter() - start})
+    # The cached routines and the ones that the packed request could not convert are converted on their own
+    for i, routine_code in enumerate(routine_codes):
+        if converted[i] is None:
+            converted[i] = convert_routine(converter, routine_code, cache, metrics[i])
+    return converted
+
+
+def convert_file(converter: CodeConverter, source_file: Path, output_file: Path, errors_file: Path,
+                 workers: int = 1, cache: ConversionCache | None = None,
+                 journal_file: Path | None = None, resume: bool = False,
+                 metrics: MetricsCollector | None = None, pack_tokens: int | None = None) -> tuple[int, int]:
     """
     Try to convert the functions in the given source file, one by one
 
-    The FM-provided code will be checked to see if it compiles.
+    The FM-provided code will be checked to see if it compiles. When more than one worker is
+    requested, routines are converted concurrently, but the results are still written in the
+    order in which they appear in the source file.
 
     Parameters
     ----------
@@ -20,37 +134,288 @@ def convert_file(converter: CodeConverter, source_file: Path, output_file: Path,
     source_file : Source file containing the Package Body definition
     output_file : File where the converted code should be dumped.
     errors_file: File where the code that could not be converted should be dumped
+    workers : Maximum number of routines to be converted concurrently
+    cache : Cache of previous conversions to use, if any
+    journal_file : File where the processed routines are journaled, if any
+    resume : Whether to reuse the routines journaled by a previous run instead of converting them again
+    metrics : Collector where the metrics of each converted routine are added, if any
+    pack_tokens : Maximum number of (estimated) input tokens of the consecutive small routines packed in a single
+                  FM request (see `convert_routines`), routines are converted one by one if not given
+
+    Returns
+    -------
+    The number of routines that were converted and the number of routines that could not be converted
     """
     logging.info(f'Processing {source_file} -> {output_file}')
-    package_source = source_file.read_text(errors='replace')
 
-    with output_file.open('wt') as conversions, errors_file.open('wt') as errors:
+    with converter.tracer.span('file', file=source_file.name, model=converter.fm_name) as file_span, \
+            output_file.open('wt') as conversions, errors_file.open('wt') as errors, \
+            ThreadPoolExecutor(max_workers=workers) as executor, \
+            (ConversionJournal(journal_file, resume=resume) if journal_file else nullcontext()) as journal:
         conversions.write('import cx_Oracle\n')
-        # Find procedures / functions using regular expressions
-        matches = re.findall('^(PROCEDURE|FUNCTION)(.*?)(^End;)',
-                             package_source,
-                             flags=re.MULTILINE | re.DOTALL | re.IGNORECASE)
-        for match in matches:
-            routine_code = ''.join(match)
-            logging.debug(f'Converting code: {routine_code}')
-            try:
-                routine_name = routine_code.split("\n")[0]
-                logging.info(f'\t\tConverting {routine_name}')
-                converted = converter.convert(routine_code)
-            except ConversionError:
-                logging.info(f'\t\tFailed to convert procedure, failing...')
-                errors.write(routine_code + '\n\n')
-                errors.flush()
+        n_routines, n_failed = 0, 0
+
+        def write_result(routine_code: str, result: Future | dict,
+                         routine_metrics: ConversionMetrics | None = None, index: int | None = None) -> None:
+            """
+            Write the conversion result (or the journaled result) of a routine to the corresponding file, `index`
+            being the position of the routine in its group if it was packed with others
+            """
+            nonlocal n_failed
+            routine_name = routine_code.split("\n")[0]
+            if isinstance(result, dict):
+                logging.info(f'\t\tReusing the journaled result for {routine_name}')
+                status, output = result['status'], result['output']
+            else:
+                converted = result.result() if index is None else result.result()[index]
+                if converted is None:
+                    status, output = ConversionJournal.FAILED, routine_code + '\n\n'
+                else:
+                    status, output = ConversionJournal.CONVERTED, converted.replace('import cx_Oracle', '') + '\n\n'
+
+            target = conversions if status == ConversionJournal.CONVERTED else errors
+            with converter.tracer.span('write', routine=routine_name, status=status):
+                offset = target.tell()
+                target.write(output)
+                target.flush()
+                if journal is not None:
+                    journal.record(routine_code, routine_name, status, offset, output)
+            if status == ConversionJournal.FAILED:
+                n_failed += 1
+            if metrics is not None and routine_metrics is not None:
+                metrics.add(source_file.name, routine_metrics)
+
+        # Routines are converted as soon as they are found. Only a few of them are kept in flight,
+        # and results are written in the order in which they were found, so the output keeps the source order
+        pending = deque()
+        # Consecutive small routines waiting to be packed in a single request, with their metrics
+        group, group_tokens = [], 0
+
+        def submit_group() -> None:
+            """
+            Send the group of small routines to the workers, packed in a single request if there's more than one
+            """
+            nonlocal group, group_tokens
+            if len(group) == 1:
+                pending.append((group[0][0],
+                                executor.submit(contextvars.copy_context().run, convert_routine,
+                                                converter, group[0][0], cache, group[0][1]),
+                                group[0][1]))
+            elif group:
+                packed = executor.submit(contextvars.copy_context().run, convert_routines, converter,
+                                         [routine_code for routine_code, _ in group], cache,
+                                         [routine_metrics for _, routine_metrics in group])
+                pending.extend((routine_code, packed, routine_metrics, i)
+                               for i, (routine_code, routine_metrics) in enumerate(group))
+            group, group_tokens = [], 0
+
+        routines = split_routines(source_file)
+        while True:
+            with converter.tracer.span('split'):
+                routine_code = next(routines, None)
+            if routine_code is None:
+                break
+            n_routines += 1
+            # Routines journaled in a previous run are reused, the rest are sent to the workers
+            record = journal.lookup(routine_code) if journal is not None else None
+            tokens = len(routine_code) // converter.CHARS_PER_TOKEN
+            if record is None and pack_tokens is not None and tokens <= pack_tokens:
+                if group_tokens + tokens > pack_tokens:
+                    submit_group()
+                group.append((routine_code, ConversionMetrics(routine_code.split("\n")[0], converter.fm_name)
+                              if metrics is not None else None))
+                group_tokens += tokens
                 continue
+            # The results are written in order, so the routines waiting to be packed are sent first
+            submit_group()
+            if record is None:
+                routine_metrics = ConversionMetrics(routine_code.split("\n")[0], converter.fm_name) \
+                    if metrics is not None else None
+                # The routine is converted in the current context, so its spans are nested in the file's span
+                pending.append((routine_code,
+                                executor.submit(contextvars.copy_context().run, convert_routine,
+                                                converter, routine_code, cache, routine_metrics),
+                                routine_metrics))
+            else:
+                pending.append((routine_code, record))
+            while len(pending) > 2 * workers:
+                write_result(*pending.popleft())
+        submit_group()
+        while pending:
+            write_result(*pending.popleft())
+        file_span.set_attribute('routines', n_routines)
+        file_span.set_attribute('failed', n_failed)
 
-            converted = converted.replace('import cx_Oracle', '')
-            conversions.write(converted + '\n\n')
-            conversions.flush()
+    return n_routines - n_failed, n_failed
 
 
-if __name__ == '__main__':
-    import argparse
+def create_backend_converter(backend: str) -> CodeConverter:
+    """
+    Create the converter for the given backend
+
+    Parameters
+    ----------
+    backend : Amazon Bedrock model ID, or `sagemaker:` followed by the name of a SageMaker endpoint
+
+    Returns
+    -------
+    The converter calling the backend
+    """
+    if backend.startswith('sagemaker:'):
+        return create_converter('codellama', sagemaker_endpoint=backend.removeprefix('sagemaker:'))
+    elif backend.startswith('anthropic'):
+        return create_converter('claude', model_id=backend)
+    elif backend.startswith('meta'):
+        return create_converter('bedrock-llama', model_id=backend)
+    # You should not be here, argparse shouldn't have let you
+    raise RuntimeError(f'Backend not supported: {backend}')
+
+
+def configure_converter(converter: CodeConverter, args: argparse.Namespace) -> CodeConverter:
+    """
+    Apply the options given in the command line to the converter of a backend
+
+    Parameters
+    ----------
+    converter : Converter calling the backend
+    args : Parsed command line arguments
+
+    Returns
+    -------
+    The configured converter (which is wrapped if the FM calls are recorded or replayed)
+    """
+    if args.record is not None:
+        converter = create_converter('replay', converter=converter, cassette=args.record, record=True)
+    elif args.replay is not None:
+        converter = create_converter('replay', converter=converter, cassette=args.replay,
+                                     latency=args.replay_latency)
+    converter.streaming = args.stream
+    converter.validate_partial_code = not args.no_partial_validation
+    converter.parallel_seeds = args.parallel_seeds
+    converter.repair_attempts = args.repair_attempts
+    converter.continuation_window = args.continuation_window
+    converter.compact_source = args.compact_source
+    converter.max_comment_length = args.max_comment_length
+    if not args.no_token_budget:
+        converter.token_budget = TokenBudget(args.sources_dir / '.cache' / 'token_budget.jsonl')
+    # The quotas are shared by all the processes, each of them gets an even share
+    converter.rate_limiter = get_rate_limiter(
+        converter.fm_name,
+        requests_per_minute=args.requests_per_minute / args.processes if args.requests_per_minute else None,
+        tokens_per_minute=args.tokens_per_minute / args.processes if args.tokens_per_minute else None,
+        # Each of the workers may have a request in flight per seed
+        initial_concurrency=args.workers * args.parallel_seeds)
+    converter.circuit_breaker = get_circuit_breaker(converter.fm_name,
+                                                    failure_threshold=args.circuit_breaker_failures,
+                                                    reset_timeout=args.circuit_breaker_timeout)
+    if args.hedging_quantile:
+        # Each request in flight (see `build_converter`) and its hedge run on their own thread
+        converter.hedging = get_hedging_policy(converter.fm_name, quantile=args.hedging_quantile,
+                                               budget=args.hedging_budget,
+                                               max_workers=2 * args.workers * args.parallel_seeds)
+    return converter
+
+
+def build_converter(args: argparse.Namespace) -> CodeConverter:
+    """
+    Create the converter requested in the command line
+
+    Parameters
+    ----------
+    args : Parsed command line arguments
 
+    Returns
+    -------
+    The converter to use for translating the code
+    """
+    # Each of the workers of the process may have a request in flight per seed (plus its hedge, if hedging)
+    configure_clients(max_pool_connections=args.workers * args.parallel_seeds * (2 if args.hedging_quantile else 1),
+                      connect_timeout=args.connect_timeout, read_timeout=args.read_timeout)
+    match args.command:
+        case 'bedrock':
+            backends = [args.model_id]
+        case 'sagemaker':
+            backends = [f'sagemaker:{args.endpoint_name}']
+        case 'cascade':
+            backends = args.tiers
+        case _:
+            raise RuntimeError('You should not be here...')
+
+    converters = [configure_converter(create_backend_converter(backend), args) for backend in backends]
+    converter = converters[0] if args.command != 'cascade' else create_converter('cascade', converters=converters)
+    if args.trace_file is not None:
+        # All the tiers of a cascade write to the same file
+        converter.tracer = FileTracer(args.trace_file)
+        for tier in converters:
+            tier.tracer = converter.tracer
+    return converter
+
+
+def build_cache(args: argparse.Namespace) -> ConversionCache | None:
+    """
+    Open the conversion cache requested in the command line, if any
+    """
+    if args.no_cache:
+        return None
+    return ConversionCache(args.cache_file or args.sources_dir / '.cache' / 'conversions.sqlite3',
+                           max_size=args.cache_max_mb * 1024 * 1024)
+
+
+def setup_logging(debug: bool) -> None:
+    """
+    Set the default logging configuration
+    """
+    logging.basicConfig()
+    if debug:
+        logging.getLogger().setLevel(logging.DEBUG)
+    else:
+        logging.getLogger().setLevel(logging.INFO)
+
+
+# Arguments, converter and cache used by each of the worker processes, created once per process by `_init_worker`
+_worker_args: argparse.Namespace | None = None
+_worker_converter: CodeConverter | None = None
+_worker_cache: ConversionCache | None = None
+
+
+def _init_worker(args: argparse.Namespace) -> None:
+    """
+    Initialize a worker process, creating its own converter (and backend clients)
+    """
+    global _worker_args, _worker_converter, _worker_cache
+    _worker_args = args
+    setup_logging(args.debug)
+    _worker_converter = build_converter(args)
+    _worker_cache = build_cache(args)
+
+
+def _convert_file_worker(task: tuple[Path, Path, Path, Path]) -> tuple[Path, int, int, list[dict] | None]:
+    """
+    Convert a single file in a worker process, returning the file name along with the conversion counts
+    and the metrics of its routines (if requested)
+    """
+    source_file, output_file, errors_file, journal_file = task
+    metrics = MetricsCollector() if _worker_args.metrics_file or _worker_args.prometheus_file else None
+    n_converted, n_failed = convert_file(_worker_converter, source_file, output_file, errors_file,
+                                         workers=_worker_args.workers, cache=_worker_cache,
+                                         journal_file=journal_file, resume=_worker_args.resume, metrics=metrics,
+                                         pack_tokens=_worker_args.pack_tokens)
+    return source_file, n_converted, n_failed, metrics.routines if metrics is not None else None
+
+
+def write_metrics(args: argparse.Namespace, metrics: MetricsCollector | None) -> None:
+    """
+    Export the metrics collected so far to the files requested in the command line, if any
+    """
+    if metrics is None:
+        return
+    if args.metrics_file is not None:
+        metrics.write_json(args.metrics_file)
+    if args.prometheus_file is not None:
+        metrics.write_prometheus(args.prometheus_file)
+
+
+if __name__ == '__main__':
     # Define the command line arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('-s', '--sources_dir',
@@ -58,6 +423,104 @@ if __name__ == '__main__':
                         type=Path, default='scripts')
     parser.add_argument('-d', '--debug',
                         action='store_true', help='Enable debugging')
+    parser.add_argument('-w', '--workers',
+                        help='Number of routines to be converted concurrently within each file',
+                        type=int, default=1)
+    parser.add_argument('-p', '--processes',
+                        help='Number of worker processes converting files in parallel',
+                        type=int, default=1)
+    parser.add_argument('-r', '--resume',
+                        action='store_true',
+                        help='Resume an interrupted run, skipping the routines that were already processed')
+    parser.add_argument('--cache_file',
+                        help='SQLite file caching previous conversions '
+                             '(defaults to [SOURCES_DIR]/.cache/conversions.sqlite3)',
+                        type=Path, default=None)
+    parser.add_argument('--cache_max_mb',
+                        help='Maximum size of the conversion cache in MB, least recently used entries are evicted',
+                        type=int, default=512)
+    parser.add_argument('--no-cache',
+                        action='store_true', help='Do not read nor write the conversion cache')
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help='Stream the model output, stopping as soon as the converted code is complete')
+    parser.add_argument('--requests_per_minute',
+                        help='Maximum number of requests per minute sent to the backend (e.g. your quota)',
+                        type=int, default=None)
+    parser.add_argument('--tokens_per_minute',
+                        help='Maximum number of tokens per minute sent to the backend (e.g. your quota)',
+                        type=int, default=None)
+    parser.add_argument('--circuit_breaker_failures',
+                        help='Number of consecutive backend failures after which all the requests are paused',
+                        type=int, default=5)
+    parser.add_argument('--circuit_breaker_timeout',
+                        help='Time (in seconds) to pause the requests once the backend is considered down',
+                        type=float, default=30.0)
+    parser.add_argument('--parallel_seeds',
+                        help='Number of conversion attempts (seeds) of each routine run at the same time, each with '
+                             'a different temperature, using the first one that compiles',
+                        type=int, default=1)
+    parser.add_argument('--pack_tokens',
+                        help='Pack consecutive small routines in a single request of up to this number of input '
+                             'tokens (estimated), instead of sending a request per routine',
+                        type=int, default=None)
+    parser.add_argument('--compact_source',
+                        help='Remove banner comments, licence headers and redundant whitespace from the code before '
+                             'sending it to the model',
+                        action='store_true')
+    parser.add_argument('--max_comment_length',
+                        help='Shorten the comments longer than this number of characters when compacting the code '
+                             '(see --compact_source), putting their full text back into the converted code',
+                        type=int, default=None)
+    parser.add_argument('--continuation_window',
+                        help='Number of lines of the converted code sent back to the model when continuing it, along '
+                             'with an outline of the rest of the code (by default the whole code is sent)',
+                        type=int, default=None)
+    parser.add_argument('--repair_attempts',
+                        help='Number of times the model is asked to fix converted code that does not compile before '
+                             'converting the routine again from scratch',
+                        type=int, default=1)
+    parser.add_argument('--hedging_quantile',
+                        help='Send a request again if it has not returned after this quantile of the recent '
+                             'latencies (e.g. 0.95), using whichever copy finishes first',
+                        type=float, default=None)
+    parser.add_argument('--hedging_budget',
+                        help='Maximum fraction of the requests that can be sent again when hedging',
+                        type=float, default=0.05)
+    parser.add_argument('--connect_timeout',
+                        help='Time (in seconds) to wait for a connection to the backend to be established',
+                        type=float, default=60.0)
+    parser.add_argument('--read_timeout',
+                        help='Time (in seconds) to wait for the response of the backend once a request is sent',
+                        type=float, default=60.0)
+    parser.add_argument('--no-token-budget',
+                        action='store_true',
+                        help='Always request the maximum number of output tokens instead of predicting '
+                             'the tokens needed from previous conversions')
+    parser.add_argument('--no-partial-validation',
+                        action='store_true',
+                        help='Generate all the chunks of the converted code before checking its syntax, instead '
+                             'of abandoning the generation as soon as the partial code is invalid')
+    parser.add_argument('--record',
+                        help='Record the FM calls to the given cassette file, so the run can be replayed later',
+                        type=Path, default=None)
+    parser.add_argument('--replay',
+                        help='Replay the FM calls recorded in the given cassette file instead of calling the FM',
+                        type=Path, default=None)
+    parser.add_argument('--replay_latency',
+                        action='store_true',
+                        help='When replaying, wait for the recorded duration of each FM call')
+    parser.add_argument('--trace_file',
+                        help='File where the spans of each conversion stage are appended, in the OpenTelemetry '
+                             '(OTLP) JSON format',
+                        type=Path, default=None)
+    parser.add_argument('--metrics_file',
+                        help='JSON file where the metrics of the run (FM calls, tokens, retries...) are written',
+                        type=Path, default=None)
+    parser.add_argument('--prometheus_file',
+                        help='File where the metrics of the run are written in the Prometheus text format '
+                             '(e.g. for the node exporter\'s textfile collector)',
+                        type=Path, default=None)
     subparsers = parser.add_subparsers(dest='command')
     subparsers.required = True
     bedrock = subparsers.add_parser('bedrock', help='Convert the code with Amazon Bedrock')
@@ -72,29 +535,38 @@ if __name__ == '__main__':
     sagemaker.add_argument('-e', '--endpoint-name',
                            help='Name of the CodeLlama-Instruct backed SageMaker Endpoint to use for querying',
                            default='codellama-13b')
+    cascade = subparsers.add_parser('cascade',
+                                    help='Convert each routine with the first of several backends that succeeds')
+    cascade.add_argument('-t', '--tiers',
+                         help='Backends to try for each routine, in order (usually from the cheapest to the best): '
+                              'Amazon Bedrock model IDs, or SageMaker endpoints as sagemaker:[ENDPOINT NAME]',
+                         nargs='+', required=True)
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('The number of workers must be at least 1')
+    if args.continuation_window is not None and args.continuation_window < 1:
+        parser.error('The continuation window must be at least 1 line')
+    if args.pack_tokens is not None and args.pack_tokens < 1:
+        parser.error('The number of tokens of the packed requests must be at least 1')
+    if args.max_comment_length is not None and not args.compact_source:
+        parser.error('--max_comment_length requires --compact_source')
+    if args.parallel_seeds < 1:
+        parser.error('The number of parallel seeds must be at least 1')
+    if args.processes < 1:
+        parser.error('The number of processes must be at least 1')
+    if args.command == 'cascade':
+        for backend in args.tiers:
+            if not backend.startswith(('anthropic', 'meta', 'sagemaker:')):
+                parser.error(f'Backend not supported: {backend}')
+    if args.hedging_quantile is not None and not 0 < args.hedging_quantile < 1:
+        parser.error('The hedging quantile must be between 0 and 1')
+    if args.record is not None and args.replay is not None:
+        parser.error('Calls can\'t be recorded and replayed at the same time')
 
-    # Set the default logging configuration
-    logging.basicConfig()
-    if args.debug:
-        logging.getLogger().setLevel(logging.DEBUG)
-    else:
-        logging.getLogger().setLevel(logging.INFO)
+    setup_logging(args.debug)
 
     # Create the converter, translate the code
-    match args.command:
-        case 'bedrock':
-            if args.model_id.startswith('anthropic'):
-                converter = ClaudeConverter(model_id=args.model_id)
-            elif args.model_id.startswith('meta'):
-                converter = BedrockLlamaConverter(model_id=args.model_id)
-            else:
-                # You should not be here, argparse shouldn't have let you
-                raise RuntimeError('Model ID not supported')
-        case 'sagemaker':
-            converter = CodeLlamaConverter(sagemaker_endpoint=args.endpoint_name)
-        case _:
-            raise RuntimeError('You should not be here...')
+    converter = build_converter(args)
 
     # Loop through the files in the data directory, process them separately
     if not args.sources_dir.is_dir():
@@ -103,10 +575,38 @@ if __name__ == '__main__':
     output_dir.mkdir(exist_ok=True, parents=True)
     errors_dir = args.sources_dir / 'non-converted' / converter.fm_name
     errors_dir.mkdir(exist_ok=True, parents=True)
+    journal_dir = args.sources_dir / '.cache' / 'journal' / converter.fm_name
 
     logging.info(f'Using {args.command} - {converter.fm_name} to convert the code')
 
-    for file in sorted(args.sources_dir.glob('*.pkb')):
-        convert_file(converter, file,
-                     output_dir / file.with_suffix('.py').name,
-                     errors_dir / file.name)
+    tasks = [(file, output_dir / file.with_suffix('.py').name, errors_dir / file.name,
+              journal_dir / file.with_suffix('.jsonl').name)
+             for file in sorted(args.sources_dir.glob('*.pkb'))]
+    total_converted, total_failed = 0, 0
+    # The metrics are exported again after each file, so they can be monitored during the run
+    metrics = MetricsCollector() if args.metrics_file or args.prometheus_file else None
+    if args.processes == 1:
+        cache = build_cache(args)
+        for source_file, output_file, errors_file, journal_file in tasks:
+            n_converted, n_failed = convert_file(converter, source_file, output_file, errors_file,
+                                                 workers=args.workers, cache=cache,
+                                                 journal_file=journal_file, resume=args.resume, metrics=metrics,
+                                                 pack_tokens=args.pack_tokens)
+            total_converted, total_failed = total_converted + n_converted, total_failed + n_failed
+            write_metrics(args, metrics)
+    else:
+        # Each worker process builds its own converter and takes files from the pool's queue
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(args.processes, initializer=_init_worker, initargs=(args,)) as pool:
+            for n_files, (source_file, n_converted, n_failed, file_metrics) in enumerate(
+                    pool.imap_unordered(_convert_file_worker, tasks), start=1):
+                total_converted, total_failed = total_converted + n_converted, total_failed + n_failed
+                if metrics is not None:
+                    metrics.extend(file_metrics)
+                    write_metrics(args, metrics)
+                logging.info(f'[{n_files}/{len(tasks)}] {source_file.name}: {n_converted} converted, '
+                             f'{n_failed} failed')
+
+    converter.tracer.close()
+    logging.info(f'Finished converting {len(tasks)} files: {total_converted} routines converted, '
+                 f'{total_failed} failed')
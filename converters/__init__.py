@@ -1,4 +1,20 @@
 from .base import CodeConverter
-from .claude import ClaudeConverter
-from .llama_instruct import BedrockLlamaConverter
-from .codellama_instruct import CodeLlamaConverter
+from .registry import create_converter, get_converter_class, register_converter
+
+# Converter classes exported by the package, imported on first access (see `registry`)
+_LAZY_CONVERTERS = {'ClaudeConverter': 'claude',
+                    'BedrockLlamaConverter': 'bedrock-llama',
+                    'CodeLlamaConverter': 'codellama',
+                    'ReplayConverter': 'replay',
+                    'SyntheticConverter': 'synthetic',
+                    'CascadeConverter': 'cascade'}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_CONVERTERS:
+        return get_converter_class(_LAZY_CONVERTERS[name])
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def __dir__() -> list[str]:
+    return sorted([*globals(), *_LAZY_CONVERTERS])
@@ -1,11 +1,80 @@
+import json
+import time
+import asyncio
+import hashlib
 import logging
-from converters.exceptions import BackendTimeoutError, ConversionError, OutputTooLongException
+import weakref
+import functools
+import threading
+import contextvars
+from collections.abc import Generator
+from concurrent import futures
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from converters.budget import TokenBudget
+from converters.ratelimit import RateLimiter
+from converters.retry import CircuitBreaker, RetryPolicy
+from converters.hedging import HedgingPolicy, cancellation_event, request_sent, run_cancellable
+from converters.tracing import Tracer
+from converters.metrics import ConversionMetrics
+from converters.validation import is_viable_prefix
+from converters.window import continuation_window, stitch
+from converters.compaction import CompactedSource, compact_source
+from converters.packing import split_packed_code
+from converters.exceptions import (BackendTimeoutError, ConversionError, InvalidCodeError, OutputTooLongException,
+                                   RequestCancelledError, RetriesExhaustedError, SeedsExhaustedError,
+                                   ThrottlingError)
 
 
 class CodeConverter:
     MAX_NEW_TOKENS = 1024
+    # Maximum number of requests that `aconvert` will keep in flight at the same time
+    MAX_IN_FLIGHT_REQUESTS = 16
+    # Maximum number of times a throttled request is sent again when using a rate limiter
+    MAX_THROTTLING_RETRIES = 8
+    # Rough number of characters per token, used to estimate the size of the requests
+    CHARS_PER_TOKEN = 4
+    # Sampling temperature of the first seed, and increase for each of the seeds run in parallel
+    TEMPERATURE = 0.2
+    SEED_TEMPERATURE_STEP = 0.2
+    # Output tokens requested to repair converted code, relative to the (estimated) tokens of the code, plus a margin
+    REPAIR_OUTPUT_RATIO = 1.5
+    REPAIR_MIN_TOKENS = 128
 
-    def convert(self, original_code: str, max_seeds: int = 3, max_conversion_chunks: int = 4, max_retries: int = 3):
+    def __init__(self):
+        # Thread pool and per-event loop semaphores used by `aconvert`, created on first use
+        self._async_executor: ThreadPoolExecutor | None = None
+        self._semaphores: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        # Model used to choose the number of output tokens to request, `MAX_NEW_TOKENS` is used if not set
+        self.token_budget: TokenBudget | None = None
+        # Rate limiter for the backend (usually shared with other converters), requests are not limited if not set
+        self.rate_limiter: RateLimiter | None = None
+        # Whether to stream the FM output, stopping as soon as the code block is complete
+        self.streaming = False
+        # Whether to check the partial code (while streaming and between chunks), abandoning the seed as soon
+        # as it's invalid instead of generating the remaining chunks
+        self.validate_partial_code = True
+        # Tracer producing spans for the stages of the conversion, which does nothing by default
+        self.tracer: Tracer = Tracer()
+        # Policy deciding whether (and when) failed requests are retried
+        self.retry_policy = RetryPolicy()
+        # Circuit breaker for the backend (usually shared with other converters), not used if not set
+        self.circuit_breaker: CircuitBreaker | None = None
+        # Policy hedging the slowest requests (usually shared with other converters), not used if not set
+        self.hedging: HedgingPolicy | None = None
+        # Number of seeds run at the same time by `convert`, seeds are run one after the other by default
+        self.parallel_seeds = 1
+        # Number of lines of the converted code sent back to the FM to be continued (along with an outline of the
+        # rest of the code), the whole code is sent if not set
+        self.continuation_window: int | None = None
+        # Number of times the FM is asked to fix converted code that doesn't compile before retrying the conversion
+        self.repair_attempts = 1
+        # Whether the code is compacted before being sent to the FM (see `compaction.compact_source`), and the
+        # maximum length of its comments (they are not shortened if not set)
+        self.compact_source = False
+        self.max_comment_length: int | None = None
+
+    def convert(self, original_code: str, max_seeds: int = 3, max_conversion_chunks: int = 4, max_retries: int = 3,
+                metrics: ConversionMetrics | None = None, parallel_seeds: int | None = None):
         """
         Convert the given code block
 
@@ -24,20 +93,556 @@ class CodeConverter:
                                 be performed in chunks. This parameter identifies the maximum number of chunks that
                                 are allowed per function.
         max_retries : Maximum number of retries in case of FM failure (per conversion chunk)
+        metrics : Metrics where the FM calls, seeds, chunks and retries of the conversion are recorded, if any
+        parallel_seeds : Number of seeds run at the same time (each with a different temperature), the first
+                         one producing code that compiles is used. Defaults to `parallel_seeds` of the converter
 
         Returns
         -------
         Model output, which will include free-form text and should also include a code block.
         """
+        source = self._compact(original_code, metrics)
+        parallel_seeds = self.parallel_seeds if parallel_seeds is None else parallel_seeds
+        if parallel_seeds > 1 and max_seeds > 1:
+            return source.restore(self._convert_parallel(source.code, max_seeds, max_conversion_chunks, max_retries,
+                                                         metrics, parallel_seeds))
+        return source.restore(self._run_steps(
+            self._conversion_steps(source.code, max_seeds, max_conversion_chunks, max_retries, metrics), metrics))
+
+    async def aconvert(self, original_code: str, max_seeds: int = 3, max_conversion_chunks: int = 4,
+                       max_retries: int = 3, metrics: ConversionMetrics | None = None,
+                       parallel_seeds: int | None = None):
+        """
+        Convert the given code block without blocking the event loop
+
+        This is the asynchronous counterpart of `convert`, and follows exactly the same conversion process.
+        The FM requests are still blocking: they're run in a thread pool of `MAX_IN_FLIGHT_REQUESTS` threads
+        (see `_afm_eval`), which caps the number of requests in flight for this converter.
+
+        Parameters
+        ----------
+        original_code : Original code fragment
+        max_seeds : Maximum number of times the whole conversion process can be retried
+        max_conversion_chunks : Maximum number of iterations on the code generation task
+        max_retries : Maximum number of retries in case of FM failure (per conversion chunk)
+        metrics : Metrics where the FM calls, seeds, chunks and retries of the conversion are recorded, if any
+        parallel_seeds : Number of seeds run at the same time, see `convert`
+
+        Returns
+        -------
+        Model output, which will include free-form text and should also include a code block.
+        """
+        source = self._compact(original_code, metrics)
+        parallel_seeds = self.parallel_seeds if parallel_seeds is None else parallel_seeds
+        if parallel_seeds > 1 and max_seeds > 1:
+            return source.restore(await self._aconvert_parallel(source.code, max_seeds, max_conversion_chunks,
+                                                                max_retries, metrics, parallel_seeds))
+        return source.restore(await self._arun_steps(
+            self._conversion_steps(source.code, max_seeds, max_conversion_chunks, max_retries, metrics), metrics))
+
+    def convert_batch(self, original_codes: list[str], max_retries: int = 3,
+                      metrics: ConversionMetrics | None = None) -> list[str | None]:
+        """
+        Convert several (small) code blocks with a single FM request
+
+        The code blocks are packed in a single prompt, each of them preceded by a marker comment naming it, and
+        the FM is asked to convert each one to its own function preceded by the same marker (see `packing`). The
+        converted code is then split by those markers, and the code of each block is checked on its own. Since
+        there's a single request, there are no seeds nor chunks: the blocks whose code is missing, incomplete or
+        doesn't compile must be converted again on their own (e.g. with `convert`).
+
+        Parameters
+        ----------
+        original_codes : Original code fragments
+        max_retries : Maximum number of retries in case of FM failure
+        metrics : Metrics where the FM calls and retries of the packed request are recorded, if any
+
+        Returns
+        -------
+        The converted code of each block, or `None` for the blocks that could not be converted. All of them are
+        `None` if the converter doesn't support packing several code blocks in a request.
+        """
+        return self._run_steps(self._batch_steps(original_codes, max_retries, metrics), metrics)
+
+    async def aconvert_batch(self, original_codes: list[str], max_retries: int = 3,
+                             metrics: ConversionMetrics | None = None) -> list[str | None]:
+        """
+        Convert several (small) code blocks with a single FM request without blocking the event loop, see
+        `convert_batch`
+        """
+        return await self._arun_steps(self._batch_steps(original_codes, max_retries, metrics), metrics)
+
+    def _compacted(self, original_code: str) -> CompactedSource:
+        """
+        Return the code to be sent to the FM for the given original code, compacted if `compact_source` is set
+        """
+        if not self.compact_source:
+            return CompactedSource(original_code, len(original_code))
+        return compact_source(original_code, self.max_comment_length)
+
+    def _compact(self, original_code: str, metrics: ConversionMetrics | None = None) -> CompactedSource:
+        """
+        Compact the given code before converting it, recording the input tokens saved in each FM request
+        """
+        source = self._compacted(original_code)
+        saved_tokens = source.saved_characters // self.CHARS_PER_TOKEN
+        if saved_tokens > 0:
+            logging.info(f'\t\t\tCompacted the code, saving ~{saved_tokens} input tokens per request')
+        if metrics is not None:
+            metrics.saved_input_tokens = saved_tokens
+        return source
+
+    def _run_steps(self, steps: Generator, metrics: ConversionMetrics | None = None,
+                   cancel: threading.Event | None = None):
+        """
+        Run a conversion process (see `_conversion_steps`), evaluating its payloads with the FM
+
+        Parameters
+        ----------
+        steps : Conversion process
+        metrics : Metrics where the FM calls are recorded, if any
+        cancel : Event signaling that the result is no longer needed, in which case the process is stopped
+
+        Returns
+        -------
+        The result of the conversion process, or `None` if it was cancelled
+        """
+        # Consecutive failed requests, used to compute the backoff before retrying
+        failures = 0
+        try:
+            payload = next(steps)
+            while True:
+                if cancel is not None and cancel.is_set():
+                    steps.close()
+                    return None
+                try:
+                    with self.tracer.span('fm_call', model=self.fm_name):
+                        response = self._evaluate(payload, metrics)
+                except ConversionError as e:
+                    if cancel is not None and cancel.is_set():
+                        # The request was probably abandoned because of the cancellation, not a real failure
+                        continue
+                    failures += 1
+                    # The process is only delayed if it retries, i.e. if it doesn't give up with the error
+                    payload = steps.throw(e)
+                    delay = self.retry_policy.delay(e, failures)
+                    if delay > 0:
+                        logging.info(f'\t\t\tWaiting {delay:.1f}s before retrying')
+                        time.sleep(delay)
+                else:
+                    failures = 0
+                    payload = steps.send(response)
+        except StopIteration as result:
+            return result.value
+
+    async def _arun_steps(self, steps: Generator, metrics: ConversionMetrics | None = None):
+        """
+        Run a conversion process without blocking the event loop, see `_run_steps`
 
-        for _ in range(max_seeds):
+        The process is stopped if the task running it is cancelled.
+        """
+        failures = 0
+        try:
+            payload = next(steps)
+            while True:
+                try:
+                    async with self._in_flight_semaphore():
+                        with self.tracer.span('fm_call', model=self.fm_name):
+                            response = await self._aevaluate(payload, metrics)
+                except ConversionError as e:
+                    failures += 1
+                    # The process is only delayed if it retries, i.e. if it doesn't give up with the error
+                    payload = steps.throw(e)
+                    delay = self.retry_policy.delay(e, failures)
+                    if delay > 0:
+                        logging.info(f'\t\t\tWaiting {delay:.1f}s before retrying')
+                        await asyncio.sleep(delay)
+                else:
+                    failures = 0
+                    payload = steps.send(response)
+        except StopIteration as result:
+            return result.value
+        finally:
+            steps.close()
+
+    def _seed_temperature(self, seed: int) -> float:
+        """
+        Return the sampling temperature of a seed run in parallel with others, so the seeds produce different code
+        """
+        return min(self.TEMPERATURE + seed * self.SEED_TEMPERATURE_STEP, 1.0)
+
+    def _run_seed(self, original_code: str, seed: int, max_conversion_chunks: int, max_retries: int,
+                  metrics: ConversionMetrics | None, cancel: threading.Event) -> str | None:
+        """
+        Run a single seed of a parallel conversion, returning the converted code or `None` if the seed failed
+        """
+        if cancel.is_set():
+            return None
+        with self.tracer.span('seed', model=self.fm_name, seed=seed) as span:
+            code = run_cancellable(cancel, self._run_steps,
+                                   self._seed_steps(original_code, seed, max_conversion_chunks, max_retries,
+                                                    metrics, temperature=self._seed_temperature(seed)),
+                                   metrics, cancel)
+            span.set_attribute('converted', code is not None)
+        return code
+
+    def _convert_parallel(self, original_code: str, max_seeds: int, max_conversion_chunks: int, max_retries: int,
+                          metrics: ConversionMetrics | None, parallel_seeds: int) -> str:
+        """
+        Convert the given code running several seeds at the same time, see `convert`
+
+        The seeds that are still running once one of them succeeds are cancelled: they stop before their next
+        request, and their streamed requests (if any) are abandoned.
+        """
+        cancel = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=min(parallel_seeds, max_seeds),
+                                      thread_name_prefix=f'{type(self).__name__}-seed')
+        try:
+            # Each seed runs in a copy of the current context, so its spans are nested in the current span
+            seeds = [executor.submit(contextvars.copy_context().run, self._run_seed, original_code, seed,
+                                     max_conversion_chunks, max_retries, metrics, cancel)
+                     for seed in range(max_seeds)]
+            for seed in as_completed(seeds):
+                code = seed.result()
+                if code is not None:
+                    return code
+        finally:
+            # Don't wait for the cancelled seeds to stop
+            cancel.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+        raise SeedsExhaustedError('Could not convert the code, failing')
+
+    async def _aconvert_parallel(self, original_code: str, max_seeds: int, max_conversion_chunks: int,
+                                 max_retries: int, metrics: ConversionMetrics | None, parallel_seeds: int) -> str:
+        """
+        Convert the given code running several seeds at the same time without blocking the event loop, see
+        `_convert_parallel`
+        """
+        cancel = threading.Event()
+        limit = asyncio.Semaphore(parallel_seeds)
+
+        async def run_seed(seed: int) -> str | None:
+            async with limit:
+                with self.tracer.span('seed', model=self.fm_name, seed=seed) as span:
+                    steps = self._seed_steps(original_code, seed, max_conversion_chunks, max_retries, metrics,
+                                             temperature=self._seed_temperature(seed))
+                    code = await run_cancellable(cancel, self._arun_steps, steps, metrics)
+                    span.set_attribute('converted', code is not None)
+                return code
+
+        seeds = [asyncio.ensure_future(run_seed(seed)) for seed in range(max_seeds)]
+        try:
+            for seed in asyncio.as_completed(seeds):
+                code = await seed
+                if code is not None:
+                    return code
+        finally:
+            cancel.set()
+            for seed in seeds:
+                seed.cancel()
+        raise SeedsExhaustedError('Could not convert the code, failing')
+
+    def _evaluate(self, payload: dict, metrics: ConversionMetrics | None = None):
+        """
+        Eval the given payload with the FM, sending it again if it's too slow and there's a hedging policy
+
+        Each copy of a hedged request goes through the rate limiter and the circuit breaker on its own, so the
+        hedged requests are accounted for like any other request.
+        """
+        if self.hedging is None:
+            return self._limited_call(payload, metrics)
+        return self.hedging.call(self._limited_call, payload, metrics, on_hedge=self._hedge_callback(metrics))
+
+    async def _aevaluate(self, payload: dict, metrics: ConversionMetrics | None = None):
+        """
+        Eval the given payload with the FM without blocking the event loop, see `_evaluate`
+        """
+        if self.hedging is None:
+            return await self._alimited_call(payload, metrics)
+        return await self.hedging.acall(self._alimited_call, payload, metrics,
+                                        on_hedge=self._hedge_callback(metrics))
+
+    def _limited_call(self, payload: dict, metrics: ConversionMetrics | None = None):
+        """
+        Eval the given payload with the FM, waiting for the rate limiter (if any) before sending it
+
+        Requests throttled by the backend are sent again (once the rate limiter allows it) up to
+        `MAX_THROTTLING_RETRIES` times, without counting as a failed attempt of the conversion.
+        """
+        if self.rate_limiter is None:
+            return self._call_fm(payload, metrics)
+        estimated_tokens = self._estimate_tokens(payload)
+        for attempt in range(self.MAX_THROTTLING_RETRIES):
+            ticket = self.rate_limiter.acquire(estimated_tokens)
+            try:
+                response = self._call_fm(payload, metrics)
+            except ThrottlingError:
+                self.rate_limiter.release(ticket, tokens=0, throttled=True)
+                if attempt == self.MAX_THROTTLING_RETRIES - 1:
+                    raise
+                if metrics is not None:
+                    metrics.record_retry('throttled')
+                continue
+            except BaseException:
+                self.rate_limiter.release(ticket, failed=True)
+                raise
+            self.rate_limiter.release(ticket, tokens=self._used_tokens(response, estimated_tokens))
+            return response
+
+    async def _alimited_call(self, payload: dict, metrics: ConversionMetrics | None = None):
+        """
+        Eval the given payload with the FM without blocking the event loop, see `_limited_call`
+        """
+        if self.rate_limiter is None:
+            return await self._acall_fm(payload, metrics)
+        estimated_tokens = self._estimate_tokens(payload)
+        for attempt in range(self.MAX_THROTTLING_RETRIES):
+            ticket = await self.rate_limiter.aacquire(estimated_tokens)
+            try:
+                response = await self._acall_fm(payload, metrics)
+            except ThrottlingError:
+                self.rate_limiter.release(ticket, tokens=0, throttled=True)
+                if attempt == self.MAX_THROTTLING_RETRIES - 1:
+                    raise
+                if metrics is not None:
+                    metrics.record_retry('throttled')
+                continue
+            except BaseException:
+                self.rate_limiter.release(ticket, failed=True)
+                raise
+            self.rate_limiter.release(ticket, tokens=self._used_tokens(response, estimated_tokens))
+            return response
+
+    def _call_fm(self, payload: dict, metrics: ConversionMetrics | None = None):
+        """
+        Eval the given payload with the FM, recording the call in the given metrics (if any)
+
+        If there's a circuit breaker, the request waits until the breaker lets it through.
+        """
+        probe = self.circuit_breaker.acquire() if self.circuit_breaker is not None else False
+        cancel = cancellation_event()
+        if cancel is not None and cancel.is_set():
+            # Abandoned while waiting (e.g. a hedged request that lost the race), there's no need to send it
+            self._release_circuit_breaker(None, probe)
+            raise RequestCancelledError('The request is no longer needed')
+        request_sent()
+        start = time.perf_counter()
+        try:
+            response = self._fm_eval(payload)
+        except ConversionError as e:
+            self._release_circuit_breaker(
+                None if isinstance(e, RequestCancelledError) else self.retry_policy.is_outage(e), probe)
+            if metrics is not None:
+                metrics.record_call(time.perf_counter() - start, error=type(e).__name__)
+            raise
+        except (asyncio.CancelledError, futures.CancelledError):
+            # The request is no longer needed (e.g. a seed that lost the race), the backend didn't fail
+            self._release_circuit_breaker(None, probe)
+            raise
+        except BaseException:
+            self._release_circuit_breaker(True, probe)
+            raise
+        self._release_circuit_breaker(False, probe)
+        if metrics is not None:
+            self._record_fm_call(metrics, response, time.perf_counter() - start)
+        return response
+
+    async def _acall_fm(self, payload: dict, metrics: ConversionMetrics | None = None):
+        """
+        Eval the given payload with the FM without blocking the event loop, see `_call_fm`
+        """
+        probe = await self.circuit_breaker.aacquire() if self.circuit_breaker is not None else False
+        cancel = cancellation_event()
+        if cancel is not None and cancel.is_set():
+            # Abandoned while waiting (e.g. a hedged request that lost the race), there's no need to send it
+            self._release_circuit_breaker(None, probe)
+            raise RequestCancelledError('The request is no longer needed')
+        request_sent()
+        start = time.perf_counter()
+        try:
+            response = await self._afm_eval(payload)
+        except ConversionError as e:
+            self._release_circuit_breaker(
+                None if isinstance(e, RequestCancelledError) else self.retry_policy.is_outage(e), probe)
+            if metrics is not None:
+                metrics.record_call(time.perf_counter() - start, error=type(e).__name__)
+            raise
+        except (asyncio.CancelledError, futures.CancelledError):
+            # The request is no longer needed (e.g. a seed that lost the race), the backend didn't fail
+            self._release_circuit_breaker(None, probe)
+            raise
+        except BaseException:
+            self._release_circuit_breaker(True, probe)
+            raise
+        self._release_circuit_breaker(False, probe)
+        if metrics is not None:
+            self._record_fm_call(metrics, response, time.perf_counter() - start)
+        return response
+
+    @staticmethod
+    def _hedge_callback(metrics: ConversionMetrics | None):
+        """
+        Return the function recording a hedged request in the given metrics, if any
+        """
+        return functools.partial(metrics.record_retry, 'hedged') if metrics is not None else None
+
+    def _release_circuit_breaker(self, failed: bool | None, probe: bool) -> None:
+        """
+        Signal the end of a request to the circuit breaker, if any (`failed` being `None` if it was cancelled)
+        """
+        if self.circuit_breaker is None:
+            return
+        if failed is None:
+            self.circuit_breaker.cancel(probe)
+        else:
+            self.circuit_breaker.release(failed, probe)
+
+    def _record_fm_call(self, metrics: ConversionMetrics, response, latency: float) -> None:
+        """
+        Record a successful FM call in the given metrics
+        """
+        metrics.record_call(latency,
+                            input_tokens=self._input_tokens(response),
+                            output_tokens=self._output_tokens(response),
+                            stop_reason=self._stop_reason(response),
+                            time_to_first_token=self._time_to_first_token(response))
+
+    def _estimate_tokens(self, payload: dict) -> int:
+        """
+        Estimate the number of input tokens of the given payload
+        """
+        return len(json.dumps(payload)) // self.CHARS_PER_TOKEN
+
+    def _used_tokens(self, response, estimated_tokens: int) -> int:
+        """
+        Return the total (input + output) tokens used for the given response, using the estimated
+        input tokens if the backend doesn't report them
+        """
+        input_tokens, output_tokens = self._input_tokens(response), self._output_tokens(response)
+        return (estimated_tokens if input_tokens is None else input_tokens) + (output_tokens or 0)
+
+    def _conversion_steps(self, original_code: str, max_seeds: int, max_conversion_chunks: int,
+                          max_retries: int, metrics: ConversionMetrics | None = None) -> Generator[dict, dict, str]:
+        """
+        Conversion process, independent of the way in which the FM is called
+
+        This generator yields the payloads that must be evaluated by the FM and expects the FM response
+        to be sent back (or the raised `ConversionError` to be thrown into it). Its return value is the
+        converted code. See `convert` for a description of the parameters.
+        """
+        for seed in range(max_seeds):
+            with self.tracer.span('seed', model=self.fm_name, seed=seed) as span:
+                code = yield from self._seed_steps(original_code, seed, max_conversion_chunks, max_retries, metrics)
+                span.set_attribute('converted', code is not None)
+            if code is not None:
+                return code
+
+        raise SeedsExhaustedError('Could not convert the code, failing')
+
+    def _batch_steps(self, original_codes: list[str], max_retries: int,
+                     metrics: ConversionMetrics | None = None) -> Generator[dict, dict, list[str | None]]:
+        """
+        Conversion process for several code blocks packed in a single request, see `convert_batch` and
+        `_conversion_steps`
+        """
+        sources = [self._compacted(original_code) for original_code in original_codes]
+        converted: list[str | None] = [None] * len(sources)
+        if self.token_budget is not None:
+            # Capped by the largest budget the model is known to handle, like the budget of a single code block
+            max_new_tokens = min(sum(self.token_budget.predict(self.fm_name, source.code, self.MAX_NEW_TOKENS)
+                                     for source in sources),
+                                 self.token_budget.ceiling(self.fm_name, self.MAX_NEW_TOKENS))
+        else:
             max_new_tokens = self.MAX_NEW_TOKENS
-            code_fragment, complete = '', False
-            i = 0
-            while not complete and i < max_conversion_chunks:
-                payload = self._construct_payload(original_code,
-                                                  max_new_tokens=max_new_tokens,
-                                                  converted_code=code_fragment)
+        with self.tracer.span('payload'):
+            payload = self._construct_batch_payload([source.code for source in sources], max_new_tokens)
+        if payload is None:
+            return converted
+        if metrics is not None:
+            metrics.seeds += 1
+            metrics.chunks += 1
+
+        j = 0
+        while True:
+            try:
+                response = yield payload
+                with self.tracer.span('extract'):
+                    code, complete = self._extract_code(response, payload)
+                break
+            except (OutputTooLongException, InvalidCodeError) as e:
+                # The blocks are better off converted on their own
+                logging.warning(f'\t\t\t{e}, converting the code blocks one by one')
+                return converted
+            except BackendTimeoutError as e:
+                logging.warning('Timed out while querying the backend, continuing')
+                if metrics is not None:
+                    metrics.record_retry('timeout')
+            except ConversionError as e:
+                if not self.retry_policy.is_retryable(e):
+                    logging.error(f'\t\t\tThe backend rejected the request ({e}), failing')
+                    raise
+                logging.exception(e)
+                if metrics is not None:
+                    metrics.record_retry('error')
+            j += 1
+            if j > max_retries - 1:
+                logging.warning(f'\t\t\tCould not convert the packed code blocks after {j} retries')
+                return converted
+
+        sections = split_packed_code(code, len(sources))
+        if not complete:
+            # The FM ran out of output tokens, the last block it started is not complete
+            last = max((i for i, section in enumerate(sections) if section is not None), default=None)
+            if last is not None:
+                sections[last] = None
+        for i, (source, section) in enumerate(zip(sources, sections)):
+            if section is None:
+                continue
+            try:
+                with self.tracer.span('compile'):
+                    compile(section, filename='<string>', mode='exec')
+            except BaseException as e:
+                logging.warning(f'\t\t\tFailed to compile the converted code of block {i + 1} ({e})')
+                continue
+            converted[i] = source.restore(section)
+        failed = converted.count(None)
+        if failed and metrics is not None:
+            metrics.record_retry('unpacked')
+        logging.info(f'\t\t\tConverted {len(converted) - failed} of {len(converted)} packed code blocks')
+        return converted
+
+    def _seed_steps(self, original_code: str, seed: int, max_conversion_chunks: int, max_retries: int,
+                    metrics: ConversionMetrics | None = None,
+                    temperature: float | None = None) -> Generator[dict, dict, str | None]:
+        """
+        Conversion process for a single seed, see `_conversion_steps`. The seed is sampled with the given
+        temperature, or with the default one of the converter.
+
+        Returns
+        -------
+        The converted code, or `None` if this seed failed and the conversion should be retried
+        """
+        if metrics is not None:
+            metrics.seeds += 1
+        if self.token_budget is not None:
+            max_new_tokens = self.token_budget.predict(self.fm_name, original_code, self.MAX_NEW_TOKENS)
+        else:
+            max_new_tokens = self.MAX_NEW_TOKENS
+        code_fragment, complete, abandoned = '', False, False
+        # Output tokens used by the FM in all the chunks, if reported by the backend
+        output_tokens = 0
+        i = 0
+        while not complete and i < max_conversion_chunks:
+            with self.tracer.span('chunk', model=self.fm_name, seed=seed, chunk=i):
+                if metrics is not None:
+                    metrics.chunks += 1
+                with self.tracer.span('payload'):
+                    # Code sent back to the FM to be continued, which might be a window of the code converted so far
+                    window = self._continuation_code(code_fragment)
+                    payload = self._construct_payload(original_code,
+                                                      max_new_tokens=max_new_tokens,
+                                                      converted_code=window,
+                                                      temperature=temperature)
 
                 # The following block iterates on each individual code block, retrying runtime errors
                 # it will not iterate on code blocks that are not complete and need further calls
@@ -45,47 +650,190 @@ class CodeConverter:
                 j = 0
                 while j < max_retries:
                     try:
-                        response = self._fm_eval(payload)
-                        code_fragment, complete = self._extract_code(response, payload)
+                        response = yield payload
+                        response_tokens = self._output_tokens(response)
+                        if output_tokens is not None and response_tokens is not None:
+                            output_tokens += response_tokens
+                        else:
+                            output_tokens = None
+                        with self.tracer.span('extract'):
+                            extracted, complete = self._extract_code(response, payload)
+                            code_fragment = extracted if window == code_fragment else \
+                                stitch(code_fragment, window, extracted)
                         logging.debug(f'Extracted code:\n{code_fragment}')
                         if not complete:
+                            if self.validate_partial_code:
+                                with self.tracer.span('validate'):
+                                    viable = is_viable_prefix(code_fragment)
+                                if not viable:
+                                    raise InvalidCodeError('The partial code is already invalid')
                             logging.info('\t\t\tModel output not complete, iterating...')
+                            if self.token_budget is not None:
+                                # The predicted budget was too small, use the largest one for the next chunks
+                                max_new_tokens = self.token_budget.ceiling(self.fm_name, self.MAX_NEW_TOKENS)
                         break
                     except OutputTooLongException as e:
                         # This error code means that the context + output is too long for the model to handle -> fail
+                        if self.token_budget is not None:
+                            self.token_budget.observe_too_long(self.fm_name, max_new_tokens)
+                        if metrics is not None:
+                            metrics.record_retry('output_too_long')
                         max_new_tokens = int(0.7 * max_new_tokens)
-                        payload = self._construct_payload(original_code,
-                                                          max_new_tokens=max_new_tokens,
-                                                          converted_code=code_fragment)
+                        with self.tracer.span('payload'):
+                            payload = self._construct_payload(original_code,
+                                                              max_new_tokens=max_new_tokens,
+                                                              converted_code=window,
+                                                              temperature=temperature)
                         logging.warning('\t\t\tError calling the model, retrying with a '
                                         'smaller number of output tokens')
                     except BackendTimeoutError as e:
                         logging.warning('Timed out while querying the backend, continuing')
+                        if metrics is not None:
+                            metrics.record_retry('timeout')
+                    except InvalidCodeError as e:
+                        # No continuation can fix the code, don't spend more chunks on this seed
+                        logging.warning(f'\t\t\t{e}, retrying the whole code conversion')
+                        if metrics is not None:
+                            metrics.record_retry('invalid_partial_code')
+                        abandoned = True
+                        break
                     except ConversionError as e:
+                        if not self.retry_policy.is_retryable(e):
+                            logging.error(f'\t\t\tThe backend rejected the request ({e}), failing')
+                            raise
                         logging.exception(e)
+                        if metrics is not None:
+                            metrics.record_retry('error')
 
                     j += 1
 
+                if abandoned:
+                    break
                 if j > max_retries - 1:
-                    raise ConversionError(f'Could not construct the full code fragment after {j} retries')
+                    raise RetriesExhaustedError(f'Could not construct the full code fragment after {j} retries')
 
                 i += 1
 
-            if i > max_conversion_chunks - 1:
-                logging.warning(f'\t\t\tCould not convert the code after {max_conversion_chunks} '
-                                f'completions, retrying the whole code conversion')
-                continue
+        if abandoned:
+            return None
+        if i > max_conversion_chunks - 1:
+            logging.warning(f'\t\t\tCould not convert the code after {max_conversion_chunks} '
+                            f'completions, retrying the whole code conversion')
+            if metrics is not None:
+                metrics.record_retry('incomplete')
+            return None
 
-            # We have a chunk of code, let's try to see if it's syntactically correct
-            try:
+        # We have a chunk of code, let's try to see if it's syntactically correct
+        try:
+            with self.tracer.span('compile'):
                 compile(code_fragment, filename='<string>', mode='exec')
-                return code_fragment
-            except BaseException as e:
-                logging.warning(f'\t\t\tFailed to compile the converted code, retrying ({e})')
-                logging.debug(code_fragment)
-                continue
+        except BaseException as e:
+            logging.warning(f'\t\t\tFailed to compile the converted code ({e})')
+            if metrics is not None:
+                metrics.record_retry('compile_error')
+            logging.debug(code_fragment)
+            if not isinstance(e, SyntaxError):
+                return None
+            error = e
+        else:
+            if self.token_budget is not None and output_tokens is not None:
+                self.token_budget.observe(self.fm_name, original_code, output_tokens)
+            return code_fragment
 
-        raise ConversionError('Could not convert the code, failing')
+        # Fixing the error is much cheaper than converting the whole code again
+        return (yield from self._repair_steps(code_fragment, error, temperature, metrics))
+
+    def _continuation_code(self, code: str) -> str:
+        """
+        Return the code to be sent back to the FM for it to continue the given converted code
+
+        If `continuation_window` is set, only an outline of the code and its last lines are sent (see
+        `window.continuation_window`), so the input tokens don't grow with the length of the converted code.
+        """
+        if self.continuation_window is None or not code:
+            return code
+        return continuation_window(code, self.continuation_window)
+
+    def _repair_steps(self, code: str, error: SyntaxError, temperature: float | None = None,
+                      metrics: ConversionMetrics | None = None) -> Generator[dict, dict, str | None]:
+        """
+        Repair process for converted code that doesn't compile, see `_conversion_steps`
+
+        The code and the syntax error are sent back to the FM, asking for a targeted fix, up to `repair_attempts`
+        times. The whole code is generated again, so it must fit in the output tokens of a single request.
+
+        Parameters
+        ----------
+        code : Converted code
+        error : Error raised when compiling the code
+        temperature : Sampling temperature, the default one of the converter if not given
+        metrics : Metrics where the repairs are recorded, if any
+
+        Returns
+        -------
+        The repaired code, or `None` if it could not be repaired and the conversion should be retried
+        """
+        for attempt in range(self.repair_attempts):
+            max_new_tokens = int(self.REPAIR_OUTPUT_RATIO * len(code) / self.CHARS_PER_TOKEN) + self.REPAIR_MIN_TOKENS
+            if max_new_tokens > self.MAX_NEW_TOKENS:
+                logging.info('\t\t\tThe converted code is too long to be repaired, retrying the whole code conversion')
+                return None
+            with self.tracer.span('payload'):
+                payload = self._construct_repair_payload(code, error, max_new_tokens, temperature)
+            if payload is None:
+                # The converter doesn't support repairs
+                return None
+            logging.info(f'\t\t\tAsking the model to fix the syntax error ({error.msg}, line {error.lineno})')
+            if metrics is not None:
+                metrics.record_retry('repair')
+            with self.tracer.span('repair', model=self.fm_name, attempt=attempt):
+                try:
+                    response = yield payload
+                    with self.tracer.span('extract'):
+                        repaired, complete = self._extract_code(response, payload)
+                except ConversionError as e:
+                    if not self.retry_policy.is_retryable(e):
+                        logging.error(f'\t\t\tThe backend rejected the request ({e}), failing')
+                        raise
+                    logging.warning(f'\t\t\tCould not repair the code ({e}), retrying the whole code conversion')
+                    return None
+                if not complete:
+                    logging.warning('\t\t\tThe repaired code is not complete, retrying the whole code conversion')
+                    return None
+                try:
+                    with self.tracer.span('compile'):
+                        compile(repaired, filename='<string>', mode='exec')
+                except SyntaxError as e:
+                    logging.warning(f'\t\t\tThe repaired code does not compile either ({e})')
+                    logging.debug(repaired)
+                    code, error = repaired, e
+                    continue
+                except Exception as e:
+                    logging.warning(f'\t\t\tFailed to compile the repaired code, retrying ({e})')
+                    return None
+            logging.info('\t\t\tRepaired the converted code')
+            return repaired
+        return None
+
+    @staticmethod
+    def _repair_fields(code: str, error: SyntaxError) -> dict:
+        """
+        Return the fields describing a syntax error used by the repair prompts
+
+        Parameters
+        ----------
+        code : Code that doesn't compile
+        error : Error raised when compiling the code
+
+        Returns
+        -------
+        Dictionary with the code (`PYTHON_CODE`), the error message (`ERROR`), the number of the failing line
+        (`LINE_NUMBER`) and the line itself (`LINE`)
+        """
+        lines = code.splitlines()
+        lineno = error.lineno or 0
+        line = lines[lineno - 1] if 0 < lineno <= len(lines) else (error.text or '').rstrip('\n')
+        return {'PYTHON_CODE': code, 'ERROR': error.msg, 'LINE_NUMBER': lineno, 'LINE': line}
 
     @property
     def fm_name(self) -> str:
@@ -94,7 +842,23 @@ class CodeConverter:
         """
         raise NotImplementedError('This method must be implemented by derived classes')
 
-    def _construct_payload(self, original_code: str, max_new_tokens: int, converted_code: str = '') -> dict:
+    def fingerprint(self, original_code: str) -> str:
+        """
+        Return a hash identifying the conversion of the given code
+
+        The hash covers the code itself, the model, the prompt and the sampling parameters (i.e. everything
+        that is sent to the FM), so it can be used as a key for caching the conversion results.
+
+        Parameters
+        ----------
+        original_code: Original code to be translated
+        """
+        payload = self._construct_payload(self._compacted(original_code).code, max_new_tokens=self.MAX_NEW_TOKENS)
+        request = json.dumps({'fm_name': self.fm_name, 'payload': payload}, sort_keys=True)
+        return hashlib.sha256(request.encode('utf-8')).hexdigest()
+
+    def _construct_payload(self, original_code: str, max_new_tokens: int, converted_code: str = '',
+                           temperature: float | None = None) -> dict:
         """
         Construct the payload to be passed to the endpoint
 
@@ -103,9 +867,43 @@ class CodeConverter:
         original_code: Original code to be translated
         max_new_tokens: The maximum number of tokens to be provided at the FM output
         converted_code: Code chunk that has already been converted by the FM
+        temperature: Sampling temperature, `TEMPERATURE` if not given
         """
         raise NotImplementedError('This method must be implemented by derived classes')
 
+    def _construct_repair_payload(self, code: str, error: SyntaxError, max_new_tokens: int,
+                                  temperature: float | None = None) -> dict | None:
+        """
+        Construct the payload asking the FM to fix a syntax error in the converted code
+
+        The response is parsed with `_extract_code`, so it must contain the whole fixed code. Converters that
+        don't support repairs return `None` (the default), and the conversion is retried from scratch instead.
+
+        Parameters
+        ----------
+        code: Converted code that doesn't compile
+        error: Error raised when compiling the code
+        max_new_tokens: The maximum number of tokens to be provided at the FM output
+        temperature: Sampling temperature, `TEMPERATURE` if not given
+        """
+        return None
+
+    def _construct_batch_payload(self, original_codes: list[str], max_new_tokens: int,
+                                 temperature: float | None = None) -> dict | None:
+        """
+        Construct the payload asking the FM to convert several code blocks at once (see `convert_batch`)
+
+        Converters that don't support packing several code blocks in a request return `None`, so each block
+        is converted on its own.
+
+        Parameters
+        ----------
+        original_codes: Original code blocks to be translated (see `packing.pack_routines`)
+        max_new_tokens: The maximum number of tokens to be provided at the FM output
+        temperature: Sampling temperature, `TEMPERATURE` if not given
+        """
+        return None
+
     def _fm_eval(self, payload: dict):
         """
         Eval the given payload with the underlyinf Foundation Model
@@ -135,3 +933,90 @@ class CodeConverter:
         It might not be complete if the FM ran out of output tokens.
         """
         raise NotImplementedError('This method must be implemented by derived classes')
+
+    async def _afm_eval(self, payload: dict):
+        """
+        Eval the given payload with the underlying Foundation Model without blocking the event loop
+
+        The blocking `_fm_eval` is run in a thread pool of `MAX_IN_FLIGHT_REQUESTS` threads, so each request
+        in flight still holds a thread. None of the converters has a native asynchronous client.
+
+        Parameters
+        ----------
+        payload: Dict with the payload to send to the FM for evaluation
+
+        Returns
+        -------
+        Model output, which will include free-form text and should also include a code block.
+        """
+        if self._async_executor is None:
+            self._async_executor = ThreadPoolExecutor(max_workers=self.MAX_IN_FLIGHT_REQUESTS,
+                                                      thread_name_prefix=f'{type(self).__name__}-fm')
+        # The request runs in a copy of the current context, so it can be traced and cancelled
+        return await asyncio.get_running_loop().run_in_executor(
+            self._async_executor, functools.partial(contextvars.copy_context().run, self._fm_eval, payload))
+
+    def _in_flight_semaphore(self) -> asyncio.Semaphore:
+        """
+        Return the semaphore capping the number of in-flight requests for the running event loop
+        """
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.MAX_IN_FLIGHT_REQUESTS)
+        return self._semaphores[loop]
+
+    def _output_tokens(self, response) -> int | None:
+        """
+        Return the number of output tokens generated by the FM for the given response
+
+        Parameters
+        ----------
+        response : The response from the FM
+
+        Returns
+        -------
+        The number of output tokens, or `None` if the backend does not report it
+        """
+        return None
+
+    def _input_tokens(self, response) -> int | None:
+        """
+        Return the number of input tokens processed by the FM for the given response
+
+        Parameters
+        ----------
+        response : The response from the FM
+
+        Returns
+        -------
+        The number of input tokens, or `None` if the backend does not report it
+        """
+        return None
+
+    def _stop_reason(self, response) -> str | None:
+        """
+        Return the reason why the FM stopped generating the given response
+
+        Parameters
+        ----------
+        response : The response from the FM
+
+        Returns
+        -------
+        The stop reason, or `None` if the backend does not report it
+        """
+        return None
+
+    def _time_to_first_token(self, response) -> float | None:
+        """
+        Return the time (in seconds) until the first token of the given response was received
+
+        Parameters
+        ----------
+        response : The response from the FM
+
+        Returns
+        -------
+        The time to first token, or `None` if the output was not streamed
+        """
+        return None
@@ -0,0 +1,209 @@
+import os
+import json
+import math
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from collections import defaultdict, deque
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where the persisted file is not locked
+    fcntl = None
+
+
+class TokenBudget:
+    """
+    Model of the number of output tokens needed to convert a routine, learned from previous conversions
+
+    For each model, the budget keeps the ratio between the output tokens used to convert a routine and
+    the size of the routine (in characters) for the most recent conversions, and predicts the budget for
+    a new routine as a high quantile of that ratio times its size, plus a safety margin. It also learns
+    the largest budget that a model can handle without timing out (i.e. without `OutputTooLongException`),
+    so later requests start below it instead of failing first. Since a timeout might be transient, every
+    successful conversion raises that ceiling a bit again, until it reaches the budget that failed.
+
+    Observations can be persisted to an append-only JSON lines file, shared by several processes. The file is
+    compacted when it's loaded if it grew too much, keeping only what the model still uses. The processes lock
+    the file while appending to it or compacting it, so no observation is lost.
+    """
+    # Number of recent conversions to use for predicting the budget
+    WINDOW = 200
+    # Minimum number of conversions needed before predicting the budget
+    MIN_OBSERVATIONS = 5
+    MIN_NEW_TOKENS = 256
+    QUANTILE = 0.9
+    MARGIN = 1.15
+    # Factor applied to a budget that made the model time out
+    SHRINK_FACTOR = 0.7
+    # Factor applied to the ceiling after each successful conversion
+    RECOVERY_FACTOR = 1.05
+    # Number of observations in the persisted file above which it's compacted
+    MAX_RECORDS = 4 * WINDOW
+
+    def __init__(self, path: Path | None = None):
+        """
+        Create the budget model, loading previous observations from the given file (if any)
+
+        Parameters
+        ----------
+        path : JSON lines file where the observations are persisted, or `None` to keep them in memory
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._observations: dict[str, deque] = defaultdict(lambda: deque(maxlen=self.WINDOW))
+        self._ceilings: dict[str, int] = {}
+        # Smallest budget that made each model time out, up to which its ceiling recovers
+        self._too_long: dict[str, int] = {}
+        if path is not None:
+            path.parent.mkdir(exist_ok=True, parents=True)
+            if path.exists():
+                self._load(path)
+
+    @contextmanager
+    def _locked(self):
+        """
+        Hold the lock of the persisted file, shared by all the processes using it
+        """
+        with self.path.with_name(f'.{self.path.name}.lock').open('at') as lock:
+            if fcntl is not None:
+                # Released when the lock file is closed
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _read(self, path: Path) -> int:
+        """
+        Update the model with the observations in the given file, returning the number of records in it
+        """
+        records = 0
+        with path.open('rt') as observations:
+            for line in observations:
+                records += 1
+                try:
+                    self._apply(json.loads(line))
+                except (json.JSONDecodeError, KeyError):
+                    logging.warning(f'Skipping corrupted observation in {path}')
+        return records
+
+    def _load(self, path: Path) -> None:
+        """
+        Load the observations in the given file
+        """
+        if self._read(path) > self.MAX_RECORDS:
+            with self._locked():
+                self._compact(path)
+
+    def _compact(self, path: Path) -> None:
+        """
+        Replace the given file with the observations still used by the model (and the current ceilings)
+
+        The lock of the file must be held. The file is read again, since other processes might have appended
+        observations (or compacted it) since it was loaded, and replaced atomically.
+        """
+        budget = TokenBudget()
+        if budget._read(path) <= self.MAX_RECORDS:
+            return
+        with tempfile.NamedTemporaryFile('wt', dir=path.parent, prefix=f'.{path.name}.', delete=False) as observations:
+            for fm_name_observations in budget._observations.values():
+                for observation in fm_name_observations:
+                    observations.write(json.dumps(observation) + '\n')
+            # The ceilings go last, so they're not raised again by the observations when the file is loaded
+            for fm_name, ceiling in budget._ceilings.items():
+                observations.write(json.dumps({'fm_name': fm_name, 'ceiling': ceiling,
+                                               'too_long': budget._too_long[fm_name]}) + '\n')
+        os.replace(observations.name, path)
+
+    def _apply(self, observation: dict) -> None:
+        """
+        Update the model with the given observation
+        """
+        fm_name = observation['fm_name']
+        if 'ceiling' in observation:
+            # Ceiling written when compacting the file
+            self._ceilings[fm_name], self._too_long[fm_name] = observation['ceiling'], observation['too_long']
+        elif 'too_long' in observation:
+            ceiling = max(int(self.SHRINK_FACTOR * observation['too_long']), self.MIN_NEW_TOKENS)
+            self._ceilings[fm_name] = min(self._ceilings.get(fm_name, ceiling), ceiling)
+            self._too_long[fm_name] = min(self._too_long.get(fm_name, observation['too_long']),
+                                          observation['too_long'])
+        else:
+            self._observations[fm_name].append(observation)
+            if fm_name in self._ceilings:
+                ceiling = int(self.RECOVERY_FACTOR * self._ceilings[fm_name]) + 1
+                if ceiling >= self._too_long[fm_name]:
+                    # Fully recovered, the budget that failed can be tried again
+                    del self._ceilings[fm_name], self._too_long[fm_name]
+                else:
+                    self._ceilings[fm_name] = ceiling
+
+    def _record(self, observation: dict) -> None:
+        """
+        Update the model with the given observation and persist it
+        """
+        with self._lock:
+            self._apply(observation)
+            if self.path is not None:
+                with self._locked(), self.path.open('at') as observations:
+                    observations.write(json.dumps(observation) + '\n')
+
+    def ceiling(self, fm_name: str, max_new_tokens: int) -> int:
+        """
+        Return the largest number of output tokens that should be requested to the given model
+
+        Parameters
+        ----------
+        fm_name : Name of the model used for the conversion
+        max_new_tokens : Maximum number of output tokens supported by the converter
+        """
+        with self._lock:
+            return min(max_new_tokens, self._ceilings.get(fm_name, max_new_tokens))
+
+    def predict(self, fm_name: str, original_code: str, max_new_tokens: int) -> int:
+        """
+        Predict the number of output tokens to request for the first chunk of a conversion
+
+        Parameters
+        ----------
+        fm_name : Name of the model used for the conversion
+        original_code : Code to be converted
+        max_new_tokens : Maximum number of output tokens supported by the converter
+
+        Returns
+        -------
+        The number of output tokens to request, which will never exceed `max_new_tokens`
+        """
+        max_new_tokens = self.ceiling(fm_name, max_new_tokens)
+        with self._lock:
+            ratios = sorted(observation['output_tokens'] / max(observation['chars'], 1)
+                            for observation in self._observations[fm_name])
+        if len(ratios) < self.MIN_OBSERVATIONS:
+            return max_new_tokens
+        ratio = ratios[max(math.ceil(self.QUANTILE * len(ratios)) - 1, 0)]
+        budget = int(self.MARGIN * ratio * len(original_code))
+        return max(min(budget, max_new_tokens), min(self.MIN_NEW_TOKENS, max_new_tokens))
+
+    def observe(self, fm_name: str, original_code: str, output_tokens: int) -> None:
+        """
+        Record the output tokens used for a successful conversion
+
+        Parameters
+        ----------
+        fm_name : Name of the model used for the conversion
+        original_code : Code that was converted
+        output_tokens : Total number of output tokens generated for the conversion, in all its chunks
+        """
+        self._record({'fm_name': fm_name, 'chars': len(original_code), 'output_tokens': output_tokens})
+
+    def observe_too_long(self, fm_name: str, max_new_tokens: int) -> None:
+        """
+        Record that requesting the given number of output tokens made the model fail
+
+        Parameters
+        ----------
+        fm_name : Name of the model used for the conversion
+        max_new_tokens : Number of output tokens requested
+        """
+        self._record({'fm_name': fm_name, 'too_long': max_new_tokens})
@@ -0,0 +1,133 @@
+import json
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+
+
+class ConversionCache:
+    """
+    Persistent, content-addressed cache of converted routines
+
+    Conversions are stored in a SQLite database, keyed by the converter-provided fingerprint of the
+    request (see `CodeConverter.fingerprint`), so that routines are only sent to the FM again when the
+    routine, the model, the prompt or the sampling parameters change. Once the database grows over
+    `max_size` bytes, the least recently used entries are evicted.
+
+    The cache can be shared by several threads, and by several processes as long as each of them opens
+    its own `ConversionCache`.
+    """
+
+    def __init__(self, path: Path, max_size: int = 512 * 1024 * 1024):
+        """
+        Open (or create) the cache stored in the given file
+
+        Parameters
+        ----------
+        path : Path to the SQLite database holding the cache
+        max_size : Maximum size (in bytes) of the cached code and metadata before evicting entries
+        """
+        path.parent.mkdir(exist_ok=True, parents=True)
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        with self._lock:
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS conversions ('
+                                     'key TEXT PRIMARY KEY, '
+                                     'fm_name TEXT NOT NULL, '
+                                     'code TEXT NOT NULL, '
+                                     'metadata TEXT NOT NULL, '
+                                     'size INTEGER NOT NULL, '
+                                     'created_at REAL NOT NULL, '
+                                     'last_used_at REAL NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS conversions_last_used_at '
+                                     'ON conversions (last_used_at)')
+            # Total size of the entries, kept up to date by triggers so it's shared by all the processes and
+            # `put` doesn't need to add up the sizes of all the entries
+            self._connection.execute('BEGIN IMMEDIATE')
+            self._connection.execute('CREATE TABLE IF NOT EXISTS cache_size ('
+                                     'id INTEGER PRIMARY KEY CHECK (id = 0), '
+                                     'total INTEGER NOT NULL)')
+            self._connection.execute('INSERT OR IGNORE INTO cache_size (id, total) '
+                                     'SELECT 0, COALESCE(SUM(size), 0) FROM conversions')
+            self._connection.execute('CREATE TRIGGER IF NOT EXISTS conversions_insert AFTER INSERT ON conversions '
+                                     'BEGIN UPDATE cache_size SET total = total + NEW.size; END')
+            self._connection.execute('CREATE TRIGGER IF NOT EXISTS conversions_delete AFTER DELETE ON conversions '
+                                     'BEGIN UPDATE cache_size SET total = total - OLD.size; END')
+            self._connection.execute('CREATE TRIGGER IF NOT EXISTS conversions_update '
+                                     'AFTER UPDATE OF size ON conversions '
+                                     'BEGIN UPDATE cache_size SET total = total + NEW.size - OLD.size; END')
+            self._connection.execute('COMMIT')
+
+    def get(self, key: str) -> str | None:
+        """
+        Retrieve the converted code for the given key, if cached
+
+        Parameters
+        ----------
+        key : Fingerprint of the conversion request
+
+        Returns
+        -------
+        The cached code or `None` if the key is not present in the cache
+        """
+        with self._lock:
+            row = self._connection.execute('SELECT code FROM conversions WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self._connection.execute('UPDATE conversions SET last_used_at = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, fm_name: str, code: str, metadata: dict | None = None) -> None:
+        """
+        Store the converted code for the given key
+
+        Parameters
+        ----------
+        key : Fingerprint of the conversion request
+        fm_name : Name of the model that converted the code
+        code : Converted (and validated) code
+        metadata : Additional JSON-serializable information to be stored along with the code
+        """
+        metadata = json.dumps(metadata or {})
+        now = time.time()
+        with self._lock:
+            # An upsert rather than `INSERT OR REPLACE`, whose implicit deletes don't fire the triggers
+            self._connection.execute('INSERT INTO conversions '
+                                     '(key, fm_name, code, metadata, size, created_at, last_used_at) '
+                                     'VALUES (?, ?, ?, ?, ?, ?, ?) '
+                                     'ON CONFLICT (key) DO UPDATE SET fm_name = excluded.fm_name, '
+                                     'code = excluded.code, metadata = excluded.metadata, size = excluded.size, '
+                                     'created_at = excluded.created_at, last_used_at = excluded.last_used_at',
+                                     (key, fm_name, code, metadata, len(code) + len(metadata), now, now))
+            self._evict()
+
+    def _evict(self) -> None:
+        """
+        Remove the least recently used entries until the cache fits in `max_size`
+
+        The entries are only scanned when the cache is over `max_size`, the total size being tracked in the
+        `cache_size` table.
+        """
+        total_size = self._connection.execute('SELECT total FROM cache_size').fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        evicted = []
+        for key, size in self._connection.execute('SELECT key, size FROM conversions '
+                                                  'ORDER BY last_used_at').fetchall():
+            if total_size <= self.max_size:
+                break
+            evicted.append((key,))
+            total_size -= size
+        self._connection.executemany('DELETE FROM conversions WHERE key = ?', evicted)
+        logging.debug(f'Evicted {len(evicted)} entries from the conversion cache')
+
+    def close(self) -> None:
+        """
+        Close the underlying database
+        """
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,103 @@
+import json
+import hashlib
+import logging
+from .base import CodeConverter
+from converters.metrics import ConversionMetrics
+from converters.exceptions import ConversionError, FatalConversionError
+
+
+class CascadeConverter(CodeConverter):
+    """
+    Converter trying an ordered list of converters (tiers), e.g. from the cheapest / fastest model to the best one
+
+    Each routine is converted with the first tier, and only escalated to the next one when the tier gave up
+    (e.g. none of its seeds produced complete code that compiles, or it ran out of retries). Only the errors
+    that no tier can fix (`FatalConversionError`, e.g. an invalid request) stop the cascade. The converted code
+    starts with a comment naming the tier that produced it, and the `fm_name` of the routine metrics is set to
+    that tier's model.
+
+    Each tier keeps its own settings (rate limiter, circuit breaker, token budget...), since they depend on
+    the backend.
+    """
+
+    def __init__(self, converters: list[CodeConverter]):
+        """
+        Create a cascade of converters
+
+        Parameters
+        ----------
+        converters : Converters to try, in order
+        """
+        if not converters:
+            raise ValueError('A cascade needs at least one converter')
+        super().__init__()
+        self.converters = converters
+
+    @property
+    def fm_name(self) -> str:
+        """
+        Return the models of the tiers, in order
+        """
+        return '+'.join(converter.fm_name for converter in self.converters)
+
+    def fingerprint(self, original_code: str) -> str:
+        """
+        Return a hash identifying the conversion of the given code by the whole cascade
+        """
+        fingerprints = [converter.fingerprint(original_code) for converter in self.converters]
+        return hashlib.sha256(json.dumps(fingerprints).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _converted(converter: CodeConverter, tier: int, code: str, metrics: ConversionMetrics | None) -> str:
+        """
+        Record the tier that converted a routine, returning the code annotated with it
+        """
+        if metrics is not None:
+            metrics.fm_name = converter.fm_name
+        return f'# Converted by {converter.fm_name} (tier {tier + 1})\n{code}'
+
+    def _escalate(self, converter: CodeConverter, tier: int, error: ConversionError,
+                  metrics: ConversionMetrics | None) -> None:
+        """
+        Move on to the next tier after the given one failed, re-raising the error if it was the last one (or if
+        no tier can fix it)
+        """
+        if isinstance(error, FatalConversionError) or tier == len(self.converters) - 1:
+            raise error
+        logging.info(f'\t\t\t{converter.fm_name} could not convert the code, escalating to '
+                     f'{self.converters[tier + 1].fm_name}')
+        if metrics is not None:
+            metrics.record_retry('escalated')
+
+    def convert(self, original_code: str, max_seeds: int = 3, max_conversion_chunks: int = 4, max_retries: int = 3,
+                metrics: ConversionMetrics | None = None, parallel_seeds: int | None = None):
+        """
+        Convert the given code block with the first tier that succeeds, see `CodeConverter.convert`
+        """
+        for tier, converter in enumerate(self.converters):
+            try:
+                with self.tracer.span('tier', model=converter.fm_name, tier=tier):
+                    code = converter.convert(original_code, max_seeds, max_conversion_chunks, max_retries, metrics,
+                                             parallel_seeds)
+            except ConversionError as e:
+                self._escalate(converter, tier, e, metrics)
+            else:
+                return self._converted(converter, tier, code, metrics)
+        raise ConversionError('Could not convert the code, failing')
+
+    async def aconvert(self, original_code: str, max_seeds: int = 3, max_conversion_chunks: int = 4,
+                       max_retries: int = 3, metrics: ConversionMetrics | None = None,
+                       parallel_seeds: int | None = None):
+        """
+        Convert the given code block with the first tier that succeeds, see `CodeConverter.aconvert`
+        """
+        for tier, converter in enumerate(self.converters):
+            try:
+                with self.tracer.span('tier', model=converter.fm_name, tier=tier):
+                    code = await converter.aconvert(original_code, max_seeds, max_conversion_chunks, max_retries,
+                                                    metrics, parallel_seeds)
+            except ConversionError as e:
+                self._escalate(converter, tier, e, metrics)
+            else:
+                return self._converted(converter, tier, code, metrics)
+        raise ConversionError('Could not convert the code, failing')
@@ -1,9 +1,15 @@
 import re
 import json
-import boto3
+import logging
 import botocore
+from contextlib import closing
+from functools import cached_property
 from .base import CodeConverter
-from converters.exceptions import BackendTimeoutError, ConversionError
+from .clients import get_client
+from .retry import retry_after
+from .packing import PACKING_INSTRUCTIONS, first_marker, pack_routines
+from .streaming import CodeBlockStream, stream_error
+from converters.exceptions import BackendTimeoutError, ConversionError, FatalConversionError, ThrottlingError
 
 
 class ClaudeConverter(CodeConverter):
@@ -40,7 +46,21 @@ def function_name(db_conn, ...):
 </python_function>
 
 Make sure to handle database operations, such as queries and updates, by calling appropriate methods on the db_conn object instead of executing SQL directly.'''
+    REPAIR_TEMPLATE = '''The following Python code, converted from PL/SQL, does not compile:
+
+<python_code>
+{PYTHON_CODE}
+</python_code>
+
+The Python compiler reports "{ERROR}" on line {LINE_NUMBER}:
+
+<failing_line>
+{LINE}
+</failing_line>
+
+Fix the error changing as little code as possible, and return the whole corrected code.'''
     MAX_NEW_TOKENS = 4096
+    TEMPERATURE = 0.3
 
     def __init__(self, model_id: str = 'anthropic.claude-3-sonnet-20240229-v1:0'):
         """
@@ -48,8 +68,15 @@ Make sure to handle database operations, such as queries and updates, by calling
 
         This converter will work with the provided SageMaker endpoint for converting the given code
         """
+        super().__init__()
         self.model_id = model_id
-        self.client = boto3.client(service_name='bedrock-runtime')
+
+    @cached_property
+    def client(self):
+        """
+        Amazon Bedrock runtime client, shared by all the converters in the process (see `clients.get_client`)
+        """
+        return get_client('bedrock-runtime')
 
     @property
     def fm_name(self) -> str:
@@ -58,7 +85,8 @@ Make sure to handle database operations, such as queries and updates, by calling
         """
         return self.model_id
 
-    def _construct_payload(self, original_code: str, max_new_tokens: int, converted_code: str = '') -> dict:
+    def _construct_payload(self, original_code: str, max_new_tokens: int, converted_code: str = '',
+                           temperature: float | None = None) -> dict:
         """
         Construct the payload to be passed to the endpoint
         """
@@ -71,7 +99,38 @@ Make sure to handle database operations, such as queries and updates, by calling
                 'max_tokens': max_new_tokens,
                 'system': self.SYSTEM_PROMPT,
                 'messages': messages,
-                'temperature': 0.3}
+                'temperature': self.TEMPERATURE if temperature is None else temperature}
+
+    def _construct_batch_payload(self, original_codes: list[str], max_new_tokens: int,
+                                 temperature: float | None = None) -> dict:
+        """
+        Construct the payload asking the model to convert several routines at once
+        """
+        prompt = self.PROMPT_TEMPLATE.format(PLSQL_CODE=pack_routines(original_codes))
+        messages = [{'role': 'user',
+                     'content': f'{prompt}\n\n{PACKING_INSTRUCTIONS.format(COUNT=len(original_codes))}'},
+                    {'role': 'assistant', 'content': f'```python\n{first_marker(original_codes)}'}]
+
+        return {'anthropic_version': 'bedrock-2023-05-31',
+                'max_tokens': max_new_tokens,
+                'system': self.SYSTEM_PROMPT,
+                'messages': messages,
+                'temperature': self.TEMPERATURE if temperature is None else temperature}
+
+    def _construct_repair_payload(self, code: str, error: SyntaxError, max_new_tokens: int,
+                                  temperature: float | None = None) -> dict:
+        """
+        Construct the payload asking the model to fix a syntax error in the converted code
+        """
+        messages = [{'role': 'user',
+                     'content': self.REPAIR_TEMPLATE.format(**self._repair_fields(code, error))},
+                    {'role': 'assistant', 'content': '```python'}]
+
+        return {'anthropic_version': 'bedrock-2023-05-31',
+                'max_tokens': max_new_tokens,
+                'system': self.SYSTEM_PROMPT,
+                'messages': messages,
+                'temperature': self.TEMPERATURE if temperature is None else temperature}
 
     def _fm_eval(self, payload: dict):
         """
@@ -82,11 +141,81 @@ Make sure to handle database operations, such as queries and updates, by calling
         Model output, which will include free-form text and should also include a code block.
         """
         try:
+            if self.streaming:
+                return self._fm_eval_stream(payload)
             response = self.client.invoke_model(body=json.dumps(payload), modelId=self.model_id)
         except (botocore.exceptions.ReadTimeoutError, self.client.exceptions.ModelTimeoutException) as e:
             raise BackendTimeoutError(f'{e}')
+        except self.client.exceptions.ThrottlingException as e:
+            raise ThrottlingError(f'{e}', retry_after=retry_after(e))
+        except (self.client.exceptions.ValidationException, self.client.exceptions.AccessDeniedException,
+                self.client.exceptions.ResourceNotFoundException) as e:
+            raise FatalConversionError(f'{e}')
+        except (self.client.exceptions.ServiceUnavailableException, self.client.exceptions.InternalServerException,
+                self.client.exceptions.ModelNotReadyException) as e:
+            raise ConversionError(f'{e}', retry_after=retry_after(e))
+        except botocore.exceptions.EventStreamError as e:
+            raise stream_error(e)
         return json.loads(response.get('body').read())
 
+    def _fm_eval_stream(self, payload: dict) -> dict:
+        """
+        Eval the given payload streaming the model output, which stops as soon as the code block is closed
+        (or as soon as the partial code is found to be invalid, if `validate_partial_code` is set)
+
+        Returns
+        -------
+        Model output, with the same format as the `invoke_model` output plus the time to first token.
+        """
+        code_block = CodeBlockStream(payload['messages'][-1]['content'], validate=self.validate_partial_code)
+        response = self.client.invoke_model_with_response_stream(body=json.dumps(payload), modelId=self.model_id)
+        stop_reason, input_tokens, output_tokens = None, 0, None
+        with closing(response['body']) as events:
+            for event in events:
+                chunk = json.loads(event['chunk']['bytes'])
+                match chunk['type']:
+                    case 'message_start':
+                        input_tokens = chunk['message']['usage']['input_tokens']
+                    case 'content_block_delta':
+                        if code_block.feed(chunk['delta'].get('text', '')):
+                            stop_reason = 'end_turn'
+                            break
+                    case 'message_delta':
+                        stop_reason = chunk['delta']['stop_reason']
+                        output_tokens = chunk['usage']['output_tokens']
+        logging.debug(f'\t\t\tTime to first token: {code_block.time_to_first_token}s')
+        if output_tokens is None:
+            # The stream was stopped early, estimate the tokens generated so far
+            output_tokens = len(code_block.text) // self.CHARS_PER_TOKEN
+        return {'content': [{'type': 'text', 'text': code_block.text}],
+                'stop_reason': stop_reason,
+                'usage': {'input_tokens': input_tokens, 'output_tokens': output_tokens},
+                'time_to_first_token': code_block.time_to_first_token}
+
+    def _output_tokens(self, response) -> int | None:
+        """
+        Return the number of output tokens generated by the FM for the given response
+        """
+        return response['usage']['output_tokens']
+
+    def _input_tokens(self, response) -> int | None:
+        """
+        Return the number of input tokens processed by the FM for the given response
+        """
+        return response['usage']['input_tokens']
+
+    def _stop_reason(self, response) -> str | None:
+        """
+        Return the reason why the FM stopped generating the given response
+        """
+        return response['stop_reason']
+
+    def _time_to_first_token(self, response) -> float | None:
+        """
+        Return the time until the first token of the given response was received, if it was streamed
+        """
+        return response.get('time_to_first_token')
+
     def _extract_code(self, response: dict, payload: dict) -> (str, bool):
         """
         Extract the converted code from the FM response.
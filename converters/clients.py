@@ -0,0 +1,76 @@
+import threading
+import boto3
+from botocore.config import Config
+
+# Configuration of the AWS clients created by `get_client`, see `configure_clients`
+_client_config = {'max_pool_connections': 10,
+                  'connect_timeout': 60.0,
+                  'read_timeout': 60.0}
+# Session and clients shared by all the converters in the process, by service name
+_session: boto3.session.Session | None = None
+_clients: dict = {}
+_clients_lock = threading.Lock()
+
+
+def configure_clients(max_pool_connections: int | None = None, connect_timeout: float | None = None,
+                      read_timeout: float | None = None) -> None:
+    """
+    Set the configuration of the AWS clients used by the converters
+
+    The clients that were already created are discarded, so the new configuration is applied to all the
+    clients returned by `get_client` from now on.
+
+    Parameters
+    ----------
+    max_pool_connections : Maximum number of HTTP connections kept open by each client, which should be at least
+        the number of concurrent requests, otherwise requests wait for a free connection (or open a new one that
+        is not reused)
+    connect_timeout : Time (in seconds) to wait for a connection to the backend to be established
+    read_timeout : Time (in seconds) to wait for data from the backend once the request is sent
+    """
+    with _clients_lock:
+        for key, value in (('max_pool_connections', max_pool_connections),
+                           ('connect_timeout', connect_timeout),
+                           ('read_timeout', read_timeout)):
+            if value is not None:
+                _client_config[key] = value
+        _clients.clear()
+
+
+def get_session() -> boto3.session.Session:
+    """
+    Return the boto3 session shared by all the converters in the process
+    """
+    global _session
+    with _clients_lock:
+        if _session is None:
+            # The default boto3 session is not thread-safe, so a dedicated one is created (once)
+            _session = boto3.session.Session()
+        return _session
+
+
+def get_client(service_name: str):
+    """
+    Return the client for the given AWS service shared by all the converters in the process
+
+    Clients are thread-safe, so a single client (and its pool of HTTP connections, kept alive between
+    requests) is used by all the threads instead of paying for a new connection on each request.
+
+    Parameters
+    ----------
+    service_name : Name of the AWS service (e.g. `bedrock-runtime`)
+
+    Returns
+    -------
+    The client for the service, created with the configuration set by `configure_clients`
+    """
+    session = get_session()
+    with _clients_lock:
+        if service_name not in _clients:
+            # The requests are retried by the converters (see `retry.RetryPolicy`), not by botocore, otherwise
+            # the retries would be multiplied and hidden from the rate limiter and the circuit breaker
+            _clients[service_name] = session.client(
+                service_name=service_name,
+                config=Config(**_client_config, tcp_keepalive=True,
+                              retries={'mode': 'standard', 'total_max_attempts': 1}))
+        return _clients[service_name]
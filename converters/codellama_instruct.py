@@ -1,9 +1,19 @@
 import re
+import json
+import logging
+import botocore
+from contextlib import closing
+from functools import cached_property
 from .base import CodeConverter
+from sagemaker.session import Session
+from .clients import get_client, get_session
+from .retry import retry_after
+from .packing import PACKING_INSTRUCTIONS, first_marker, pack_routines
+from .streaming import CodeBlockStream, stream_error
 from sagemaker.predictor import Predictor
 from .exceptions import OutputTooLongException
 from sagemaker.serializers import JSONSerializer
-from converters.exceptions import ConversionError
+from converters.exceptions import ConversionError, FatalConversionError, ThrottlingError
 from sagemaker.deserializers import JSONDeserializer
 
 
@@ -38,7 +48,23 @@ def function_name(db_conn, ...):
 ```
 
 Make sure to handle database operations, such as queries and updates, by calling appropriate methods on the db_conn object instead of executing SQL directly.\n''')
+    REPAIR_TEMPLATE = ('<s>[INST] <<SYS>>\n'
+                       'You are a profficient python programmer fixing python code converted from PL/SQL.\n'
+                       '<</SYS>>\n'
+                       '\n'
+                       '''The following Python code does not compile:
+
+```python
+{PYTHON_CODE}
+```
+
+The Python compiler reports "{ERROR}" on line {LINE_NUMBER}: {LINE}
+
+Fix the error changing as little code as possible, and return the whole corrected code.[/INST]
+```python
+''')
     MAX_NEW_TOKENS = 1024
+    TEMPERATURE = 0.2
 
     def __init__(self, sagemaker_endpoint: str):
         """
@@ -46,28 +72,64 @@ Make sure to handle database operations, such as queries and updates, by calling
 
         This converter will work with the provided SageMaker endpoint for converting the given code
         """
+        super().__init__()
         self.endpoint = sagemaker_endpoint
-        self.predictor = Predictor(endpoint_name=sagemaker_endpoint,
-                                   serializer=JSONSerializer(),
-                                   deserializer=JSONDeserializer())
 
-    def _construct_payload(self, original_code: str, max_new_tokens: int, converted_code: str = '') -> dict:
+    @cached_property
+    def predictor(self) -> Predictor:
+        """
+        Predictor for the SageMaker endpoint, created on first use
+
+        The predictor uses the SageMaker runtime client shared by all the converters in the process (see
+        `clients.get_client`).
+        """
+        session = Session(boto_session=get_session(), sagemaker_runtime_client=get_client('sagemaker-runtime'))
+        return Predictor(endpoint_name=self.endpoint,
+                         sagemaker_session=session,
+                         serializer=JSONSerializer(),
+                         deserializer=JSONDeserializer())
+
+    def _construct_payload(self, original_code: str, max_new_tokens: int, converted_code: str = '',
+                           temperature: float | None = None) -> dict:
         """
         Construct the payload to be passed to the endpoint
         """
+        temperature = self.TEMPERATURE if temperature is None else temperature
         payload = {"inputs": self.PROMPT_TEMPLATE,
-                   "parameters": {"max_new_tokens": max_new_tokens, "top_p": 0.9, "temperature": 0.2,
+                   "parameters": {"max_new_tokens": max_new_tokens, "top_p": 0.9, "temperature": temperature,
                                   "decoder_input_details": False, "details": True}}
         payload['inputs'] += f'{original_code}[/INST]\n```python\n{converted_code}'.strip()
 
         return payload
 
+    def _construct_batch_payload(self, original_codes: list[str], max_new_tokens: int,
+                                 temperature: float | None = None) -> dict:
+        """
+        Construct the payload asking the model to convert several routines at once
+        """
+        temperature = self.TEMPERATURE if temperature is None else temperature
+        instructions = PACKING_INSTRUCTIONS.format(COUNT=len(original_codes))
+        return {"inputs": f'{self.PROMPT_TEMPLATE}{pack_routines(original_codes)}\n\n{instructions}[/INST]\n'
+                          f'```python\n{first_marker(original_codes)}',
+                "parameters": {"max_new_tokens": max_new_tokens, "top_p": 0.9, "temperature": temperature,
+                               "decoder_input_details": False, "details": True}}
+
+    def _construct_repair_payload(self, code: str, error: SyntaxError, max_new_tokens: int,
+                                  temperature: float | None = None) -> dict:
+        """
+        Construct the payload asking the model to fix a syntax error in the converted code
+        """
+        temperature = self.TEMPERATURE if temperature is None else temperature
+        return {"inputs": self.REPAIR_TEMPLATE.format(**self._repair_fields(code, error)),
+                "parameters": {"max_new_tokens": max_new_tokens, "top_p": 0.9, "temperature": temperature,
+                               "decoder_input_details": False, "details": True}}
+
     @property
     def fm_name(self) -> str:
         """
         Return the endpoint name
         """
-        return self.predictor.endpoint_name
+        return self.endpoint
 
     def _fm_eval(self, payload: dict):
         """
@@ -78,12 +140,14 @@ Make sure to handle database operations, such as queries and updates, by calling
         Model output, which will include free-form text and should also include a code block.
         """
         try:
+            if self.streaming:
+                return self._fm_eval_stream(payload)
             return self.predictor.predict(payload)
         except self.predictor.sagemaker_session.sagemaker_runtime_client.exceptions.ModelError as e:
             # This error code means that the context + output is too long for the model to handle -> fail
             match e.response['OriginalStatusCode']:
                 case 422:
-                    raise ConversionError('Context and requested output count too large, failing')
+                    raise FatalConversionError('Context and requested output count too large, failing')
                 case 424:
                     raise ConversionError('There was a CUDA error when attempting the code translation')
                 case 0:
@@ -92,7 +156,72 @@ Make sure to handle database operations, such as queries and updates, by calling
                     # a valid output before the 60s timeout of the SageMaker endpoint
                     raise OutputTooLongException('The input exceeds the max length for the input')
                 case _:
-                    raise ConversionError('Unknown error, failing ({e})')
+                    raise ConversionError(f'Unknown error, failing ({e})', retry_after=retry_after(e))
+        except botocore.exceptions.EventStreamError as e:
+            raise stream_error(e)
+        except botocore.exceptions.ClientError as e:
+            match e.response['Error']['Code']:
+                case 'ThrottlingException':
+                    raise ThrottlingError(f'{e}', retry_after=retry_after(e))
+                case 'ValidationError' | 'AccessDeniedException':
+                    raise FatalConversionError(f'{e}')
+                case 'ServiceUnavailable' | 'InternalFailure' | 'ModelNotReadyException':
+                    raise ConversionError(f'{e}', retry_after=retry_after(e))
+            raise
+
+    def _fm_eval_stream(self, payload: dict) -> list:
+        """
+        Eval the given payload streaming the model output, which stops as soon as the code block is closed
+        (or as soon as the partial code is found to be invalid, if `validate_partial_code` is set)
+
+        Returns
+        -------
+        Model output, with the same format as the `predict` output plus the time to first token.
+        """
+        code_block = CodeBlockStream(payload['inputs'], validate=self.validate_partial_code)
+        client = self.predictor.sagemaker_session.sagemaker_runtime_client
+        response = client.invoke_endpoint_with_response_stream(EndpointName=self.endpoint,
+                                                                Body=json.dumps({**payload, 'stream': True}),
+                                                                ContentType='application/json')
+        details, generated_tokens, buffer = {'finish_reason': None}, 0, b''
+        with closing(response['Body']) as events:
+            for event in events:
+                # The endpoint sends server-sent events, which might be split between payload parts
+                buffer += event['PayloadPart']['Bytes']
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    if not line.startswith(b'data:'):
+                        continue
+                    data = json.loads(line[len(b'data:'):])
+                    generated_tokens += 1
+                    details = data.get('details') or details
+                    if not data['token']['special'] and code_block.feed(data['token']['text']):
+                        details = {**details, 'finish_reason': 'eos_token'}
+                        break
+                if code_block.closed:
+                    break
+        logging.debug(f'\t\t\tTime to first token: {code_block.time_to_first_token}s')
+        return [{'generated_text': code_block.text,
+                 'details': {'generated_tokens': generated_tokens, **details,
+                             'time_to_first_token': code_block.time_to_first_token}}]
+
+    def _output_tokens(self, response) -> int | None:
+        """
+        Return the number of output tokens generated by the FM for the given response
+        """
+        return response[0]['details']['generated_tokens']
+
+    def _stop_reason(self, response) -> str | None:
+        """
+        Return the reason why the FM stopped generating the given response
+        """
+        return response[0]['details'].get('finish_reason')
+
+    def _time_to_first_token(self, response) -> float | None:
+        """
+        Return the time until the first token of the given response was received, if it was streamed
+        """
+        return response[0]['details'].get('time_to_first_token')
 
     def _extract_code(self, response: dict, payload: dict) -> (str, bool):
         """
@@ -0,0 +1,154 @@
+import re
+from typing import NamedTuple
+
+# Comments and quoted text (string literals, q-quoted literals and quoted identifiers) in PL/SQL code, the latter
+# being kept untouched. Unterminated comments / literals extend to the end of the code (see `splitter`).
+TOKEN_PATTERN = re.compile(r'''
+    (?P<comment>
+        --[^\n]*
+        | /\*.*?(?:\*/|\Z)
+    )
+    | (?P<literal>
+        [nN]?[qQ]'(?:\[.*?(?:\]'|\Z) | \{.*?(?:\}'|\Z) | \(.*?(?:\)'|\Z) | <.*?(?:>'|\Z)
+                     | (?P<delimiter>[^\s\[{(<]).*?(?:(?P=delimiter)'|\Z))
+        | '[^']*(?:''[^']*)*(?:'|\Z)
+        | "[^"]*(?:"|\Z)
+    )
+''', flags=re.VERBOSE | re.DOTALL)
+# Comments made only of punctuation, e.g. `-----------` or `/*********/`
+BANNER_PATTERN = re.compile(r'--[\W_]*|/\*[\W_]*(?:\*/)?')
+# Licence phrasing, a comment that merely mentions copyright (e.g. a business rule) is not a licence header
+LICENCE_PATTERN = re.compile(r'\bcopyright\s*(?:\(c\)|©|\d{4})|\ball\s+rights\s+reserved\b|\blicensed\s+under\b'
+                             r'|\bSPDX-License-Identifier\b', flags=re.IGNORECASE)
+TRAILING_WHITESPACE_PATTERN = re.compile(r'[ \t]+(?=\n)')
+INNER_WHITESPACE_PATTERN = re.compile(r'(?<=\S)[ \t]{2,}')
+BLANK_LINES_PATTERN = re.compile(r'\n(?:[ \t]*\n){2,}')
+# Tag of a shortened comment, found in a Python comment of the converted code along with what's left of the comment
+TAG_PATTERN = re.compile(r'^(?P<prefix>(?P<indentation>[ \t]*)[^\n#]*#[^\n]*?)(?P<tag>\[#\d+\])[^\n]*',
+                         flags=re.MULTILINE)
+
+
+class CompactedSource(NamedTuple):
+    """
+    PL/SQL code compacted before being sent to the FM (see `compact_source`)
+    """
+    code: str
+    # Length of the code before being compacted
+    original_length: int
+    # Full text of the shortened comments, by the tag left in their place
+    comments: dict[str, str] = {}
+
+    @property
+    def saved_characters(self) -> int:
+        """
+        Return the number of characters removed from the code
+        """
+        return self.original_length - len(self.code)
+
+    def restore(self, converted_code: str) -> str:
+        """
+        Put the full text of the shortened comments back into the Python code converted from the compacted code
+
+        The comments are found by their tags, which the FM usually keeps when converting the PL/SQL comments
+        into Python comments. Tags that were dropped by the FM can't be restored.
+        """
+        if not self.comments:
+            return converted_code
+
+        def expand(match: re.Match) -> str:
+            text = self.comments.get(match.group('tag'))
+            if text is None:
+                return match.group()
+            return match.group('prefix') + f'\n{match.group("indentation")}# '.join(text.splitlines())
+
+        return TAG_PATTERN.sub(expand, converted_code)
+
+
+def _compact_whitespace(code: str) -> str:
+    """
+    Remove the trailing whitespace, the runs of spaces inside lines and the consecutive blank lines of code that
+    contains neither comments nor quoted text
+    """
+    code = TRAILING_WHITESPACE_PATTERN.sub('', code)
+    code = INNER_WHITESPACE_PATTERN.sub(' ', code)
+    return BLANK_LINES_PATTERN.sub('\n\n', code)
+
+
+def _comment_text(comment: str) -> str:
+    """
+    Return the text of a comment, without its delimiters (nor the leading `*` of the lines of block comments)
+    """
+    if comment.startswith('--'):
+        return comment[2:].strip()
+    lines = comment[2:].removesuffix('*/').splitlines()
+    return '\n'.join(line.strip().lstrip('*').strip() for line in lines if line.strip().lstrip('*').strip())
+
+
+def _is_removable(comment: str, header: bool) -> bool:
+    """
+    Return whether a comment carries no information about the code, i.e. it's a banner or a licence header
+
+    Parameters
+    ----------
+    comment : Text of the comment, with its delimiters
+    header : Whether the comment is in the header of the routine, i.e. before its code
+    """
+    if comment.startswith(('--+', '/*+')):
+        # Optimizer hint
+        return False
+    return BANNER_PATTERN.fullmatch(comment) is not None or (header and LICENCE_PATTERN.search(comment) is not None)
+
+
+def compact_source(code: str, max_comment_length: int | None = None) -> CompactedSource:
+    """
+    Compact PL/SQL code to reduce the input tokens of the conversion prompts, without changing its meaning
+
+    Banner comments (e.g. `-----------`) and licence headers (licence comments before the code of the routine)
+    are removed, along with trailing whitespace, runs of spaces inside lines and consecutive blank lines.
+    Optimizer hints, string literals and quoted identifiers are kept as they are. Comments longer than
+    `max_comment_length` are shortened and tagged (e.g. `-- [#1] Computes the...`), so their full text can be put
+    back into the converted code with `CompactedSource.restore`.
+
+    Parameters
+    ----------
+    code : PL/SQL code of a routine
+    max_comment_length : Maximum length of the text of the comments, comments are not shortened if not given
+
+    Returns
+    -------
+    The compacted code, along with the full text of the shortened comments
+    """
+    parts, comments = [], {}
+    position = 0
+    header = True
+    for token in TOKEN_PATTERN.finditer(code):
+        parts.append(_compact_whitespace(code[position:token.start()]))
+        header = header and not parts[-1].strip()
+        position = token.end()
+        text = token.group()
+        if token.lastgroup == 'literal':
+            header = False
+            parts.append(text)
+        elif _is_removable(text, header):
+            parts[-1] = parts[-1].rstrip(' \t')
+            previous = next((part for part in reversed(parts) if part), None)
+            if previous is None or previous.endswith('\n'):
+                if code.startswith('\n', position):
+                    # The comment was on its own line, remove the line too
+                    position += 1
+            elif position < len(code) and not code[position].isspace():
+                # Keep the tokens around the comment apart, e.g. `a/*--*/b`
+                parts.append(' ')
+        elif max_comment_length is not None and len(comment := _comment_text(text)) > max_comment_length:
+            tag = f'[#{len(comments) + 1}]'
+            shortened = f'{tag} {" ".join(comment.split())[:max_comment_length].rstrip()}...'
+            shortened = f'-- {shortened}' if text.startswith('--') else f'/* {shortened} */'
+            if len(shortened) < len(text):
+                comments[tag] = comment
+                parts.append(shortened)
+            else:
+                parts.append(text)
+        else:
+            parts.append(text)
+    parts.append(_compact_whitespace(code[position:]))
+    return CompactedSource(''.join(parts).strip('\n'), len(code), comments)
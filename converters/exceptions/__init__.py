@@ -2,7 +2,18 @@ class ConversionError(RuntimeError):
     """
     Custom exception to be raised when the code could not be converted
     """
-    ...
+
+    def __init__(self, *args, retry_after: float | None = None):
+        """
+        Create the exception
+
+        Parameters
+        ----------
+        args : Exception arguments (usually, the error message)
+        retry_after : Time (in seconds) to wait before retrying the request, if suggested by the backend
+        """
+        super().__init__(*args)
+        self.retry_after = retry_after
 
 
 class OutputTooLongException(ConversionError):
@@ -15,3 +26,39 @@ class BackendTimeoutError(ConversionError):
     """
     Exception raised when the backend times out
     """
+
+
+class ThrottlingError(ConversionError):
+    """
+    Exception raised when the backend throttles the request
+    """
+
+
+class InvalidCodeError(ConversionError):
+    """
+    Exception raised when the code generated so far is already invalid, so the generation can be abandoned
+    """
+
+
+class SeedsExhaustedError(ConversionError):
+    """
+    Exception raised when none of the conversion attempts (seeds) produced complete code that compiles
+    """
+
+
+class RetriesExhaustedError(SeedsExhaustedError):
+    """
+    Exception raised when a chunk of the converted code could not be generated after all the retries
+    """
+
+
+class FatalConversionError(ConversionError):
+    """
+    Exception raised when the request is rejected by the backend and retrying it won't help (e.g. invalid request)
+    """
+
+
+class RequestCancelledError(ConversionError):
+    """
+    Exception raised when a request is cancelled while the FM output is streamed (e.g. a hedged request that lost)
+    """
@@ -0,0 +1,296 @@
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from collections import deque
+from collections.abc import Awaitable, Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from converters.timing import percentile
+
+# Event set when the request running in the current context is no longer needed (see `cancellation_event`)
+_cancel_event: contextvars.ContextVar = contextvars.ContextVar('cancel_event', default=None)
+# Copy of a hedged request running in the current context (see `request_sent`)
+_current_copy: contextvars.ContextVar = contextvars.ContextVar('current_copy', default=None)
+
+
+class _ChainedEvent:
+    """
+    Event set when either of two events is set, e.g. a hedged request that lost the race or whose seed was
+    cancelled
+    """
+
+    def __init__(self, event: threading.Event, parent: 'threading.Event | _ChainedEvent'):
+        self.event = event
+        self.parent = parent
+
+    def is_set(self) -> bool:
+        return self.event.is_set() or self.parent.is_set()
+
+
+class _Copy:
+    """
+    Copy of a request run by a hedging policy
+    """
+
+    def __init__(self, sent: threading.Event | asyncio.Event):
+        self.cancel = threading.Event()
+        # Set once the request is sent (or once it's done, if it never signals it)
+        self.sent = sent
+        self.sent_at = time.perf_counter()
+
+    def mark_sent(self) -> None:
+        self.sent_at = time.perf_counter()
+        self.sent.set()
+
+
+def cancellation_event() -> threading.Event | _ChainedEvent | None:
+    """
+    Return the event signaling that the request running in the current context can be abandoned, if any
+
+    Requests whose output is streamed check this event, so a hedged request that lost the race stops
+    generating (and holding a connection) instead of running to completion in the background.
+    """
+    return _cancel_event.get()
+
+
+def run_cancellable(cancel: threading.Event, call: Callable, *args):
+    """
+    Run a request (or a coroutine function) that can be abandoned by setting the given event
+
+    The event is made available to the code run by the request through `cancellation_event`, chained to the event
+    of the enclosing request if any (e.g. a hedged request of a seed is abandoned when the seed is cancelled). The
+    request must be run in its own context (e.g. with `contextvars.Context.run`, or as an `asyncio` task).
+    """
+    parent = _cancel_event.get()
+    _cancel_event.set(cancel if parent is None else _ChainedEvent(cancel, parent))
+    return call(*args)
+
+
+def request_sent() -> None:
+    """
+    Signal that the request running in the current context is being sent to the FM
+
+    Hedged requests start their hedging delay when they're sent, so the time spent waiting for a thread, the rate
+    limiter or the circuit breaker is not mistaken for a slow request. Functions hedged with `HedgingPolicy` must
+    call it right before sending the request, otherwise they're never hedged.
+    """
+    copy = _current_copy.get()
+    if copy is not None:
+        copy.mark_sent()
+
+
+class HedgingPolicy:
+    """
+    Policy hedging slow FM requests, to cut the tail latency of the conversions
+
+    The latency of the recent requests is tracked, and a request that hasn't returned after the given quantile
+    of those latencies (e.g. the p95) is sent again: the first copy to finish successfully is used, and the other
+    one is cancelled. Since the hedged requests are paid for, they are limited by a budget, a maximum fraction of
+    the requests that can be hedged (e.g. 5%, so the cost increases by 5% at most).
+
+    The policy is thread-safe, and can also be used from asynchronous code with `acall`.
+    """
+
+    def __init__(self, quantile: float = 0.95, budget: float = 0.05, window: int = 100, min_samples: int = 20,
+                 max_workers: int = 64):
+        """
+        Create a hedging policy
+
+        Parameters
+        ----------
+        quantile : Quantile of the recent latencies after which a request is hedged
+        budget : Maximum fraction of the requests that can be hedged
+        window : Number of recent latencies used to compute the quantile
+        min_samples : Minimum number of latencies needed before hedging any request
+        max_workers : Maximum number of threads running requests (and their hedges) for `call`, which should be
+            the maximum number of requests in flight (twice the number of requests that may be hedged)
+        """
+        self.quantile = quantile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self.requests = 0
+        self.hedges = 0
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._executor: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def delay(self) -> float | None:
+        """
+        Return the time (in seconds) after which a request is hedged, or `None` if there are not enough samples yet
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            return percentile(list(self._latencies), self.quantile)
+
+    def record(self, latency: float) -> None:
+        """
+        Record the latency of a successful request
+        """
+        with self._lock:
+            self._latencies.append(latency)
+
+    def _start_request(self) -> float | None:
+        """
+        Count a new request against the budget, returning the time after which it must be hedged (see `delay`)
+        """
+        delay = self.delay()
+        with self._lock:
+            self.requests += 1
+        return delay
+
+    def _try_hedge(self) -> bool:
+        """
+        Return whether a request can be hedged within the budget, counting the hedge if so
+        """
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                return False
+            self.hedges += 1
+            return True
+
+    @staticmethod
+    def _run(copy: _Copy, call: Callable, *args):
+        """
+        Run a copy of a request in the current context
+        """
+        _current_copy.set(copy)
+        try:
+            return run_cancellable(copy.cancel, call, *args)
+        finally:
+            copy.sent.set()
+
+    @staticmethod
+    async def _arun(copy: _Copy, call: Callable[..., Awaitable], *args):
+        """
+        Run a copy of a request in the current context without blocking the event loop
+        """
+        _current_copy.set(copy)
+        try:
+            return await run_cancellable(copy.cancel, call, *args)
+        finally:
+            copy.sent.set()
+
+    def _submit(self, call: Callable, args: tuple) -> tuple[Future, _Copy]:
+        """
+        Run a copy of a request in the thread pool, returning its future and the copy
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hedging')
+        copy = _Copy(threading.Event())
+        # The request runs in a copy of the current context, so it's traced under the current span
+        return self._executor.submit(contextvars.copy_context().run, self._run, copy, call, *args), copy
+
+    def call(self, call: Callable, *args, on_hedge: Callable[[], None] | None = None):
+        """
+        Run a request, hedging it if it's too slow
+
+        Each copy of the request runs `call` on its own, so anything it does before sending the request (e.g.
+        waiting for the rate limiter) is done by each copy, see `request_sent`.
+
+        Parameters
+        ----------
+        call : Function sending the request
+        args : Arguments of the function
+        on_hedge : Function called when the request is hedged, if any
+
+        Returns
+        -------
+        The result of the first copy of the request to succeed. If all of them fail, the first error is raised.
+        """
+        delay = self._start_request()
+        if delay is None:
+            copy = _Copy(threading.Event())
+            result = contextvars.copy_context().run(self._run, copy, call, *args)
+            self.record(time.perf_counter() - copy.sent_at)
+            return result
+
+        primary, copy = self._submit(call, args)
+        attempts = {primary: copy}
+        copy.sent.wait()
+        if not wait([primary], timeout=delay).done and self._try_hedge():
+            logging.info(f'\t\t\tNo response after {delay:.1f}s, hedging the request')
+            if on_hedge is not None:
+                on_hedge()
+            hedge, hedge_copy = self._submit(call, args)
+            attempts[hedge] = hedge_copy
+        pending, error = set(attempts), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = error or future.exception()
+                    continue
+                for other in pending:
+                    attempts[other].cancel.set()
+                    other.cancel()
+                self.record(time.perf_counter() - copy.sent_at)
+                return future.result()
+        raise error
+
+    async def acall(self, call: Callable[..., Awaitable], *args, on_hedge: Callable[[], None] | None = None):
+        """
+        Run a request without blocking the event loop, hedging it if it's too slow, see `call`
+        """
+        delay = self._start_request()
+        if delay is None:
+            copy = _Copy(asyncio.Event())
+            result = await asyncio.ensure_future(self._arun(copy, call, *args))
+            self.record(time.perf_counter() - copy.sent_at)
+            return result
+
+        copy = _Copy(asyncio.Event())
+        # Each copy runs as its own task, hence in its own context
+        attempts = {asyncio.ensure_future(self._arun(copy, call, *args)): copy}
+        try:
+            await copy.sent.wait()
+            done, _ = await asyncio.wait(attempts, timeout=delay)
+            if not done and self._try_hedge():
+                logging.info(f'\t\t\tNo response after {delay:.1f}s, hedging the request')
+                if on_hedge is not None:
+                    on_hedge()
+                hedge = _Copy(asyncio.Event())
+                attempts[asyncio.ensure_future(self._arun(hedge, call, *args))] = hedge
+            pending, error = set(attempts), None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    self.record(time.perf_counter() - copy.sent_at)
+                    return task.result()
+            raise error
+        finally:
+            # Cancel the copies that are still running (i.e. the one that lost, or all of them if cancelled)
+            for task, attempt in attempts.items():
+                if not task.done():
+                    attempt.cancel.set()
+                    task.cancel()
+
+
+# Hedging policies shared by all the converters in the process, by backend (model ID / endpoint name)
+_hedging_policies: dict[str, HedgingPolicy] = {}
+_hedging_policies_lock = threading.Lock()
+
+
+def get_hedging_policy(backend: str, **kwargs) -> HedgingPolicy:
+    """
+    Return the hedging policy shared by all the converters using the given backend
+
+    Parameters
+    ----------
+    backend : Name of the backend (model ID or endpoint name)
+    kwargs : Arguments used to create the hedging policy (see `HedgingPolicy`) if it doesn't exist yet
+
+    Returns
+    -------
+    The hedging policy for the backend
+    """
+    with _hedging_policies_lock:
+        if backend not in _hedging_policies:
+            _hedging_policies[backend] = HedgingPolicy(**kwargs)
+        return _hedging_policies[backend]
@@ -0,0 +1,116 @@
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+
+
+class ConversionJournal:
+    """
+    Append-only journal of the routines processed for a source file
+
+    Every routine that gets written to the converted / non-converted files is recorded as a JSON line
+    with its status, the offset where it was written and the written text. Records are flushed to disk
+    as soon as they are written, so an interrupted run can be resumed by skipping the routines already
+    in the journal and rebuilding the output files from their records.
+
+    Only the positions of the records of the previous run are kept in memory, their output is read from the
+    journal when looked up, so the memory used doesn't grow with the size of the converted files.
+    """
+    CONVERTED = 'converted'
+    FAILED = 'failed'
+
+    def __init__(self, path: Path, resume: bool = False):
+        """
+        Open the journal stored in the given file
+
+        Parameters
+        ----------
+        path : Path to the journal file
+        resume : Whether to load the records of a previous run or to start a new journal
+        """
+        path.parent.mkdir(exist_ok=True, parents=True)
+        self.path = path
+        # Status, position and length (in bytes) in the journal of the record of each routine of the previous run
+        self._index = self._read(path) if resume and path.exists() else {}
+        self._reader = path.open('rb') if self._index else None
+        self._file = path.open('at' if resume else 'wt')
+        if self._file.tell() > 0 and not path.read_bytes().endswith(b'\n'):
+            # The previous run was interrupted while writing a record -> skip the partial line
+            self._file.write('\n')
+
+    @staticmethod
+    def digest(routine_code: str) -> str:
+        """
+        Return the hash used to identify a routine in the journal
+        """
+        return hashlib.sha256(routine_code.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _read(path: Path) -> dict[str, tuple[str, int, int]]:
+        """
+        Index the records in the journal by routine digest (later records take precedence), see `lookup`
+        """
+        index = {}
+        position = 0
+        with path.open('rb') as journal:
+            for line in journal:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logging.warning(f'Skipping corrupted record in journal {path}')
+                else:
+                    index[record['digest']] = (record['status'], position, len(line))
+                position += len(line)
+        return index
+
+    def lookup(self, routine_code: str) -> dict | None:
+        """
+        Return the record of a routine processed in a previous run, if any
+
+        Parameters
+        ----------
+        routine_code : PL/SQL code for the procedure / function
+
+        Returns
+        -------
+        The journal record, including the `status` and the `output` written for the routine, or `None`
+        """
+        entry = self._index.get(self.digest(routine_code))
+        if entry is None:
+            return None
+        _, position, length = entry
+        self._reader.seek(position)
+        return json.loads(self._reader.read(length))
+
+    def record(self, routine_code: str, routine_name: str, status: str, offset: int, output: str) -> None:
+        """
+        Append a record for the given routine to the journal
+
+        Parameters
+        ----------
+        routine_code : PL/SQL code for the procedure / function
+        routine_name : Name (first line) of the routine
+        status : Either `CONVERTED` or `FAILED`
+        offset : Offset in the converted (or non-converted, if failed) file where the output was written
+        output : Text written to the output file
+        """
+        record = {'digest': self.digest(routine_code), 'routine': routine_name,
+                  'status': status, 'offset': offset, 'output': output}
+        self._file.write(json.dumps(record) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        """
+        Close the journal file
+        """
+        if self._reader is not None:
+            self._reader.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,9 +1,15 @@
 import re
 import json
-import boto3
+import logging
 import botocore
+from contextlib import closing
+from functools import cached_property
 from .base import CodeConverter
-from converters.exceptions import BackendTimeoutError, ConversionError
+from .clients import get_client
+from .retry import retry_after
+from .packing import PACKING_INSTRUCTIONS, first_marker, pack_routines
+from .streaming import CodeBlockStream, stream_error
+from converters.exceptions import BackendTimeoutError, ConversionError, FatalConversionError, ThrottlingError
 
 
 class BedrockLlamaConverter(CodeConverter):
@@ -37,7 +43,23 @@ def function_name(db_conn, ...):
 ```
 
 Make sure to handle database operations, such as queries and updates, by calling appropriate methods on the db_conn object instead of executing SQL directly.\n''')
+    REPAIR_TEMPLATE = ('<s>[INST] <<SYS>>\n'
+                       'You are a profficient python programmer fixing python code converted from PL/SQL.\n'
+                       '<</SYS>>\n'
+                       '\n'
+                       '''The following Python code does not compile:
+
+```python
+{PYTHON_CODE}
+```
+
+The Python compiler reports "{ERROR}" on line {LINE_NUMBER}: {LINE}
+
+Fix the error changing as little code as possible, and return the whole corrected code.[/INST]
+```python
+''')
     MAX_NEW_TOKENS = 2048
+    TEMPERATURE = 0.2
 
     def __init__(self, model_id: str = 'meta.llama3-8b-instruct-v1:0'):
         """
@@ -45,8 +67,15 @@ Make sure to handle database operations, such as queries and updates, by calling
 
         This converter will work with the provided SageMaker endpoint for converting the given code
         """
+        super().__init__()
         self.model_id = model_id
-        self.client = boto3.client(service_name='bedrock-runtime')
+
+    @cached_property
+    def client(self):
+        """
+        Amazon Bedrock runtime client, shared by all the converters in the process (see `clients.get_client`)
+        """
+        return get_client('bedrock-runtime')
 
     @property
     def fm_name(self) -> str:
@@ -55,19 +84,42 @@ Make sure to handle database operations, such as queries and updates, by calling
         """
         return self.model_id
 
-    def _construct_payload(self, original_code: str, max_new_tokens: int, converted_code: str = '') -> dict:
+    def _construct_payload(self, original_code: str, max_new_tokens: int, converted_code: str = '',
+                           temperature: float | None = None) -> dict:
         """
         Construct the payload to be passed to the endpoint
         """
         # Force the output style to start with code, optionally filling in preexisting code
         payload = {'prompt': self.PROMPT_TEMPLATE,
-                   'temperature': 0.2,
+                   'temperature': self.TEMPERATURE if temperature is None else temperature,
                    'top_p': 0.9,
                    'max_gen_len': max_new_tokens}
         payload['prompt'] += f'{original_code}[/INST]\n```python\n{converted_code}'.strip()
 
         return payload
 
+    def _construct_batch_payload(self, original_codes: list[str], max_new_tokens: int,
+                                 temperature: float | None = None) -> dict:
+        """
+        Construct the payload asking the model to convert several routines at once
+        """
+        instructions = PACKING_INSTRUCTIONS.format(COUNT=len(original_codes))
+        return {'prompt': f'{self.PROMPT_TEMPLATE}{pack_routines(original_codes)}\n\n{instructions}[/INST]\n'
+                          f'```python\n{first_marker(original_codes)}',
+                'temperature': self.TEMPERATURE if temperature is None else temperature,
+                'top_p': 0.9,
+                'max_gen_len': max_new_tokens}
+
+    def _construct_repair_payload(self, code: str, error: SyntaxError, max_new_tokens: int,
+                                  temperature: float | None = None) -> dict:
+        """
+        Construct the payload asking the model to fix a syntax error in the converted code
+        """
+        return {'prompt': self.REPAIR_TEMPLATE.format(**self._repair_fields(code, error)),
+                'temperature': self.TEMPERATURE if temperature is None else temperature,
+                'top_p': 0.9,
+                'max_gen_len': max_new_tokens}
+
     def _fm_eval(self, payload: dict):
         """
         Eval the given payload with the underlyinf Foundation Model
@@ -77,11 +129,75 @@ Make sure to handle database operations, such as queries and updates, by calling
         Model output, which will include free-form text and should also include a code block.
         """
         try:
+            if self.streaming:
+                return self._fm_eval_stream(payload)
             response = self.client.invoke_model(body=json.dumps(payload), modelId=self.model_id)
         except (botocore.exceptions.ReadTimeoutError, self.client.exceptions.ModelTimeoutException) as e:
             raise BackendTimeoutError(f'{e}')
+        except self.client.exceptions.ThrottlingException as e:
+            raise ThrottlingError(f'{e}', retry_after=retry_after(e))
+        except (self.client.exceptions.ValidationException, self.client.exceptions.AccessDeniedException,
+                self.client.exceptions.ResourceNotFoundException) as e:
+            raise FatalConversionError(f'{e}')
+        except (self.client.exceptions.ServiceUnavailableException, self.client.exceptions.InternalServerException,
+                self.client.exceptions.ModelNotReadyException) as e:
+            raise ConversionError(f'{e}', retry_after=retry_after(e))
+        except botocore.exceptions.EventStreamError as e:
+            raise stream_error(e)
         return json.loads(response.get('body').read())
 
+    def _fm_eval_stream(self, payload: dict) -> dict:
+        """
+        Eval the given payload streaming the model output, which stops as soon as the code block is closed
+        (or as soon as the partial code is found to be invalid, if `validate_partial_code` is set)
+
+        Returns
+        -------
+        Model output, with the same format as the `invoke_model` output plus the time to first token.
+        """
+        code_block = CodeBlockStream(payload['prompt'], validate=self.validate_partial_code)
+        response = self.client.invoke_model_with_response_stream(body=json.dumps(payload), modelId=self.model_id)
+        stop_reason, prompt_tokens, generation_tokens = None, 0, 0
+        with closing(response['body']) as events:
+            for event in events:
+                chunk = json.loads(event['chunk']['bytes'])
+                prompt_tokens = chunk.get('prompt_token_count') or prompt_tokens
+                generation_tokens = chunk.get('generation_token_count') or generation_tokens
+                if code_block.feed(chunk.get('generation', '')):
+                    stop_reason = 'stop'
+                    break
+                stop_reason = chunk.get('stop_reason') or stop_reason
+        logging.debug(f'\t\t\tTime to first token: {code_block.time_to_first_token}s')
+        return {'generation': code_block.text,
+                'stop_reason': stop_reason,
+                'prompt_token_count': prompt_tokens,
+                'generation_token_count': generation_tokens,
+                'time_to_first_token': code_block.time_to_first_token}
+
+    def _output_tokens(self, response) -> int | None:
+        """
+        Return the number of output tokens generated by the FM for the given response
+        """
+        return response['generation_token_count']
+
+    def _input_tokens(self, response) -> int | None:
+        """
+        Return the number of input tokens processed by the FM for the given response
+        """
+        return response['prompt_token_count']
+
+    def _stop_reason(self, response) -> str | None:
+        """
+        Return the reason why the FM stopped generating the given response
+        """
+        return response['stop_reason']
+
+    def _time_to_first_token(self, response) -> float | None:
+        """
+        Return the time until the first token of the given response was received, if it was streamed
+        """
+        return response.get('time_to_first_token')
+
     def _extract_code(self, response: dict, payload: dict) -> (str, bool):
         """
         Extract the converted code from the FM response.
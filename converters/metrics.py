@@ -0,0 +1,226 @@
+import os
+import json
+import threading
+from pathlib import Path
+from collections import Counter
+
+
+class ConversionMetrics:
+    """
+    Metrics of the conversion of a single routine
+
+    The converter records every FM call (latency, token usage, stop reason or error), the number of seeds and
+    chunks used and the reasons why requests or seeds were retried.
+    """
+    CONVERTED = 'converted'
+    FAILED = 'failed'
+    CACHED = 'cached'
+
+    def __init__(self, routine: str = '', fm_name: str = ''):
+        """
+        Create the metrics for a routine
+
+        Parameters
+        ----------
+        routine : Name of the routine being converted
+        fm_name : Name of the model used for the conversion
+        """
+        self.routine = routine
+        self.fm_name = fm_name
+        self.calls: list[dict] = []
+        self.seeds = 0
+        self.chunks = 0
+        self.retries: Counter = Counter()
+        # Input tokens saved in each FM request by compacting the original code (see `compaction`)
+        self.saved_input_tokens = 0
+        self.status: str | None = None
+        # Total time taken to convert the routine, in seconds
+        self.latency: float | None = None
+        self._lock = threading.Lock()
+
+    def record_call(self, latency: float, input_tokens: int | None = None, output_tokens: int | None = None,
+                    stop_reason: str | None = None, time_to_first_token: float | None = None,
+                    error: str | None = None) -> None:
+        """
+        Record a call to the FM
+
+        Parameters
+        ----------
+        latency : Time taken by the call, in seconds
+        input_tokens : Number of input tokens, if reported by the backend
+        output_tokens : Number of output tokens, if reported by the backend
+        stop_reason : Reason why the FM stopped generating, if reported by the backend
+        time_to_first_token : Time until the first token was received, if the output was streamed
+        error : Name of the exception raised by the call, if it failed
+        """
+        with self._lock:
+            self.calls.append({'latency': latency, 'input_tokens': input_tokens, 'output_tokens': output_tokens,
+                               'stop_reason': stop_reason, 'time_to_first_token': time_to_first_token,
+                               'error': error})
+
+    def record_retry(self, reason: str) -> None:
+        """
+        Record that a request or a seed was retried for the given reason
+        """
+        with self._lock:
+            self.retries[reason] += 1
+
+    def to_dict(self) -> dict:
+        """
+        Return the metrics as a dictionary that can be serialized as JSON
+        """
+        with self._lock:
+            calls = list(self.calls)
+            retries = dict(self.retries)
+        return {'routine': self.routine,
+                'fm_name': self.fm_name,
+                'status': self.status,
+                'latency': self.latency,
+                'seeds': self.seeds,
+                'chunks': self.chunks,
+                'fm_calls': len(calls),
+                'fm_latency': sum(call['latency'] for call in calls),
+                'input_tokens': sum(call['input_tokens'] or 0 for call in calls),
+                'output_tokens': sum(call['output_tokens'] or 0 for call in calls),
+                'saved_input_tokens': self.saved_input_tokens,
+                'stop_reasons': dict(Counter(call['stop_reason'] for call in calls if call['stop_reason'])),
+                'errors': dict(Counter(call['error'] for call in calls if call['error'])),
+                'retries': retries,
+                'calls': calls}
+
+
+class MetricsCollector:
+    """
+    Thread-safe collector of the metrics of the routines converted in a run, aggregated per file and per run
+    """
+    # Prefix of the metrics exported in the Prometheus text format
+    PROMETHEUS_PREFIX = 'plsql_conversion'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.routines: list[dict] = []
+
+    def add(self, source_file: str, metrics: ConversionMetrics) -> None:
+        """
+        Add the metrics of a routine found in the given source file
+        """
+        self.extend([{'file': source_file, **metrics.to_dict()}])
+
+    def extend(self, routines: list[dict]) -> None:
+        """
+        Add the metrics of several routines, as collected by another collector (e.g. in another process)
+        """
+        with self._lock:
+            self.routines.extend(routines)
+
+    @staticmethod
+    def _aggregate(routines: list[dict]) -> dict:
+        """
+        Aggregate the metrics of the given routines
+        """
+        totals = {'routines': len(routines),
+                  'status': Counter(),
+                  'latency': 0.0,
+                  'seeds': 0,
+                  'chunks': 0,
+                  'fm_calls': 0,
+                  'fm_latency': 0.0,
+                  'input_tokens': 0,
+                  'output_tokens': 0,
+                  'saved_input_tokens': 0,
+                  'stop_reasons': Counter(),
+                  'errors': Counter(),
+                  'retries': Counter()}
+        for routine in routines:
+            totals['status'][routine['status']] += 1
+            totals['latency'] += routine['latency'] or 0.0
+            for key in ('seeds', 'chunks', 'fm_calls', 'fm_latency', 'input_tokens', 'output_tokens',
+                        'saved_input_tokens'):
+                totals[key] += routine[key]
+            for key in ('stop_reasons', 'errors', 'retries'):
+                totals[key].update(routine[key])
+        return {key: dict(value) if isinstance(value, Counter) else value for key, value in totals.items()}
+
+    def summary(self) -> dict:
+        """
+        Return the metrics aggregated for the whole run and per file, along with the metrics of each routine
+        """
+        with self._lock:
+            routines = list(self.routines)
+        files = {}
+        for routine in routines:
+            files.setdefault(routine['file'], []).append(routine)
+        return {'run': self._aggregate(routines),
+                'files': {source_file: self._aggregate(file_routines)
+                          for source_file, file_routines in files.items()},
+                'routines': routines}
+
+    def write_json(self, path: Path) -> None:
+        """
+        Write the metrics summary (see `summary`) to the given JSON file
+        """
+        self._write(path, json.dumps(self.summary(), indent=2) + '\n')
+
+    def write_prometheus(self, path: Path) -> None:
+        """
+        Write the metrics aggregated per file to the given file, in the Prometheus text format
+
+        The file is replaced atomically, so it can be read at any time by the node exporter's textfile collector.
+        """
+        metrics = {'routines_total': ('counter', 'Routines processed, by status'),
+                   'routine_seconds_total': ('counter', 'Time spent converting routines'),
+                   'seeds_total': ('counter', 'Conversion attempts started'),
+                   'chunks_total': ('counter', 'Conversion chunks requested'),
+                   'fm_calls_total': ('counter', 'Calls to the FM'),
+                   'fm_call_seconds_total': ('counter', 'Time spent in calls to the FM'),
+                   'input_tokens_total': ('counter', 'Input tokens processed by the FM'),
+                   'output_tokens_total': ('counter', 'Output tokens generated by the FM'),
+                   'saved_input_tokens_total': ('counter', 'Input tokens saved per request by compacting the code'),
+                   'stop_reasons_total': ('counter', 'FM calls, by stop reason'),
+                   'errors_total': ('counter', 'Failed FM calls, by exception'),
+                   'retries_total': ('counter', 'Requests or conversion attempts retried, by reason')}
+        summary = self.summary()
+        samples = {name: [] for name in metrics}
+        for source_file, totals in summary['files'].items():
+            fm_names = {routine['fm_name'] for routine in summary['routines'] if routine['file'] == source_file}
+            labels = {'fm_name': ','.join(sorted(fm_names)), 'file': source_file}
+            for status, value in totals['status'].items():
+                samples['routines_total'].append(({**labels, 'status': status}, value))
+            samples['routine_seconds_total'].append((labels, totals['latency']))
+            samples['seeds_total'].append((labels, totals['seeds']))
+            samples['chunks_total'].append((labels, totals['chunks']))
+            samples['fm_calls_total'].append((labels, totals['fm_calls']))
+            samples['fm_call_seconds_total'].append((labels, totals['fm_latency']))
+            samples['input_tokens_total'].append((labels, totals['input_tokens']))
+            samples['output_tokens_total'].append((labels, totals['output_tokens']))
+            samples['saved_input_tokens_total'].append((labels, totals['saved_input_tokens']))
+            for key, label in (('stop_reasons', 'stop_reason'), ('errors', 'error'), ('retries', 'reason')):
+                for value, count in totals[key].items():
+                    samples[f'{key}_total'].append(({**labels, label: value}, count))
+
+        lines = []
+        for name, (kind, description) in metrics.items():
+            full_name = f'{self.PROMETHEUS_PREFIX}_{name}'
+            lines.append(f'# HELP {full_name} {description}')
+            lines.append(f'# TYPE {full_name} {kind}')
+            for labels, value in samples[name]:
+                label_text = ','.join(f'{key}="{self._escape(str(label))}"' for key, label in labels.items())
+                lines.append(f'{full_name}{{{label_text}}} {value}')
+        self._write(path, '\n'.join(lines) + '\n')
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        """
+        Escape a label value for the Prometheus text format
+        """
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    @staticmethod
+    def _write(path: Path, text: str) -> None:
+        """
+        Atomically replace the contents of the given file
+        """
+        path.parent.mkdir(exist_ok=True, parents=True)
+        temp_path = path.with_name(f'.{path.name}.tmp')
+        temp_path.write_text(text)
+        os.replace(temp_path, path)
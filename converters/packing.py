@@ -0,0 +1,67 @@
+import re
+
+ROUTINE_NAME_PATTERN = re.compile(r'(?:PROCEDURE|FUNCTION)\s+([\w$#."]+)', flags=re.IGNORECASE)
+# Comment heading the code of each routine in a packed request, in PL/SQL and in the converted Python code
+PLSQL_MARKER = '-- ROUTINE {NUMBER}: {NAME}'
+PYTHON_MARKER = '# ROUTINE {NUMBER}: {NAME}'
+PYTHON_MARKER_PATTERN = re.compile(r'^[ \t]*#[ \t]*ROUTINE[ \t]+(\d+)\b[^\n]*$', flags=re.MULTILINE)
+# Instructions added to the conversion prompt of the converters when several routines are packed
+PACKING_INSTRUCTIONS = '''The code above contains {COUNT} independent PL/SQL routines, each one preceded by a \
+"-- ROUTINE <number>: <name>" comment. Convert each routine to its own Python function, in the same order, \
+writing right before each function a "# ROUTINE <number>: <name>" comment with the same number and name. Write \
+all the functions in a single Python code block.'''
+
+
+def routine_name(original_code: str) -> str:
+    """
+    Return the name of a PL/SQL routine
+    """
+    name = ROUTINE_NAME_PATTERN.search(original_code)
+    return name.group(1) if name else 'routine'
+
+
+def pack_routines(original_codes: list[str]) -> str:
+    """
+    Return the code of several routines put together, each of them preceded by a marker comment naming it
+
+    Parameters
+    ----------
+    original_codes : PL/SQL code of the routines
+
+    Returns
+    -------
+    The code to be converted with a single FM request, see `split_packed_code` for splitting its conversion
+    """
+    return '\n\n'.join(PLSQL_MARKER.format(NUMBER=i + 1, NAME=routine_name(code)) + '\n' + code
+                       for i, code in enumerate(original_codes))
+
+
+def first_marker(original_codes: list[str]) -> str:
+    """
+    Return the marker the converted code of the given packed routines starts with, used to prefill the FM output
+    """
+    return PYTHON_MARKER.format(NUMBER=1, NAME=routine_name(original_codes[0]))
+
+
+def split_packed_code(code: str, count: int) -> list[str | None]:
+    """
+    Split the code converted from packed routines (see `pack_routines`) into the code of each routine
+
+    Parameters
+    ----------
+    code : Code generated by the FM, with the code of each routine preceded by its marker comment
+    count : Number of routines that were packed
+
+    Returns
+    -------
+    The converted code of each routine, in order, or `None` for the routines missing from the code
+    """
+    sections: list[str | None] = [None] * count
+    markers = list(PYTHON_MARKER_PATTERN.finditer(code))
+    for marker, following in zip(markers, markers[1:] + [None]):
+        number = int(marker.group(1))
+        section = code[marker.end():following.start() if following is not None else len(code)].strip()
+        # Routines converted twice are not trusted
+        if 1 <= number <= count and section:
+            sections[number - 1] = section if sections[number - 1] is None else ''
+    return [section or None for section in sections]
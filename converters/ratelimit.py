@@ -0,0 +1,180 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+
+
+class RateLimiter:
+    """
+    Client-side rate limiter for a FM backend
+
+    The limiter keeps track of the requests and the tokens used in the last minute, so that the given
+    requests per minute (RPM) and tokens per minute (TPM) quotas are not exceeded, and caps the number of
+    concurrent requests using AIMD (additive increase, multiplicative decrease): every successful request
+    increases the concurrency limit by `1 / limit` (i.e. by one per "round" of requests), and every time
+    the backend throttles the requests the limit is halved and new requests are paused for a while.
+
+    The limiter is thread-safe, and can also be used from asynchronous code with `aacquire`.
+    """
+    WINDOW = 60.0
+    # Interval used to check again whether a request can be sent once the concurrency limit is reached
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, requests_per_minute: float | None = None, tokens_per_minute: float | None = None,
+                 initial_concurrency: int = 4, max_concurrency: int | None = None, backoff: float = 1.0):
+        """
+        Create a rate limiter
+
+        Parameters
+        ----------
+        requests_per_minute : Maximum number of requests in any 60s window, `None` for no limit
+        tokens_per_minute : Maximum number of (input + output) tokens in any 60s window, `None` for no limit
+        initial_concurrency : Initial maximum number of concurrent requests
+        max_concurrency : Maximum value for the concurrency limit, `None` for no limit
+        backoff : Time (in seconds) to pause new requests after being throttled
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.backoff = backoff
+        self._concurrency = float(initial_concurrency)
+        self._in_flight = 0
+        # Requests sent in the last `WINDOW` seconds, as [timestamp, tokens] tickets
+        self._window = deque()
+        self._window_tokens = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float) -> None:
+        """
+        Remove the requests older than `WINDOW` seconds
+        """
+        while self._window and self._window[0][0] <= now - self.WINDOW:
+            self._window_tokens -= self._window.popleft()[1]
+
+    def _try_acquire(self, tokens: int) -> tuple[float, list | None]:
+        """
+        Try to acquire permission to send a request with the given (estimated) number of tokens
+
+        Returns
+        -------
+        The time to wait before trying again (0 if acquired) and the ticket for the request (if acquired)
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            if now < self._paused_until:
+                return self._paused_until - now, None
+            if self._in_flight >= int(self._concurrency):
+                return self.POLL_INTERVAL, None
+            if self.requests_per_minute is not None and len(self._window) >= self.requests_per_minute:
+                return self._window[0][0] + self.WINDOW - now, None
+            if (self.tokens_per_minute is not None and self._window
+                    and self._window_tokens + tokens > self.tokens_per_minute):
+                return self._window[0][0] + self.WINDOW - now, None
+            ticket = [now, tokens]
+            self._window.append(ticket)
+            self._window_tokens += tokens
+            self._in_flight += 1
+            return 0.0, ticket
+
+    def acquire(self, tokens: int) -> list:
+        """
+        Wait until a request with the given (estimated) number of tokens can be sent
+
+        Parameters
+        ----------
+        tokens : Estimated number of tokens used by the request
+
+        Returns
+        -------
+        The ticket for the request, which must be passed to `release` once the request finishes
+        """
+        while True:
+            wait, ticket = self._try_acquire(tokens)
+            if ticket is not None:
+                return ticket
+            time.sleep(wait)
+
+    async def aacquire(self, tokens: int) -> list:
+        """
+        Wait until a request with the given (estimated) number of tokens can be sent, see `acquire`
+        """
+        while True:
+            wait, ticket = self._try_acquire(tokens)
+            if ticket is not None:
+                return ticket
+            await asyncio.sleep(wait)
+
+    def release(self, ticket: list, tokens: int | None = None, throttled: bool = False,
+                failed: bool = False) -> None:
+        """
+        Signal that a request finished
+
+        Parameters
+        ----------
+        ticket : Ticket returned by `acquire`
+        tokens : Actual number of tokens used by the request, if known
+        throttled : Whether the backend throttled the request
+        failed : Whether the request failed for any other reason, in which case the concurrency limit is kept
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._in_flight -= 1
+            if tokens is not None and ticket[0] > now - self.WINDOW:
+                self._window_tokens += tokens - ticket[1]
+                ticket[1] = tokens
+            if not throttled:
+                # Only successful requests show that the backend can take more of them
+                if not failed:
+                    self._concurrency += 1 / self._concurrency
+                    if self.max_concurrency is not None:
+                        self._concurrency = min(self._concurrency, self.max_concurrency)
+            elif ticket[0] >= self._last_decrease:
+                # Only requests sent after the last decrease count, so a burst of throttled requests
+                # only halves the limit once
+                self._concurrency = max(1.0, self._concurrency / 2)
+                self._last_decrease = now
+                self._paused_until = now + self.backoff
+                logging.warning(f'\t\t\tThrottled by the backend, reducing the concurrency to '
+                                f'{int(self._concurrency)} requests')
+
+    @property
+    def limits(self) -> dict:
+        """
+        Current limits and usage of the rate limiter
+        """
+        with self._lock:
+            self._expire(time.monotonic())
+            return {'concurrency': int(self._concurrency),
+                    'in_flight': self._in_flight,
+                    'requests_per_minute': self.requests_per_minute,
+                    'tokens_per_minute': self.tokens_per_minute,
+                    'requests_last_minute': len(self._window),
+                    'tokens_last_minute': self._window_tokens}
+
+
+# Limiters shared by all the converters in the process, by backend (model ID / endpoint name)
+_rate_limiters: dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(backend: str, **kwargs) -> RateLimiter:
+    """
+    Return the rate limiter shared by all the converters using the given backend
+
+    Parameters
+    ----------
+    backend : Name of the backend (model ID or endpoint name)
+    kwargs : Arguments used to create the rate limiter (see `RateLimiter`) if it doesn't exist yet
+
+    Returns
+    -------
+    The rate limiter for the backend
+    """
+    with _rate_limiters_lock:
+        if backend not in _rate_limiters:
+            _rate_limiters[backend] = RateLimiter(**kwargs)
+        return _rate_limiters[backend]
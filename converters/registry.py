@@ -0,0 +1,79 @@
+import importlib
+import threading
+from converters.base import CodeConverter
+
+# Converters by name: module (relative to this package) and class implementing them. The modules are only
+# imported when the converter is first used, since some of their dependencies (e.g. `sagemaker`) are slow to import
+_converters: dict[str, tuple[str, str]] = {}
+_classes: dict[str, type[CodeConverter]] = {}
+# Reentrant, in case the module of a converter creates another one when it's imported
+_lock = threading.RLock()
+
+
+def register_converter(name: str, module: str, class_name: str) -> None:
+    """
+    Register a converter, to be imported on first use
+
+    Parameters
+    ----------
+    name : Name of the converter (e.g. `claude`)
+    module : Module implementing the converter, relative to the `converters` package (e.g. `.claude`)
+    class_name : Name of the converter class in the module
+    """
+    with _lock:
+        _converters[name] = (module, class_name)
+        _classes.pop(name, None)
+
+
+def converter_names() -> list[str]:
+    """
+    Return the names of the registered converters
+    """
+    with _lock:
+        return list(_converters)
+
+
+def get_converter_class(name: str) -> type[CodeConverter]:
+    """
+    Return the class of a registered converter, importing its module if needed
+
+    Parameters
+    ----------
+    name : Name of the converter
+
+    Returns
+    -------
+    The converter class
+    """
+    with _lock:
+        if name not in _classes:
+            try:
+                module, class_name = _converters[name]
+            except KeyError:
+                raise ValueError(f'Unknown converter: {name}') from None
+            _classes[name] = getattr(importlib.import_module(module, __package__), class_name)
+        return _classes[name]
+
+
+def create_converter(name: str, **kwargs) -> CodeConverter:
+    """
+    Create a converter by name
+
+    Parameters
+    ----------
+    name : Name of the converter
+    kwargs : Arguments passed to the converter constructor
+
+    Returns
+    -------
+    The new converter
+    """
+    return get_converter_class(name)(**kwargs)
+
+
+register_converter('claude', '.claude', 'ClaudeConverter')
+register_converter('bedrock-llama', '.llama_instruct', 'BedrockLlamaConverter')
+register_converter('codellama', '.codellama_instruct', 'CodeLlamaConverter')
+register_converter('replay', '.replay', 'ReplayConverter')
+register_converter('synthetic', '.synthetic', 'SyntheticConverter')
+register_converter('cascade', '.cascade', 'CascadeConverter')
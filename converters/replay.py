@@ -0,0 +1,202 @@
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from collections import defaultdict
+from .base import CodeConverter
+from converters import exceptions
+from converters.exceptions import ConversionError
+
+
+# Payload fields with the maximum number of output tokens of each backend, left out of the request keys
+MAX_TOKENS_FIELDS = frozenset(('max_tokens', 'max_gen_len', 'max_new_tokens'))
+
+
+# Class constants of the converters that change the requests they send, taken from the wrapped converter
+DELEGATED_CONSTANTS = ('MAX_NEW_TOKENS', 'CHARS_PER_TOKEN', 'TEMPERATURE', 'SEED_TEMPERATURE_STEP',
+                       'REPAIR_OUTPUT_RATIO', 'REPAIR_MIN_TOKENS')
+
+
+class ReplayConverter(CodeConverter):
+    """
+    Converter that records the FM calls of another converter to a cassette file, or replays them from it
+
+    A cassette is a JSON lines file with one record per `_fm_eval` call: the payload sent to the FM, the
+    response (or the `ConversionError` raised) and the time it took. When replaying, the responses for each
+    payload are returned in the order in which they were recorded (starting again from the first one once
+    all of them have been used), so a recorded run can be repeated deterministically without network access.
+    The maximum number of output tokens is not taken into account when matching the payloads, since it depends
+    on what the token budget learnt from previous runs (see `budget.TokenBudget`).
+
+    The wrapped converter is still used to build the payloads and to extract the code from the responses,
+    but its backend is never called when replaying.
+    """
+
+    def __init__(self, converter: CodeConverter, cassette: Path, record: bool = False, latency: bool = False):
+        """
+        Create a recording / replaying converter
+
+        Parameters
+        ----------
+        converter : Converter whose FM calls are recorded / replayed
+        cassette : JSON lines file where the FM calls are recorded or replayed from
+        record : Whether to call the FM and record the calls (appending them to the cassette) or to replay them
+        latency : Whether to wait for the recorded time of each call when replaying it
+        """
+        super().__init__()
+        self.converter = converter
+        self.cassette = cassette
+        self.record = record
+        self.latency = latency
+        # The requests must be the same as those of the wrapped converter, for the cassette to match them
+        for name in DELEGATED_CONSTANTS:
+            setattr(self, name, getattr(converter, name))
+        self._lock = threading.Lock()
+        # Recorded calls by request, and number of times each request has been replayed
+        self._calls: dict[str, list[dict]] = defaultdict(list)
+        self._replayed: dict[str, int] = defaultdict(int)
+        if record:
+            cassette.parent.mkdir(exist_ok=True, parents=True)
+        else:
+            self._load(cassette)
+
+    def _load(self, cassette: Path) -> None:
+        """
+        Load the calls recorded in the given cassette
+        """
+        with cassette.open('rt') as calls:
+            for line in calls:
+                try:
+                    call = json.loads(line)
+                    # Several models can be recorded in the same cassette (e.g. the tiers of a cascade)
+                    if call.get('fm_name', self.fm_name) == self.fm_name:
+                        key = self.request_key(call['payload']) if 'payload' in call else call['request']
+                        self._calls[key].append(call)
+                except (json.JSONDecodeError, KeyError):
+                    logging.warning(f'Skipping corrupted call in cassette {cassette}')
+        logging.info(f'Loaded {sum(map(len, self._calls.values()))} FM calls from {cassette}')
+
+    @staticmethod
+    def request_key(payload: dict) -> str:
+        """
+        Return the hash identifying the given payload in the cassette, regardless of its maximum number of output
+        tokens
+        """
+        def normalize(value):
+            if isinstance(value, dict):
+                return {key: normalize(item) for key, item in value.items() if key not in MAX_TOKENS_FIELDS}
+            return value
+
+        return hashlib.sha256(json.dumps(normalize(payload), sort_keys=True).encode('utf-8')).hexdigest()
+
+    @property
+    def fm_name(self) -> str:
+        """
+        Return the name of the recorded model
+        """
+        return self.converter.fm_name
+
+    def _construct_payload(self, original_code: str, max_new_tokens: int, converted_code: str = '',
+                           temperature: float | None = None) -> dict:
+        """
+        Construct the payload to be passed to the endpoint
+        """
+        return self.converter._construct_payload(original_code, max_new_tokens, converted_code, temperature)
+
+    def _construct_batch_payload(self, original_codes: list[str], max_new_tokens: int,
+                                 temperature: float | None = None) -> dict | None:
+        """
+        Construct the payload asking the FM to convert several code blocks at once, see the wrapped converter
+        """
+        return self.converter._construct_batch_payload(original_codes, max_new_tokens, temperature)
+
+    def _construct_repair_payload(self, code: str, error: SyntaxError, max_new_tokens: int,
+                                  temperature: float | None = None) -> dict | None:
+        """
+        Construct the payload asking the FM to fix a syntax error, see the wrapped converter
+        """
+        return self.converter._construct_repair_payload(code, error, max_new_tokens, temperature)
+
+    def _fm_eval(self, payload: dict):
+        """
+        Eval the given payload with the wrapped converter (recording the call) or replay the recorded response
+
+        Returns
+        -------
+        Model output, which will include free-form text and should also include a code block.
+        """
+        if self.record:
+            return self._record_call(payload)
+        return self._replay_call(payload)
+
+    def _record_call(self, payload: dict):
+        """
+        Eval the given payload with the wrapped converter and append the call to the cassette
+        """
+        self.converter.streaming = self.streaming
+        self.converter.validate_partial_code = self.validate_partial_code
+        call = {'request': self.request_key(payload), 'fm_name': self.fm_name, 'payload': payload}
+        start = time.perf_counter()
+        try:
+            response = self.converter._fm_eval(payload)
+            call['response'] = response
+            return response
+        except ConversionError as e:
+            call['error'] = {'type': type(e).__name__, 'message': str(e)}
+            raise
+        finally:
+            call['latency'] = time.perf_counter() - start
+            with self._lock, self.cassette.open('at') as calls:
+                calls.write(json.dumps(call) + '\n')
+
+    def _replay_call(self, payload: dict):
+        """
+        Return (or raise) the next recorded result for the given payload
+        """
+        key = self.request_key(payload)
+        with self._lock:
+            calls = self._calls.get(key)
+            if not calls:
+                raise ConversionError(f'No recorded FM call for the request {key} in {self.cassette}')
+            call = calls[self._replayed[key] % len(calls)]
+            self._replayed[key] += 1
+        if self.latency:
+            time.sleep(call['latency'])
+        if 'error' in call:
+            error = getattr(exceptions, call['error']['type'], ConversionError)
+            if not (isinstance(error, type) and issubclass(error, ConversionError)):
+                error = ConversionError
+            raise error(call['error']['message'])
+        return call['response']
+
+    def _extract_code(self, response: dict, payload: dict) -> (str, bool):
+        """
+        Extract the converted code from the FM response, see the wrapped converter
+        """
+        return self.converter._extract_code(response, payload)
+
+    def _output_tokens(self, response) -> int | None:
+        """
+        Return the number of output tokens generated by the FM for the given response
+        """
+        return self.converter._output_tokens(response)
+
+    def _input_tokens(self, response) -> int | None:
+        """
+        Return the number of input tokens processed by the FM for the given response
+        """
+        return self.converter._input_tokens(response)
+
+    def _stop_reason(self, response) -> str | None:
+        """
+        Return the reason why the FM stopped generating the given response
+        """
+        return self.converter._stop_reason(response)
+
+    def _time_to_first_token(self, response) -> float | None:
+        """
+        Return the time until the first token of the given response was received, if it was streamed
+        """
+        return self.converter._time_to_first_token(response)
@@ -0,0 +1,226 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from botocore.exceptions import ClientError
+from converters.exceptions import (ConversionError, FatalConversionError, InvalidCodeError, OutputTooLongException,
+                                   RequestCancelledError, ThrottlingError)
+
+
+def retry_after(error: ClientError) -> float | None:
+    """
+    Return the time to wait (in seconds) suggested by the backend in the `Retry-After` header of an error, if any
+    """
+    headers = error.response.get('ResponseMetadata', {}).get('HTTPHeaders', {})
+    try:
+        return max(float(headers['retry-after']), 0.0)
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Policy deciding whether (and when) a failed FM request should be retried
+
+    Fatal errors (e.g. invalid requests) are not retried. Errors caused by the backend (timeouts, throttling,
+    service errors) are retried after an exponential backoff with full jitter, i.e. a random delay between 0 and
+    `base_delay * 2 ** attempt` (capped to `max_delay`), or after the time suggested by the backend if it's longer.
+    Errors caused by the request itself (output too long, invalid partial code) are retried right away, since the
+    retried request is different.
+    """
+
+    def __init__(self, base_delay: float = 1.0, max_delay: float = 30.0):
+        """
+        Create a retry policy
+
+        Parameters
+        ----------
+        base_delay : Maximum delay (in seconds) before the first retry
+        max_delay : Maximum delay (in seconds) before any retry
+        """
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._random = random.Random()
+
+    @staticmethod
+    def is_retryable(error: ConversionError) -> bool:
+        """
+        Return whether the request that raised the given error can be retried
+        """
+        return not isinstance(error, FatalConversionError)
+
+    @staticmethod
+    def is_backend_failure(error: ConversionError) -> bool:
+        """
+        Return whether the given error was caused by the backend (i.e. it might be overloaded or down)
+        """
+        return not isinstance(error, (FatalConversionError, OutputTooLongException, InvalidCodeError,
+                                      RequestCancelledError))
+
+    @classmethod
+    def is_outage(cls, error: ConversionError) -> bool:
+        """
+        Return whether the given error suggests that the backend is down (throttling means it's just busy)
+        """
+        return cls.is_backend_failure(error) and not isinstance(error, ThrottlingError)
+
+    def delay(self, error: ConversionError, attempt: int) -> float:
+        """
+        Return the time to wait before retrying a request
+
+        Parameters
+        ----------
+        error : Error raised by the request
+        attempt : Number of consecutive failed requests (starting at 1)
+
+        Returns
+        -------
+        The time to wait, in seconds
+        """
+        if not self.is_backend_failure(error):
+            return 0.0
+        delay = self._random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if error.retry_after is not None:
+            delay = max(delay, error.retry_after)
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for a FM backend, shared by all the converters (and workers) using it
+
+    After `failure_threshold` consecutive backend failures the circuit opens, and all the requests wait for
+    `reset_timeout` seconds instead of hammering the backend. Then the circuit is half-open: a single request is
+    sent to probe the backend, closing the circuit if it succeeds or opening it again if it fails.
+
+    The breaker is thread-safe, and can also be used from asynchronous code with `aacquire`.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+    # Interval used to check again whether a request can be sent while another one probes the backend
+    POLL_INTERVAL = 0.1
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Create a circuit breaker
+
+        Parameters
+        ----------
+        failure_threshold : Number of consecutive backend failures that open the circuit
+        reset_timeout : Time (in seconds) to wait before probing the backend once the circuit is open
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _try_acquire(self) -> tuple[float, bool]:
+        """
+        Try to acquire permission to send a request
+
+        Returns
+        -------
+        The time to wait before trying again (0 if the request can be sent) and whether the request is a probe
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0, False
+            if self.state == self.OPEN:
+                wait = self._opened_at + self.reset_timeout - time.monotonic()
+                if wait > 0:
+                    return wait, False
+                self.state = self.HALF_OPEN
+            if self._probing:
+                return self.POLL_INTERVAL, False
+            self._probing = True
+            return 0.0, True
+
+    def acquire(self) -> bool:
+        """
+        Wait until a request can be sent to the backend
+
+        Returns
+        -------
+        Whether the request is probing the backend, which must be passed to `release` once the request finishes
+        """
+        while True:
+            wait, probe = self._try_acquire()
+            if wait <= 0:
+                return probe
+            time.sleep(wait)
+
+    async def aacquire(self) -> bool:
+        """
+        Wait until a request can be sent to the backend, see `acquire`
+        """
+        while True:
+            wait, probe = self._try_acquire()
+            if wait <= 0:
+                return probe
+            await asyncio.sleep(wait)
+
+    def release(self, failed: bool, probe: bool = False) -> None:
+        """
+        Signal that a request finished
+
+        Parameters
+        ----------
+        failed : Whether the request failed because of the backend (see `RetryPolicy.is_outage`)
+        probe : Whether the request was probing the backend (as returned by `acquire`)
+        """
+        with self._lock:
+            if probe:
+                self._probing = False
+            if not failed:
+                if self.state != self.CLOSED:
+                    logging.info('\t\t\tThe backend recovered, closing the circuit breaker')
+                self.state, self._failures = self.CLOSED, 0
+                return
+            self._failures += 1
+            if self.state == self.HALF_OPEN and probe or \
+                    self.state == self.CLOSED and self._failures >= self.failure_threshold:
+                self.state, self._opened_at = self.OPEN, time.monotonic()
+                logging.warning(f'\t\t\tThe backend failed {self._failures} times in a row, pausing the requests '
+                                f'for {self.reset_timeout}s')
+
+    def cancel(self, probe: bool = False) -> None:
+        """
+        Signal that a request was abandoned before finishing (e.g. a seed or a hedged copy that lost the race),
+        which says nothing about the backend
+
+        Parameters
+        ----------
+        probe : Whether the request was probing the backend (as returned by `acquire`)
+        """
+        if probe:
+            with self._lock:
+                self._probing = False
+
+
+# Circuit breakers shared by all the converters in the process, by backend (model ID / endpoint name)
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(backend: str, **kwargs) -> CircuitBreaker:
+    """
+    Return the circuit breaker shared by all the converters using the given backend
+
+    Parameters
+    ----------
+    backend : Name of the backend (model ID or endpoint name)
+    kwargs : Arguments used to create the circuit breaker (see `CircuitBreaker`) if it doesn't exist yet
+
+    Returns
+    -------
+    The circuit breaker for the backend
+    """
+    with _circuit_breakers_lock:
+        if backend not in _circuit_breakers:
+            _circuit_breakers[backend] = CircuitBreaker(**kwargs)
+        return _circuit_breakers[backend]
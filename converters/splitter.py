@@ -0,0 +1,176 @@
+import re
+import mmap
+from pathlib import Path
+from typing import NamedTuple
+from collections.abc import Iterator
+
+# Tokens relevant for finding the routine boundaries. Comments, string literals and quoted identifiers are
+# matched as a whole (so their contents are ignored), and all the punctuation but `;`, `(` and `)` is skipped.
+# Conditional compilation directives (e.g. `$IF ... $THEN ... $END`) and inquiry directives (e.g. `$$PLSQL_LINE`)
+# are skipped too, so they're not mistaken for the `IF` / `END` keywords.
+# Unterminated comments / literals extend to the end of the input, so every byte is only scanned once.
+TOKEN_PATTERN = re.compile(rb'''
+    (?P<skip>
+        --[^\n]*
+        | /\*.*?(?:\*/|\Z)
+        | [nN]?[qQ]'(?:\[.*?(?:\]'|\Z) | \{.*?(?:\}'|\Z) | \(.*?(?:\)'|\Z) | <.*?(?:>'|\Z)
+                     | ([^\s\[{(<]).*?(?:\2'|\Z))
+        | '[^']*(?:''[^']*)*(?:'|\Z)
+        | "[^"]*(?:"|\Z)
+        | \$\$?[A-Za-z_][\w$\#]*
+    )
+    | (?P<word>[A-Za-z_][\w$\#]*)
+    | (?P<punct>[;()])
+''', flags=re.VERBOSE | re.DOTALL)
+# Words that change the state of the parser, any other identifier is only relevant right after an `END`
+KEYWORDS = frozenset((b'PROCEDURE', b'FUNCTION', b'PACKAGE', b'TYPE', b'BODY', b'IS', b'AS',
+                      b'BEGIN', b'CASE', b'END', b'IF', b'LOOP', b'LANGUAGE', b'EXTERNAL'))
+ROUTINE_NAME_PATTERN = re.compile(rb'(?:PROCEDURE|FUNCTION)\s+([\w$#."]+)', flags=re.IGNORECASE)
+
+
+class Routine(NamedTuple):
+    """
+    Boundaries of a procedure / function found in a source file
+    """
+    name: str
+    # Offsets of the routine in the source, `end` being the offset right after its final `;`
+    start: int
+    end: int
+    # First and last lines of the routine (1-based)
+    start_line: int
+    end_line: int
+
+
+def find_routines(source: bytes | mmap.mmap) -> Iterator[Routine]:
+    """
+    Find the top-level procedures / functions in the given PL/SQL source
+
+    The source is scanned once by a tokenizer that skips comments and quoted strings, while keeping track
+    of the block depth: `BEGIN` and `CASE` open a block, and `END` closes it (unless followed by `IF` or
+    `LOOP`), so the time taken grows linearly with the size of the source. A routine starts with `PROCEDURE` /
+    `FUNCTION` and its header ends with `IS` / `AS`, whereas headers ending with `;` are forward declarations
+    and are skipped. Package specs and bodies, record types, cursors, local subprograms and nested blocks are
+    handled, and routines are not required to start at the beginning of a line.
+
+    Parameters
+    ----------
+    source : Source code to scan, as bytes or as a memory-mapped file
+
+    Returns
+    -------
+    Iterator over the routines, in the order in which they appear in the source and yielded as soon as
+    they are complete
+    """
+    depth = 0
+    # Stack of open routines as [start offset, start line, depth, whether their body has started]
+    routines = []
+    # Routine header being parsed, as [start offset, start line, parenthesis depth]
+    header = None
+    # Top-level routine closed by an `END`, waiting for the final `;`
+    closing = None
+    package_pending, after_end, after_header = False, False, False
+    last = b''
+    line, line_offset = 1, 0
+
+    def line_at(offset: int) -> int:
+        # Lines are counted incrementally, so the source is only traversed once
+        nonlocal line, line_offset
+        line += source[line_offset:offset].count(b'\n')
+        line_offset = offset
+        return line
+
+    for token in TOKEN_PATTERN.finditer(source):
+        kind = token.lastgroup
+        if kind == 'skip':
+            continue
+        value = token.group()
+        if kind == 'word':
+            value = value.upper()
+            if value not in KEYWORDS and not after_end and not after_header:
+                continue
+        prior, last = last, value
+
+        if after_end:
+            after_end = False
+            if value in (b'IF', b'LOOP'):
+                continue
+            depth = max(depth - 1, 0)
+            if routines and routines[-1][3] and depth == routines[-1][2]:
+                routine = routines.pop()
+                if not routines:
+                    closing = routine
+            if value == b'CASE':
+                # `END CASE` closes the CASE statement, it doesn't open a new one
+                continue
+
+        if header is not None:
+            if value == b'(':
+                header[2] += 1
+            elif value == b')':
+                header[2] -= 1
+            elif header[2] == 0 and value == b';':
+                # Forward declaration, there's no body to convert
+                header = None
+            elif header[2] == 0 and value in (b'IS', b'AS'):
+                routines.append([header[0], header[1], depth, False])
+                header, after_header = None, True
+            continue
+
+        if after_header:
+            after_header = False
+            if value in (b'LANGUAGE', b'EXTERNAL'):
+                # Call specification, implemented outside PL/SQL
+                routines.pop()
+                continue
+
+        match value:
+            case b'PROCEDURE' | b'FUNCTION':
+                header = [token.start(), line_at(token.start()), 0]
+            case b'PACKAGE' if not routines:
+                package_pending = True
+            case b'BODY' if not routines and prior == b'TYPE':
+                package_pending = True
+            case b'IS' | b'AS' if package_pending:
+                package_pending = False
+                depth += 1
+            case b'BEGIN':
+                if routines and not routines[-1][3] and depth == routines[-1][2]:
+                    routines[-1][3] = True
+                depth += 1
+            case b'CASE':
+                depth += 1
+            case b'END':
+                after_end = True
+            case b';':
+                package_pending = False
+                if closing is not None:
+                    start, start_line = closing[0], closing[1]
+                    name = ROUTINE_NAME_PATTERN.match(source, start)
+                    yield Routine(name=name.group(1).decode('utf-8', errors='replace') if name else '',
+                                  start=start, end=token.end(),
+                                  start_line=start_line, end_line=line_at(token.end()))
+                    closing = None
+
+
+def split_routines(source_file: Path) -> Iterator[str]:
+    """
+    Yield the procedures / functions in the given source file, one by one
+
+    The file is memory-mapped and tokenized lazily (see `find_routines`), so each routine is yielded as
+    soon as it's found and the memory usage does not depend on the size of the file.
+
+    Parameters
+    ----------
+    source_file : Source file containing the Package Body definition
+
+    Returns
+    -------
+    Iterator over the code of the routines, in the order in which they appear in the file
+    """
+    with source_file.open('rb') as source:
+        if source.seek(0, 2) == 0:
+            # Empty files can't be memory-mapped
+            return
+        with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as package_source:
+            for routine in find_routines(package_source):
+                yield package_source[routine.start:routine.end].decode('utf-8', errors='replace')
@@ -0,0 +1,101 @@
+import time
+import botocore
+from converters.retry import retry_after
+from converters.hedging import cancellation_event
+from converters.validation import is_viable_prefix
+from converters.exceptions import (BackendTimeoutError, ConversionError, InvalidCodeError, RequestCancelledError,
+                                   ThrottlingError)
+
+
+class CodeBlockStream:
+    """
+    Incremental extractor for a streamed code block
+
+    The prompts sent by the converters already open the markdown code block (i.e. the FM output starts
+    right after "```python"), so the code block is complete as soon as the closing triple quotes arrive:
+    at that point the rest of the response (usually an explanation of the code) can be discarded without
+    waiting for it to be generated.
+
+    If requested, the code is also validated while it's generated (see `is_viable_prefix`), so that the
+    request can be cancelled as soon as the code is broken beyond repair. The request is also cancelled if it's
+    no longer needed (see `hedging.cancellation_event`).
+    """
+    FENCE = '```'
+    OPENING_FENCE = '```python'
+    # Number of new lines to wait for before validating the partial code again
+    VALIDATE_EVERY_LINES = 10
+
+    def __init__(self, prompt: str = '', validate: bool = False):
+        """
+        Create the extractor
+
+        Parameters
+        ----------
+        prompt : Text that the FM output continues (i.e. the prompt or the prefilled assistant message),
+                 whose open code block is taken into account when validating the partial code
+        validate : Whether to validate the partial code while it's generated
+        """
+        self.text = ''
+        self.closed = False
+        self.time_to_first_token: float | None = None
+        self.validate = validate
+        # Code already in the open code block before the FM output
+        fence = prompt.rfind(self.OPENING_FENCE)
+        self._prefix = prompt[fence + len(self.OPENING_FENCE):] if fence >= 0 else ''
+        self._lines, self._validated_lines = 0, 0
+        self._start = time.perf_counter()
+        self._cancel = cancellation_event()
+
+    def feed(self, delta: str) -> bool:
+        """
+        Add a chunk of the FM output
+
+        Parameters
+        ----------
+        delta : Text generated by the FM since the last chunk
+
+        Returns
+        -------
+        Whether the code block has been closed, in which case the rest of the output is not needed. If
+        validating the partial code and it's already invalid, `InvalidCodeError` is raised instead.
+        """
+        if self._cancel is not None and self._cancel.is_set():
+            raise RequestCancelledError('The request is no longer needed')
+        if self.closed or not delta:
+            return self.closed
+        if self.time_to_first_token is None:
+            self.time_to_first_token = time.perf_counter() - self._start
+        # The closing triple quotes might be split between chunks
+        search_from = max(len(self.text) - len(self.FENCE) + 1, 0)
+        self.text += delta
+        fence = self.text.find(self.FENCE, search_from)
+        if fence >= 0:
+            self.text = self.text[:fence + len(self.FENCE)]
+            self.closed = True
+        elif self.validate:
+            self._lines += delta.count('\n')
+            if self._lines - self._validated_lines >= self.VALIDATE_EVERY_LINES:
+                self._validated_lines = self._lines
+                if not is_viable_prefix(self._prefix + self.text):
+                    raise InvalidCodeError(f'The generated code is already invalid after {self._lines} lines')
+        return self.closed
+
+
+def stream_error(error: botocore.exceptions.EventStreamError) -> ConversionError:
+    """
+    Translate an error received in the middle of a response stream to the corresponding conversion error
+
+    Parameters
+    ----------
+    error : Error raised while reading the stream
+
+    Returns
+    -------
+    The exception to raise
+    """
+    code = error.response['Error']['Code'].lower()
+    if 'throttling' in code:
+        return ThrottlingError(f'{error}', retry_after=retry_after(error))
+    elif 'timeout' in code:
+        return BackendTimeoutError(f'{error}')
+    return ConversionError(f'Error while streaming the model output ({error})')
@@ -0,0 +1,157 @@
+import re
+import time
+import random
+import threading
+from .base import CodeConverter
+from converters.window import window_tail
+from converters.packing import PYTHON_MARKER, pack_routines, routine_name
+
+
+class SyntheticConverter(CodeConverter):
+    """
+    Converter backed by a simulated FM, used to benchmark the conversion pipeline without calling a real FM
+
+    The "converted" code is a Python function with the same name as the routine whose body is the original
+    code as comments, generated in chunks of `max_new_tokens` like a real FM. Each call takes a simulated
+    latency (time to first token plus generation time), and a given fraction of the generations contains a
+    syntax error, so reseeding is also exercised.
+    """
+
+    def __init__(self, latency: float = 0.5, tokens_per_second: float | None = None, jitter: float = 0.0,
+                 failure_rate: float = 0.0, seed: int | None = None):
+        """
+        Create a synthetic converter
+
+        Parameters
+        ----------
+        latency : Mean time to first token of each call, in seconds
+        tokens_per_second : Generation speed of the simulated FM, `None` for instant generation
+        jitter : Standard deviation of the (log-normal) noise applied to the latency of each call
+        failure_rate : Fraction of the generations that contain a syntax error
+        seed : Seed for the random number generator, for reproducible runs
+        """
+        super().__init__()
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def fm_name(self) -> str:
+        """
+        Return the model name
+        """
+        return 'synthetic'
+
+    def _construct_repair_payload(self, code: str, error: SyntaxError, max_new_tokens: int,
+                                  temperature: float | None = None) -> dict:
+        """
+        Construct the payload asking the simulated FM to fix the converted code, which is always fixed
+        """
+        return {'original_code': code, 'converted_code': '', 'max_new_tokens': max_new_tokens, 'repair': True}
+
+    def _construct_payload(self, original_code: str, max_new_tokens: int, converted_code: str = '',
+                           temperature: float | None = None) -> dict:
+        """
+        Construct the payload to be passed to the simulated FM
+        """
+        return {'original_code': original_code,
+                'converted_code': converted_code,
+                'max_new_tokens': max_new_tokens}
+
+    def _construct_batch_payload(self, original_codes: list[str], max_new_tokens: int,
+                                 temperature: float | None = None) -> dict:
+        """
+        Construct the payload asking the simulated FM to convert several routines at once
+        """
+        return {'original_code': pack_routines(original_codes),
+                'routines': original_codes,
+                'converted_code': '',
+                'max_new_tokens': max_new_tokens}
+
+    @staticmethod
+    def _translate(original_code: str, broken: bool) -> str:
+        """
+        Return the full "converted" code for the given routine
+        """
+        name = re.sub(r'\W', '_', routine_name(original_code))
+        lines = [f'def {name}(db_conn):']
+        if broken:
+            lines.append('    result = = None')
+        lines.extend(f'    # {line.strip()}' for line in original_code.splitlines() if line.strip())
+        lines.append('    return None')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _generated_length(code: str, converted_code: str) -> int:
+        """
+        Return the length of the code already generated, given the code sent back to the simulated FM (which might
+        be a continuation window, with an outline instead of the first lines of the code)
+        """
+        tail = window_tail(converted_code)
+        end = code.find(tail)
+        return end + len(tail) if end >= 0 else len(converted_code)
+
+    def _fm_eval(self, payload: dict):
+        """
+        Simulate the evaluation of the given payload
+
+        Returns
+        -------
+        Model output, with the next chunk of the converted code
+        """
+        converted_code = payload['converted_code']
+        with self._lock:
+            # Continuations of a broken generation are broken too
+            broken = 'result = = None' in converted_code or (
+                not converted_code and self._random.random() < self.failure_rate)
+            noise = self._random.lognormvariate(0, self.jitter) if self.jitter else 1.0
+        if 'routines' in payload:
+            # Each routine might be broken on its own
+            with self._lock:
+                broken_routines = [self._random.random() < self.failure_rate for _ in payload['routines']]
+            code = '\n'.join(PYTHON_MARKER.format(NUMBER=i + 1, NAME=routine_name(routine)) + '\n' +
+                             self._translate(routine, broken_routine)
+                             for i, (routine, broken_routine) in enumerate(zip(payload['routines'], broken_routines)))
+        elif payload.get('repair'):
+            # The code to fix is in place of the original code, remove the broken line
+            code = payload['original_code'].replace('    result = = None\n', '')
+        else:
+            code = self._translate(payload['original_code'], broken)
+        generated = self._generated_length(code, converted_code)
+        chunk = code[generated:][:payload['max_new_tokens'] * self.CHARS_PER_TOKEN]
+        complete = generated + len(chunk) == len(code)
+        output_tokens = len(chunk) // self.CHARS_PER_TOKEN
+        latency = self.latency * noise
+        if self.tokens_per_second:
+            latency += output_tokens / self.tokens_per_second
+        time.sleep(latency)
+        return {'text': chunk,
+                'stop_reason': 'end_turn' if complete else 'max_tokens',
+                'usage': {'input_tokens': self._estimate_tokens(payload), 'output_tokens': output_tokens}}
+
+    def _output_tokens(self, response) -> int | None:
+        """
+        Return the number of output tokens generated by the FM for the given response
+        """
+        return response['usage']['output_tokens']
+
+    def _input_tokens(self, response) -> int | None:
+        """
+        Return the number of input tokens processed by the FM for the given response
+        """
+        return response['usage']['input_tokens']
+
+    def _stop_reason(self, response) -> str | None:
+        """
+        Return the reason why the FM stopped generating the given response
+        """
+        return response['stop_reason']
+
+    def _extract_code(self, response: dict, payload: dict) -> (str, bool):
+        """
+        Extract the converted code from the FM response, appending it to the code converted so far
+        """
+        return payload['converted_code'] + response['text'], response['stop_reason'] == 'end_turn'
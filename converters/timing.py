@@ -0,0 +1,55 @@
+import math
+import threading
+from collections import defaultdict
+from converters.tracing import RecordingTracer, Span
+
+
+def percentile(values: list[float], quantile: float) -> float | None:
+    """
+    Return the given quantile of the values (nearest-rank method), or `None` if there are no values
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(quantile * len(values)) - 1, 0)]
+
+
+class StageTimer(RecordingTracer):
+    """
+    Tracer collecting the time spent in each stage of the conversion pipeline, used for benchmarking
+
+    The duration of every span is kept by span name (so percentiles can be computed afterwards), and the
+    number of spans of a stage can be used as a counter (e.g. the number of seeds or chunks).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations: dict[str, list[float]] = defaultdict(list)
+
+    def _export(self, span: Span) -> None:
+        """
+        Record the duration of the span
+        """
+        self.add(span.name, span.duration)
+
+    def add(self, name: str, duration: float) -> None:
+        """
+        Record a run of the given stage
+        """
+        with self._lock:
+            self.durations[name].append(duration)
+
+    def summary(self) -> dict:
+        """
+        Return the number of runs, the total time and the latency percentiles of each stage
+        """
+        with self._lock:
+            durations = {name: list(values) for name, values in self.durations.items()}
+        return {name: {'count': len(values),
+                       'total': sum(values),
+                       'mean': sum(values) / len(values),
+                       'p50': percentile(values, 0.5),
+                       'p95': percentile(values, 0.95),
+                       'p99': percentile(values, 0.99),
+                       'max': max(values)}
+                for name, values in durations.items()}
@@ -0,0 +1,206 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from pathlib import Path
+from contextlib import contextmanager
+
+# Span in which the running code is, used as the parent of the spans started by it
+_current_span: contextvars.ContextVar = contextvars.ContextVar('current_span', default=None)
+
+
+class Span:
+    """
+    Timed operation of the conversion process, with attributes describing it (routine, model, seed...)
+    """
+
+    def __init__(self, name: str, trace_id: str, span_id: str, parent_id: str | None = None,
+                 attributes: dict | None = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        # Start and end times, in nanoseconds since the epoch
+        self.start_time = time.time_ns()
+        self.end_time: int | None = None
+        self.error: str | None = None
+
+    def set_attribute(self, key: str, value) -> None:
+        """
+        Set an attribute of the span
+        """
+        self.attributes[key] = value
+
+    @property
+    def duration(self) -> float | None:
+        """
+        Duration of the span in seconds, once it has ended
+        """
+        return (self.end_time - self.start_time) / 1e9 if self.end_time is not None else None
+
+
+class _NoopSpan(Span):
+    """
+    Span returned by the no-op tracer, which ignores its attributes
+    """
+
+    def __init__(self):
+        super().__init__('', '', '')
+
+    def set_attribute(self, key: str, value) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Tracer:
+    """
+    Tracer producing spans for the stages of the conversion process
+
+    This base tracer does nothing, so tracing has no cost unless a tracer is set. Derived classes (see
+    `RecordingTracer`) keep track of the parent of each span and export the spans once they end.
+    """
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Trace the code run inside the context as a span with the given name and attributes
+
+        Parameters
+        ----------
+        name : Name of the stage traced by the span
+        attributes : Attributes of the span (e.g. `routine`, `model`, `seed`, `chunk`)
+
+        Returns
+        -------
+        Context manager yielding the span, whose attributes can be updated while it's open
+        """
+        yield _NOOP_SPAN
+
+    def close(self) -> None:
+        """
+        Export the spans that are still pending
+        """
+
+
+class RecordingTracer(Tracer):
+    """
+    Tracer creating actual spans, nested under the span open in the current context (thread or task)
+    """
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """
+        Trace the code run inside the context as a span with the given name and attributes, see `Tracer.span`
+        """
+        parent = _current_span.get()
+        span = Span(name,
+                    trace_id=parent.trace_id if parent is not None else os.urandom(16).hex(),
+                    span_id=os.urandom(8).hex(),
+                    parent_id=parent.span_id if parent is not None else None,
+                    attributes=attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            span.end_time = time.time_ns()
+            try:
+                _current_span.reset(token)
+            except ValueError:
+                # The span was ended in another context (e.g. by a generator resumed in another task)
+                _current_span.set(parent)
+            self._export(span)
+
+    def _export(self, span: Span) -> None:
+        """
+        Export a span that has just ended
+        """
+        raise NotImplementedError('This method must be implemented by derived classes')
+
+
+class FileTracer(RecordingTracer):
+    """
+    Tracer writing the spans to a local file, in the OpenTelemetry protocol (OTLP) JSON format
+
+    Each line of the file is an OTLP `ExportTraceServiceRequest`, like the ones written by the OpenTelemetry
+    Collector's file exporter, so the traces can be loaded by the collector (or any OTLP-compatible tool).
+    Spans are written in batches, and as soon as a root span (e.g. a whole file) ends. Several processes can
+    write to the same file.
+    """
+    BATCH_SIZE = 256
+    SCOPE_NAME = 'converters'
+
+    def __init__(self, path: Path, service_name: str = 'plsql-to-python'):
+        """
+        Create the tracer
+
+        Parameters
+        ----------
+        path : File where the spans are appended
+        service_name : Name of the service in the resource of the spans
+        """
+        path.parent.mkdir(exist_ok=True, parents=True)
+        self.path = path
+        self.service_name = service_name
+        self._spans: list[dict] = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _attribute(key: str, value) -> dict:
+        """
+        Convert an attribute to its OTLP representation
+        """
+        if isinstance(value, bool):
+            return {'key': key, 'value': {'boolValue': value}}
+        elif isinstance(value, int):
+            return {'key': key, 'value': {'intValue': str(value)}}
+        elif isinstance(value, float):
+            return {'key': key, 'value': {'doubleValue': value}}
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+    def _export(self, span: Span) -> None:
+        """
+        Add the span to the current batch, writing it if it's complete or if the span is a root span
+        """
+        otlp_span = {'traceId': span.trace_id,
+                     'spanId': span.span_id,
+                     'parentSpanId': span.parent_id or '',
+                     'name': span.name,
+                     # SPAN_KIND_INTERNAL
+                     'kind': 1,
+                     'startTimeUnixNano': str(span.start_time),
+                     'endTimeUnixNano': str(span.end_time),
+                     'attributes': [self._attribute(key, value) for key, value in span.attributes.items()],
+                     # STATUS_CODE_ERROR / STATUS_CODE_UNSET
+                     'status': {'code': 2, 'message': span.error} if span.error else {}}
+        with self._lock:
+            self._spans.append(otlp_span)
+            if len(self._spans) >= self.BATCH_SIZE or span.parent_id is None:
+                self._flush()
+
+    def _flush(self) -> None:
+        """
+        Write the pending spans to the file, as a single line
+        """
+        if not self._spans:
+            return
+        request = {'resourceSpans': [{
+            'resource': {'attributes': [self._attribute('service.name', self.service_name),
+                                        self._attribute('process.pid', os.getpid())]},
+            'scopeSpans': [{'scope': {'name': self.SCOPE_NAME}, 'spans': self._spans}]}]}
+        with self.path.open('at') as traces:
+            traces.write(json.dumps(request) + '\n')
+        self._spans = []
+
+    def close(self) -> None:
+        """
+        Write the spans that are still pending
+        """
+        with self._lock:
+            self._flush()
@@ -0,0 +1,49 @@
+import io
+import tokenize
+
+
+def is_viable_prefix(code: str) -> bool:
+    """
+    Check whether the given partial code can still be the beginning of a valid Python program
+
+    The code is checked with Python's own tokenizer and parser. Only the complete logical lines are
+    taken into account, and errors caused by the code ending abruptly (e.g. a block statement without a
+    body yet, an open bracket or an unterminated multi-line string) are accepted, so a `False` result
+    means that the code is already broken and no continuation can fix it.
+
+    Parameters
+    ----------
+    code : Partial code, as generated so far by the FM
+
+    Returns
+    -------
+    Whether the code might still become valid once it's complete
+    """
+    # The last line might still be incomplete
+    lines = code.splitlines(keepends=True)
+    if lines and not lines[-1].endswith('\n'):
+        lines.pop()
+    complete_lines = 0
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(''.join(lines)).readline):
+            if token.type == tokenize.NEWLINE:
+                complete_lines = token.end[0]
+    except tokenize.TokenError:
+        # The code ends inside an open bracket or string, only the logical lines before it can be checked
+        pass
+    except SyntaxError:
+        # Indentation errors in complete lines are raised by the tokenizer
+        return False
+
+    try:
+        compile(''.join(lines[:complete_lines]), filename='<string>', mode='exec')
+    except SyntaxError as e:
+        if e.lineno is None or e.lineno > complete_lines:
+            return True
+        elif e.lineno < complete_lines:
+            return False
+        # Errors caused by the end of the input (e.g. a block without a body) point past the end of the last line
+        return not e.offset or e.offset > len(lines[complete_lines - 1].rstrip('\r\n'))
+    except ValueError:
+        return False
+    return True
@@ -0,0 +1,187 @@
+import io
+import re
+import tokenize
+from converters.exceptions import ConversionError
+
+# Comment standing for the lines of the converted code left out of a continuation window
+OMITTED_MARKER = '# ...'
+# Body standing for the omitted body of the statement a branch of the outline belongs to (e.g. the `if` of an `else`)
+OMITTED_BODY = f'... {OMITTED_MARKER}'
+DEFINITION_PATTERN = re.compile(r'\s*(?:async\s+)?(?:def|class)\s+([A-Za-z_]\w*)')
+ASSIGNMENT_PATTERN = re.compile(r'\s*([A-Za-z_]\w*(?:\s*,\s*[A-Za-z_]\w*)*)\s*(?::[^=]+)?(?:[-+*/%|&]|//)?=(?!=)')
+FOR_PATTERN = re.compile(r'\s*(?:async\s+)?for\s+([A-Za-z_]\w*(?:\s*,\s*[A-Za-z_]\w*)*)\s+in\b')
+IMPORT_PATTERN = re.compile(r'\s*(?:from\s+\S+\s+)?import\s+(.+)')
+# Headers of the branches that can't go without the statement they belong to
+BRANCH_PATTERN = re.compile(r'\s*(?:elif|else|except|finally)\b')
+
+
+def _statement_starts(lines: list[str]) -> set[int]:
+    """
+    Return the indexes of the lines starting a logical line (i.e. not continuing a statement from previous lines)
+    """
+    starts, depth = {0}, 0
+    try:
+        for token in tokenize.generate_tokens(io.StringIO(''.join(lines)).readline):
+            if token.type == tokenize.OP and token.string in ('(', '[', '{'):
+                depth += 1
+            elif token.type == tokenize.OP and token.string in (')', ']', '}'):
+                depth -= 1
+            elif token.type == tokenize.NEWLINE or token.type == tokenize.NL and depth == 0:
+                # The line after the end of a statement (or after a blank line / comment) starts a new one
+                starts.add(token.end[0])
+    except (tokenize.TokenError, SyntaxError):
+        # The code is partial, the lines after the error are not taken into account
+        pass
+    return starts
+
+
+def _indentation(line: str) -> int:
+    """
+    Return the indentation of a line
+    """
+    return len(line) - len(line.lstrip())
+
+
+def _is_code(line: str) -> bool:
+    """
+    Return whether a line contains code (i.e. it's neither blank nor a comment)
+    """
+    return bool(line.strip()) and not line.lstrip().startswith('#')
+
+
+def _header(line: str) -> bool:
+    """
+    Return whether a line is the (whole) header of a block
+    """
+    return _is_code(line) and line.split('#')[0].rstrip().endswith(':')
+
+
+def _opener(lines: list[str], starts: set[int], branch: int) -> int | None:
+    """
+    Return the index of the header of the statement (e.g. `if` or `try`) the given branch (e.g. `else` or `except`)
+    belongs to, if found
+    """
+    indentation = _indentation(lines[branch])
+    for i in range(branch - 1, -1, -1):
+        if i not in starts or not _is_code(lines[i]) or _indentation(lines[i]) > indentation:
+            continue
+        if _indentation(lines[i]) < indentation:
+            return None
+        if not BRANCH_PATTERN.match(lines[i]):
+            return i if _header(lines[i]) else None
+    return None
+
+
+def _defined_names(lines: list[str]) -> list[str]:
+    """
+    Return the names defined (functions, classes, variables, loop variables and imports) in the given lines
+    """
+    names = {}
+    for line in lines:
+        if match := DEFINITION_PATTERN.match(line):
+            found = [match.group(1)]
+        elif match := FOR_PATTERN.match(line) or ASSIGNMENT_PATTERN.match(line):
+            found = match.group(1).split(',')
+        elif match := IMPORT_PATTERN.match(line):
+            found = [name.split(' as ')[-1].split('.')[0] for name in match.group(1).strip('()').split(',')]
+        else:
+            continue
+        names.update(dict.fromkeys(name.strip() for name in found if name.strip().isidentifier()))
+    return list(names)
+
+
+def continuation_window(code: str, tail_lines: int) -> str:
+    """
+    Return a compact version of the code converted so far, to be continued by the FM
+
+    The window contains an outline of the code (the number of lines left out, the names defined in them and the
+    headers of the blocks that are still open, e.g. the function and loops the code is in, preceded by the
+    statement their branches belong to, e.g. the `try` of an `except`) followed by the last `tail_lines` lines of
+    the code, so the size of the continuation requests doesn't grow with the code. The window is valid code.
+    The code continuing the window can be put back together with `stitch`.
+
+    Parameters
+    ----------
+    code : Code converted so far
+    tail_lines : Number of lines of the code kept as they are
+
+    Returns
+    -------
+    The window, or the code itself if it's not longer than the window would be
+    """
+    lines = code.splitlines(keepends=True)
+    if len(lines) <= tail_lines:
+        return code
+    # The tail starts with a statement, not in the middle of one
+    starts = _statement_starts(lines)
+    first = min((i for i in starts if len(lines) - tail_lines <= i < len(lines)), default=None)
+    if first is None:
+        first = max((i for i in starts if i < len(lines) - tail_lines), default=0)
+    if first == 0:
+        return code
+    head, tail = lines[:first], lines[first:]
+
+    # Headers of the blocks the tail is in, from the outermost one
+    first_code = next((i for i in range(first, len(lines)) if _is_code(lines[i])), None)
+    indentation = _indentation(lines[first_code]) if first_code is not None else 0
+    headers = []
+    for i in range(len(head) - 1, -1, -1):
+        if indentation == 0:
+            break
+        if i in starts and _indentation(head[i]) < indentation and _header(head[i]):
+            headers.insert(0, i)
+            indentation = _indentation(head[i])
+    # Branches (in the headers, or starting the tail) are only valid after the statement they belong to, which is
+    # added with an omitted body, e.g. the `try` of an `except`
+    openers = set()
+    for branch in headers + ([first_code] if first_code is not None else []):
+        if BRANCH_PATTERN.match(lines[branch]) and (opener := _opener(lines, starts, branch)) is not None:
+            openers.add(opener)
+    blocks = sorted(set(headers) | openers)
+
+    names = _defined_names(head)
+    outline = [f'{OMITTED_MARKER} {len(head)} lines omitted' +
+               (f', defining {", ".join(names)}' if names else '') + '\n']
+    for k, i in enumerate(blocks):
+        outline.append(lines[i] if lines[i].endswith('\n') else lines[i] + '\n')
+        if i in openers:
+            body = next((line for line in lines[i + 1:]
+                         if _is_code(line) and _indentation(line) > _indentation(lines[i])), '')
+            outline.append(' ' * _indentation(body) + OMITTED_BODY + '\n')
+            continue
+        body = lines[blocks[k + 1]] if k + 1 < len(blocks) else lines[first_code] if first_code is not None else ''
+        outline.append(' ' * _indentation(body) + OMITTED_MARKER + '\n')
+    window = ''.join(outline + tail)
+    return window if len(window) < len(code) else code
+
+
+def window_tail(window: str) -> str:
+    """
+    Return the lines of a continuation window that are kept as they are (i.e. the code after the outline)
+    """
+    lines = window.splitlines(keepends=True)
+    outline = max((i for i, line in enumerate(lines)
+                   if line.strip().startswith(OMITTED_MARKER) or line.strip() == OMITTED_BODY), default=-1)
+    return ''.join(lines[outline + 1:])
+
+
+def stitch(code: str, window: str, continued: str) -> str:
+    """
+    Put back together the code converted so far and its continuation
+
+    Parameters
+    ----------
+    code : Code converted so far
+    window : Continuation window sent to the FM (see `continuation_window`)
+    continued : Code extracted from the FM response, i.e. the window followed by the newly generated code
+
+    Returns
+    -------
+    The whole code converted so far
+    """
+    # The window might have been stripped when sent to the FM or when extracting the code
+    body = window.strip()
+    start = continued.find(body)
+    if start < 0 or start > len(window) - len(window.lstrip()):
+        raise ConversionError('The generated code does not continue the code sent to the FM')
+    return code.rstrip() + continued[start + len(body):]
@@ -0,0 +1,30 @@
+from converters.splitter import find_routines
+
+CONDITIONAL_COMPILATION_SOURCE = b'''CREATE OR REPLACE PACKAGE BODY versions AS
+PROCEDURE set_value IS
+BEGIN
+  $IF DBMS_DB_VERSION.VER_LE_11 $THEN
+    value := 1;
+  $ELSIF $$PLSQL_OPTIMIZE_LEVEL > 1 $THEN
+    value := 2;
+  $ELSE
+    $ERROR 'Unsupported version ' || $$PLSQL_UNIT $END
+  $END
+  COMMIT;
+END set_value;
+
+PROCEDURE reset_value IS
+BEGIN
+  value := 0;
+END reset_value;
+END versions;
+'''
+
+
+def test_conditional_compilation_directives_do_not_change_the_block_depth():
+    routines = list(find_routines(CONDITIONAL_COMPILATION_SOURCE))
+
+    assert [routine.name for routine in routines] == ['set_value', 'reset_value']
+    first = CONDITIONAL_COMPILATION_SOURCE[routines[0].start:routines[0].end]
+    assert first.startswith(b'PROCEDURE set_value IS')
+    assert first.endswith(b'COMMIT;\nEND set_value;')
@@ -0,0 +1,47 @@
+from converters.validation import is_viable_prefix
+from converters.window import continuation_window, stitch, window_tail
+
+CONVERTED_CODE = '''import logging
+
+
+def convert_rows(rows, threshold, penalty, bonus):
+    total = 0
+    skipped = 0
+    rejected = []
+    accepted = []
+    logging.info(f'Converting {len(rows)} rows')
+    for row in rows:
+        try:
+            value = int(row)
+            if value > threshold:
+                total -= penalty
+                rejected.append(row)
+            else:
+                total += value
+                total += bonus
+                accepted.append(row)
+        except ValueError:
+            logging.warning(f'Skipping {row}')
+            skipped += 1
+'''
+CONTINUATION = '    return total, skipped, accepted, rejected\n'
+
+
+def _assert_valid_window(window: str, tail: str):
+    assert window_tail(window) == tail
+    assert is_viable_prefix(window)
+    assert stitch(CONVERTED_CODE, window, window + CONTINUATION) == CONVERTED_CODE + CONTINUATION
+
+
+def test_window_with_the_tail_in_an_else_branch_is_valid_code():
+    window = continuation_window(CONVERTED_CODE, 6)
+
+    assert '            if value > threshold:\n' in window
+    _assert_valid_window(window, '\n'.join(CONVERTED_CODE.splitlines()[-6:]) + '\n')
+
+
+def test_window_with_the_tail_starting_with_an_except_branch_is_valid_code():
+    window = continuation_window(CONVERTED_CODE, 3)
+
+    assert '        try:\n' in window
+    _assert_valid_window(window, '\n'.join(CONVERTED_CODE.splitlines()[-3:]) + '\n')